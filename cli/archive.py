@@ -0,0 +1,264 @@
+import argparse
+import gzip
+import json
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs
+
+from fetcher import parse_log_key
+from logparser import field_key, parse_stream
+from rollup import HIT_RESULT_TYPES
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("date", pa.string()), ("hour", pa.int8()), ("distribution", pa.string())]),
+    flavor="hive",
+)
+COMPACTED_MANIFEST = "_compacted.json"
+# Parts are written here and moved into the archive once complete. Dataset
+# discovery skips names starting with '.', so queries never see a partial part.
+STAGING_PREFIX = ".staging-"
+
+
+def load_log_file(path):
+    """
+    Parses one downloaded `.gz` log file into an Arrow table with OpenSearch-style
+    column names plus the 'date'/'hour'/'distribution' partition columns.
+    """
+    parts = parse_log_key(os.path.basename(path), prefix="")
+    distribution = parts[0] if parts else "unknown"
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        tables = [batch.to_arrow() for batch in parse_stream(f)]
+    if not tables:
+        return None
+    table = pa.concat_tables(tables)
+    table = table.rename_columns([name if name == "timestamp" else field_key(name)
+                                  for name in table.column_names])
+    table = table.drop_columns([c for c in ("time",) if c in table.column_names])
+    hours = pc.hour(table["timestamp"]).cast(pa.int8())
+    return (table.append_column("hour", hours)
+                 .append_column("distribution", pa.array([distribution] * len(table), pa.string())))
+
+
+def find_log_files(src_dir):
+    """
+    Returns the fetched `.gz` log files under `src_dir`, sorted by path.
+    """
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(src_dir)
+                  for name in names if name.endswith(".gz"))
+
+
+def load_log_dir(src_dir, columns=None):
+    """
+    Parses every log file under `src_dir` into one Arrow table (optionally only `columns`).
+    """
+    tables = [t if columns is None else t.select(columns)
+              for t in map(load_log_file, find_log_files(src_dir)) if t is not None]
+    if not tables:
+        raise Exception(f"No CloudFront logs found under {src_dir}")
+    return pa.concat_tables(tables)
+
+
+def _load_manifest(archive_dir):
+    path = os.path.join(archive_dir, COMPACTED_MANIFEST)
+    if os.path.exists(path):
+        with open(path) as f:
+            return set(json.load(f))
+    return set()
+
+
+def _save_manifest(archive_dir, compacted):
+    path = os.path.join(archive_dir, COMPACTED_MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(sorted(compacted), f)
+    os.replace(path + ".tmp", path)
+
+
+def compact(src_dir, archive_dir, workers=None, rows_per_file=2_000_000, row_group_size=128 * 1024):
+    """
+    Compacts fetched log files into a Parquet archive partitioned by date/hour/distribution.
+
+    Rows are sorted by timestamp before writing, so the per-row-group min/max
+    statistics Parquet records let time-range queries skip whole row groups.
+    Files already compacted (tracked in `_compacted.json`) are skipped. Each
+    part is written to a staging directory, moved into the archive and then
+    recorded in the manifest, so an interrupted run leaves no rows behind that a
+    rerun would write a second time.
+
+    Returns:
+        int: Number of rows written.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    for name in os.listdir(archive_dir):
+        if name.startswith(STAGING_PREFIX):
+            shutil.rmtree(os.path.join(archive_dir, name), ignore_errors=True)
+    compacted = _load_manifest(archive_dir)
+    paths = [path for path in find_log_files(src_dir) if path not in compacted]
+    if not paths:
+        print("Nothing new to compact.")
+        return 0
+
+    write_options = ds.ParquetFileFormat().make_write_options(compression="zstd")
+    run_id = uuid.uuid4().hex[:12]
+    pending, pending_paths, pending_rows, written, part = [], [], 0, 0, 0
+
+    def write(tables, sources):
+        nonlocal written, part
+        if tables:
+            table = pa.concat_tables(tables).sort_by("timestamp")
+            staging = os.path.join(archive_dir, f"{STAGING_PREFIX}{run_id}-{part}")
+            ds.write_dataset(
+                table, staging, format="parquet", partitioning=PARTITIONING,
+                basename_template=f"part-{run_id}-{part}-{{i}}.parquet",
+                file_options=write_options, max_rows_per_group=row_group_size,
+                min_rows_per_group=min(row_group_size, len(table)), use_threads=True,
+            )
+            for root, _, names in os.walk(staging):
+                for name in names:
+                    target = os.path.join(archive_dir, os.path.relpath(os.path.join(root, name), staging))
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(os.path.join(root, name), target)
+            shutil.rmtree(staging)
+            written += len(table)
+            part += 1
+        compacted.update(sources)
+        _save_manifest(archive_dir, compacted)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for path, table in zip(paths, executor.map(load_log_file, paths)):
+            if table is not None:
+                pending.append(table)
+                pending_rows += len(table)
+            pending_paths.append(path)
+            if pending_rows >= rows_per_file:
+                write(pending, pending_paths)
+                pending, pending_paths, pending_rows = [], [], 0
+        if pending_paths:
+            write(pending, pending_paths)
+
+    print(f"Compacted {len(paths)} log files ({written} rows) into {archive_dir}")
+    return written
+
+
+def open_archive(archive_dir):
+    """
+    Opens the archive as a memory-mapped Arrow dataset.
+    """
+    filesystem = pyarrow.fs.LocalFileSystem(use_mmap=True)
+    return ds.dataset(archive_dir, format="parquet", partitioning=PARTITIONING,
+                      filesystem=filesystem, exclude_invalid_files=True)
+
+
+def time_filter(start=None, end=None, distribution=None):
+    """
+    Builds a filter expression for [start, end) and an optional distribution.
+
+    The 'date' and 'distribution' terms prune whole partition directories; the
+    'timestamp' terms prune row groups through their min/max statistics.
+    """
+    expr = None
+
+    def both(a, b):
+        return b if a is None else a & b
+
+    if start is not None:
+        expr = both(expr, ds.field("date") >= start.strftime("%Y-%m-%d"))
+        expr = both(expr, ds.field("timestamp") >= pa.scalar(start, pa.timestamp("s", tz="UTC")))
+    if end is not None:
+        expr = both(expr, ds.field("date") <= end.strftime("%Y-%m-%d"))
+        expr = both(expr, ds.field("timestamp") < pa.scalar(end, pa.timestamp("s", tz="UTC")))
+    if distribution:
+        expr = both(expr, ds.field("distribution") == distribution)
+    return expr
+
+
+def scan(dataset, columns, start=None, end=None, distribution=None, where=None):
+    """
+    Reads only `columns` of the rows matching the time range (and `where`), on all cores.
+    """
+    expr = time_filter(start, end, distribution)
+    if where is not None:
+        expr = where if expr is None else expr & where
+    return dataset.to_table(columns=columns, filter=expr, use_threads=True)
+
+
+def top_uris(dataset, k=10, **window):
+    table = scan(dataset, ["cs_uri_stem"], **window)
+    counts = table.group_by("cs_uri_stem").aggregate([("cs_uri_stem", "count")])
+    return counts.sort_by([("cs_uri_stem_count", "descending")]).slice(0, k).to_pylist()
+
+
+def hit_ratio(dataset, **window):
+    table = scan(dataset, ["x_edge_result_type"], **window)
+    total = len(table)
+    hits = pc.sum(pc.is_in(table["x_edge_result_type"], pa.array(HIT_RESULT_TYPES))).as_py() or 0
+    return {"requests": total, "hits": hits, "hit_ratio": round(hits / total, 4) if total else None}
+
+
+def time_taken_percentile(dataset, q=0.95, **window):
+    table = scan(dataset, ["time_taken"], **window)
+    if not len(table):
+        return None
+    return pc.quantile(table["time_taken"], q=q, skip_nulls=True)[0].as_py()
+
+
+def errors_by_edge(dataset, **window):
+    table = scan(dataset, ["x_edge_location"], where=ds.field("sc_status") >= 500, **window)
+    counts = table.group_by("x_edge_location").aggregate([("x_edge_location", "count")])
+    return counts.sort_by([("x_edge_location_count", "descending")]).to_pylist()
+
+
+QUERIES = {
+    "top-uris": top_uris,
+    "hit-ratio": hit_ratio,
+    "p95-time-taken": lambda dataset, **window: time_taken_percentile(dataset, 0.95, **window),
+    "5xx-by-edge": errors_by_edge,
+}
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local Parquet archive of CloudFront logs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("compact", help="Compact fetched .gz logs into the archive")
+    p.add_argument("--src", default="logs", help="Directory of fetched logs (see fetcher.py)")
+    p.add_argument("--archive", default="archive", help="Archive directory")
+    p.add_argument("--workers", type=int, help="Parallel file parsers (default: all cores)")
+
+    p = sub.add_parser("query", help="Run a canned query against the archive")
+    p.add_argument("query", choices=sorted(QUERIES))
+    p.add_argument("--archive", default="archive", help="Archive directory")
+    p.add_argument("--start", help="Inclusive start time, e.g. 2024-01-31T00:00")
+    p.add_argument("--end", help="Exclusive end time")
+    p.add_argument("--distribution", help="Restrict to one distribution id")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "compact":
+        compact(args.src, args.archive, workers=args.workers)
+        return
+
+    dataset = open_archive(args.archive)
+    result = QUERIES[args.query](dataset, start=_parse_time(args.start), end=_parse_time(args.end),
+                                 distribution=args.distribution)
+    print(json.dumps(result, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
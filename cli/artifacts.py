@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+import io
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+
+from scp import SCPClient
+
+from ssh import execute, run_script
+from tracing import span
+
+# Where provisioning state lives on a host.
+STATE_DIR = "/home/ubuntu/.cloudfront-setup"
+
+
+class Artifact:
+    """A file to place on a host, identified by the SHA-256 of its contents."""
+
+    def __init__(self, remote_path, data, mode="0644"):
+        self.remote_path = remote_path
+        self.data = data
+        self.mode = mode
+        self.sha256 = hashlib.sha256(data).hexdigest()
+
+    @classmethod
+    def from_file(cls, local_path, remote_path, mode="0644"):
+        with open(local_path, "rb") as f:
+            return cls(remote_path, f.read(), mode)
+
+    @classmethod
+    def from_text(cls, text, remote_path, mode="0644"):
+        return cls(remote_path, text.encode("utf-8"), mode)
+
+
+def remote_manifest(ssh_client, paths):
+    """
+    Hashes the given files on the host in one round trip.
+
+    Returns:
+        dict: Remote path -> SHA-256 for every path that exists.
+    """
+    command = "sha256sum -- " + " ".join(shlex.quote(path) for path in paths) + " 2>/dev/null; true"
+    _, out, _ = execute(ssh_client, command)
+    manifest = {}
+    for line in out.splitlines():
+        digest, _, path = line.partition("  ")
+        if len(digest) == 64 and path:
+            manifest[path] = digest
+    return manifest
+
+
+def _staging_path(artifact):
+    return f"/tmp/cloudfront-setup-{artifact.sha256[:16]}.gz"
+
+
+def sync_artifacts(ssh_client, artifacts, label="", max_parallel=4):
+    """
+    Uploads only the artifacts whose remote copy is missing or differs.
+
+    Remote files are hashed in one command and compared with the local hashes.
+    Changed files are gzip-compressed and uploaded concurrently, each over its own
+    SCP channel of the shared transport. One script then decompresses them,
+    checks their hashes and moves them into place atomically.
+
+    Args:
+        ssh_client (paramiko.SSHClient): The active SSH client.
+        artifacts (list[Artifact]): Files to place.
+        label (str): Prefix for messages, e.g. the host name.
+        max_parallel (int): Concurrent uploads.
+
+    Returns:
+        list[Artifact]: The artifacts that were uploaded.
+    """
+    prefix = f"[{label}] " if label else ""
+    with span("artifacts.sync", files=len(artifacts)) as sync_span:
+        manifest = remote_manifest(ssh_client, [artifact.remote_path for artifact in artifacts])
+        changed = [artifact for artifact in artifacts if manifest.get(artifact.remote_path) != artifact.sha256]
+        sync_span.attrs["changed"] = len(changed)
+        if not changed:
+            print(f"{prefix}All {len(artifacts)} artifacts up to date; nothing uploaded.")
+            return []
+
+        payloads = {artifact.remote_path: gzip.compress(artifact.data, 6) for artifact in changed}
+
+        def upload(artifact):
+            with SCPClient(ssh_client.get_transport()) as scp:
+                scp.putfo(io.BytesIO(payloads[artifact.remote_path]), _staging_path(artifact))
+
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            list(executor.map(upload, changed))
+
+        commands = []
+        for artifact in changed:
+            dest = shlex.quote(artifact.remote_path)
+            tmp = shlex.quote(artifact.remote_path + ".tmp")
+            commands.append(
+                f"mkdir -p \"$(dirname {dest})\" && gunzip -c {_staging_path(artifact)} > {tmp} && "
+                f"echo '{artifact.sha256}  {artifact.remote_path}.tmp' | sha256sum -c --quiet && "
+                f"chmod {artifact.mode} {tmp} && mv {tmp} {dest} && rm -f {_staging_path(artifact)}")
+        run_script(ssh_client, commands, label=label, echo=False)
+
+    raw = sum(len(artifact.data) for artifact in changed)
+    compressed = sum(len(payload) for payload in payloads.values())
+    print(f"{prefix}Uploaded {len(changed)}/{len(artifacts)} artifacts "
+          f"({', '.join(a.remote_path for a in changed)}): {raw:,} bytes as {compressed:,} compressed.")
+    return changed
@@ -0,0 +1,166 @@
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+
+# DescribeInstances accepts many ids per call; larger batches only make pages.
+DESCRIBE_BATCH = 200
+
+
+class ClientRegistry:
+    """
+    One boto3 session per region and one client per (service, region), shared by
+    every caller and thread for the life of the process.
+
+    Creating a client loads and parses the service model, which costs more than
+    most API calls; boto3 clients are thread-safe once created, so only creation
+    is serialised. Clients use botocore's adaptive retry mode, which backs off on
+    throttling errors and rate-limits the client afterwards, so parallel callers
+    slow down together instead of failing.
+    """
+
+    def __init__(self, max_pool_connections=32, max_attempts=10):
+        self.config = Config(max_pool_connections=max_pool_connections,
+                             retries={"mode": "adaptive", "max_attempts": max_attempts})
+        self._sessions = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def session(self, region=None):
+        with self._lock:
+            if region not in self._sessions:
+                self._sessions[region] = boto3.Session(region_name=region)
+            return self._sessions[region]
+
+    def client(self, service, region=None):
+        key = (service, region)
+        client = self._clients.get(key)
+        if client is None:
+            session = self.session(region)
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._clients[key] = session.client(service, config=self.config)
+        return client
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._clients.clear()
+
+
+class TTLCache:
+    """
+    A thread-safe cache of describe results that expire after `ttl` seconds.
+    """
+
+    def __init__(self, ttl=60.0):
+        self.ttl = ttl
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic():
+                return None
+            return item[1]
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._items[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        return value
+
+    def get_or_load(self, key, load, ttl=None):
+        value = self.get(key)
+        return value if value is not None else self.put(key, load(), ttl)
+
+    def invalidate(self, predicate=None):
+        """
+        Drops every entry, or those whose key satisfies `predicate`.
+        """
+        with self._lock:
+            for key in [key for key in self._items if predicate is None or predicate(key)]:
+                del self._items[key]
+
+
+clients = ClientRegistry()
+describe_cache = TTLCache()
+
+
+def describe_instances(region, instance_ids, refresh=False):
+    """
+    Describes instances in batches of `DESCRIBE_BATCH` ids per call, answering
+    ids described within the cache TTL from the cache.
+
+    Args:
+        region (str): The AWS region of the instances.
+        instance_ids (list): EC2 instance IDs.
+        refresh (bool): Describe every id again, e.g. right after a launch.
+
+    Returns:
+        dict: Instance ID -> instance description, for the ids that exist.
+    """
+    found = {}
+    wanted = []
+    for instance_id in dict.fromkeys(instance_ids):
+        cached = None if refresh else describe_cache.get(("ec2.instance", region, instance_id))
+        if cached is not None:
+            found[instance_id] = cached
+        else:
+            wanted.append(instance_id)
+
+    paginator = clients.client("ec2", region).get_paginator("describe_instances")
+    for start in range(0, len(wanted), DESCRIBE_BATCH):
+        batch = wanted[start:start + DESCRIBE_BATCH]
+        try:
+            pages = list(paginator.paginate(InstanceIds=batch))
+        except clients.client("ec2", region).exceptions.ClientError as e:
+            if "InvalidInstanceID" not in str(e):
+                raise
+            # One unknown id fails the whole call; a filter returns the rest.
+            pages = paginator.paginate(Filters=[{"Name": "instance-id", "Values": batch}])
+        for page in pages:
+            for reservation in page["Reservations"]:
+                found.update(remember_instances(region, reservation["Instances"]))
+    return found
+
+
+def remember_instances(region, instances):
+    """
+    Caches instances described elsewhere (e.g. by a readiness probe), so the
+    next `describe_instances` for them needs no call.
+
+    Returns:
+        dict: Instance ID -> instance description.
+    """
+    return {instance["InstanceId"]: describe_cache.put(("ec2.instance", region, instance["InstanceId"]), instance)
+            for instance in instances}
+
+
+def list_instances(region, filters=None):
+    """
+    Returns every instance of the region matching `filters`, paginated and cached.
+    """
+    key = ("ec2.instances", region, repr(filters))
+
+    def load():
+        paginator = clients.client("ec2", region).get_paginator("describe_instances")
+        instances = []
+        for page in paginator.paginate(Filters=filters or []):
+            for reservation in page["Reservations"]:
+                remember_instances(region, reservation["Instances"])
+                instances.extend(reservation["Instances"])
+        return instances
+    return describe_cache.get_or_load(key, load)
+
+
+def enabled_regions():
+    """
+    Returns the regions enabled for the account, cached for an hour.
+    """
+    return describe_cache.get_or_load(
+        ("ec2.regions",),
+        lambda: sorted(r["RegionName"] for r in clients.client("ec2", "us-east-1").describe_regions()["Regions"]),
+        ttl=3600)
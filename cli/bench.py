@@ -0,0 +1,1074 @@
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from logparser import CLOUDFRONT_FIELDS, INTEGER_FIELDS, FLOAT_FIELDS, parse_chunk, parse_stream
+from bulk import AdaptiveBatchSizer, BulkIndexer
+from dedup import DedupFilter, hash_strings
+from index_templates import backfill_settings, cloudfront_index_template
+from ingest import build_bulk_actions
+from opensearch import opensearch_request
+from rollup import HIT_RESULT_TYPES, RollupAggregator
+
+EDGES = ["IAD89-C1", "FRA56-P4", "NRT57-C2", "SIN2-C1", "LHR61-P1", "GRU3-C2"]
+PATHS = ["/", "/index.html", "/static/app.js", "/static/app.css", "/img/logo.png",
+         "/api/items", "/api/items/42", "/docs/getting-started", "/favicon.ico"]
+RESULTS = ["Hit", "Hit", "Hit", "Miss", "RefreshHit", "Error"]
+STATUSES = ["200", "200", "200", "200", "304", "404", "503"]
+
+
+def synthetic_log_lines(count, seed=0, start=1704067200, offset=0):
+    """
+    Generates realistic-looking CloudFront log lines (33 tab-separated fields).
+
+    Args:
+        count (int): Number of records to generate.
+        seed (int): Random seed so runs are comparable.
+        start (int): Epoch second of the first record; one record per ~10 ms follows.
+        offset (int): Sequence number of the first record, used for unique request ids.
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        ts = time.gmtime(start + i // 100)
+        path = rng.choice(PATHS)
+        status = rng.choice(STATUSES)
+        result = rng.choice(RESULTS)
+        size = str(rng.randint(200, 500000))
+        yield "\t".join([
+            time.strftime("%Y-%m-%d", ts), time.strftime("%H:%M:%S", ts), rng.choice(EDGES),
+            size, f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            "GET", "d111111abcdef8.cloudfront.net", path, status, "-",
+            "Mozilla/5.0%20(X11;%20Linux%20x86_64)", "-" if rng.random() < 0.8 else "v=1",
+            "-", result, f"req{offset + i:012d}AbCdEf==", "example.com", "https",
+            str(rng.randint(100, 900)), f"{rng.random() * 0.5:.3f}", "-", "TLSv1.3",
+            "TLS_AES_128_GCM_SHA256", result, "HTTP/2.0", "-", "-",
+            str(rng.randint(1024, 65535)), f"{rng.random() * 0.4:.3f}", result,
+            "text/html", size, "-", "-",
+        ])
+
+
+def write_synthetic_log(path, size_mb, seed=0):
+    """
+    Writes a synthetic log of roughly `size_mb` megabytes to `path`, streaming so
+    that multi-GB files can be produced without holding them in memory.
+
+    Returns:
+        int: Number of records written.
+    """
+    target = size_mb * 1024 * 1024
+    written = 0
+    lines = 0
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        f.write("#Version: 1.0\n#Fields: " + " ".join(CLOUDFRONT_FIELDS) + "\n")
+        while written < target:
+            block = "\n".join(synthetic_log_lines(
+                10000, seed=seed + lines, start=1704067200 + lines // 100, offset=lines)) + "\n"
+            f.write(block)
+            written += len(block)
+            lines += 10000
+    return lines
+
+
+def naive_parse(stream):
+    """
+    Baseline: split every line individually and convert typed fields per value,
+    appending into per-field lists.
+
+    Returns:
+        int: Number of records parsed.
+    """
+    columns = {name: [] for name in CLOUDFRONT_FIELDS}
+    appenders = [(name, columns[name].append) for name in CLOUDFRONT_FIELDS]
+    count = 0
+    for line in stream:
+        if line.startswith("#"):
+            continue
+        values = line.rstrip("\n").split("\t")
+        for (name, append), value in zip(appenders, values):
+            if name in INTEGER_FIELDS:
+                append(int(value) if value != "-" else -1)
+            elif name in FLOAT_FIELDS:
+                append(float(value) if value != "-" else float("nan"))
+            else:
+                append(value)
+        count += 1
+        if count % 50000 == 0:
+            columns = {name: [] for name in CLOUDFRONT_FIELDS}
+            appenders = [(name, columns[name].append) for name in CLOUDFRONT_FIELDS]
+    return count
+
+
+def columnar_parse(stream, chunk_size=4 * 1024 * 1024):
+    """
+    Candidate: parse the stream into `LogBatch` chunks, leaving string fields as
+    byte offsets. Not comparable with the naive path, which builds every string.
+
+    Returns:
+        int: Number of records parsed.
+    """
+    return sum(len(batch) for batch in parse_stream(stream, chunk_size))
+
+
+def columnar_parse_arrow(stream, chunk_size=4 * 1024 * 1024):
+    """
+    Candidate with every field materialised as a typed Arrow column, as the
+    archive writes them: the same output as the naive path, in Arrow form.
+
+    Returns:
+        int: Number of records parsed.
+    """
+    return sum(batch.to_arrow().num_rows for batch in parse_stream(stream, chunk_size))
+
+
+def columnar_parse_lists(stream, chunk_size=4 * 1024 * 1024):
+    """
+    Candidate with every field as Python lists via `LogBatch.tolists`, as ingest
+    encodes documents: the same output as the naive path.
+
+    Returns:
+        int: Number of records parsed.
+    """
+    count = 0
+    for batch in parse_stream(stream, chunk_size):
+        batch.tolists()
+        count += len(batch)
+    return count
+
+
+def _timed(label, func, path, size_bytes, mode="r"):
+    with open(path, mode) as f:
+        started = time.perf_counter()
+        count = func(f)
+        elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed else float("inf")
+    print(f"{label:<15} {count:>12,d} lines  {elapsed:8.2f} s  "
+          f"{rate:>14,.0f} lines/s  {size_bytes / elapsed / 1e6:8.1f} MB/s")
+    return rate
+
+
+def bench_parser(size_mb=2048, path=None):
+    """
+    Compares the naive per-line parser with the columnar parser on a synthetic
+    log. The headline speed-up compares equivalent output: every field of every
+    record materialised and typed (Arrow columns on the columnar side).
+
+    Returns:
+        float: Speed-up of the columnar parser with Arrow output over the naive one.
+    """
+    own_file = path is None
+    if own_file:
+        fd, path = tempfile.mkstemp(suffix=".log")
+        os.close(fd)
+    try:
+        if own_file or not os.path.exists(path):
+            print(f"Generating ~{size_mb} MB synthetic log at {path}...")
+            write_synthetic_log(path, size_mb)
+        size_bytes = os.path.getsize(path)
+        naive = _timed("naive", naive_parse, path, size_bytes)
+        arrow = _timed("columnar+arrow", columnar_parse_arrow, path, size_bytes, mode="rb")
+        lists = _timed("columnar+lists", columnar_parse_lists, path, size_bytes, mode="rb")
+        lazy = _timed("columnar lazy", columnar_parse, path, size_bytes, mode="rb")
+        speedup = arrow / naive
+        print(f"Columnar parser speed-up, equivalent output: {speedup:.1f}x with Arrow columns, "
+              f"{lists / naive:.1f}x with Python lists (target 5x). "
+              f"Lazy string fields: {lazy / naive:.1f}x, not like-for-like.")
+        return speedup
+    finally:
+        if own_file:
+            os.remove(path)
+
+
+class FakeBulkServer(ThreadingHTTPServer):
+    """
+    A local stand-in for OpenSearch's `_bulk` endpoint.
+
+    Each request costs `base_latency + per_doc_latency * docs` seconds. At most
+    `capacity` requests are served at once (like the write thread pool); excess
+    concurrent requests get every item rejected with 429, and `reject_rate` adds
+    random item-level `es_rejected_execution_exception`s on top.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, capacity=2, base_latency=0.01, per_doc_latency=0.00002, reject_rate=0.0, port=0):
+        super().__init__(("127.0.0.1", port), _FakeBulkHandler)
+        self.capacity = threading.BoundedSemaphore(capacity)
+        self.base_latency = base_latency
+        self.per_doc_latency = per_doc_latency
+        self.reject_rate = reject_rate
+        self.rng = random.Random(0)
+        self.docs = 0
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+def _serve_fake_bulk(ready, kwargs):
+    server = FakeBulkServer(**kwargs)
+    ready.put(server.endpoint)
+    server.serve_forever()
+
+
+class FakeBulkProcess:
+    """
+    Runs a `FakeBulkServer` in a child process so its JSON work does not share
+    the benchmarked client's GIL.
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.endpoint = None
+        self._process = None
+
+    def __enter__(self):
+        ready = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=_serve_fake_bulk, args=(ready, self.kwargs), daemon=True)
+        self._process.start()
+        self.endpoint = ready.get(timeout=10)
+        return self
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        self._process.join()
+
+
+class _FakeBulkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        docs = body.count(b"\n") // 2
+        server = self.server
+        if server.capacity.acquire(blocking=False):
+            try:
+                time.sleep(server.base_latency + server.per_doc_latency * docs)
+                items = []
+                with server.lock:
+                    for _ in range(docs):
+                        if server.rng.random() < server.reject_rate:
+                            items.append({"index": {"status": 429, "error": {
+                                "type": "es_rejected_execution_exception"}}})
+                        else:
+                            items.append({"index": {"status": 201}})
+                            server.docs += 1
+            finally:
+                server.capacity.release()
+        else:
+            items = [{"index": {"status": 429, "error": {"type": "es_rejected_execution_exception"}}}] * docs
+        errors = any(item["index"]["status"] != 201 for item in items)
+        payload = json.dumps({"took": 1, "errors": errors, "items": items}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def _bulk_actions(count):
+    for i, line in enumerate(synthetic_log_lines(count)):
+        yield (json.dumps({"index": {"_index": "bench", "_id": str(i)}}) + "\n"
+               + json.dumps({"line": line}) + "\n").encode("utf-8")
+
+
+def bench_bulk(docs=200000, workers=4, capacity=4, reject_rate=0.01):
+    """
+    Indexes synthetic documents into a `FakeBulkServer`, first with one worker and
+    a fixed batch size (the old sequential behaviour), then with the adaptive,
+    concurrent indexer, and prints docs/s and p99 bulk latency for both.
+    """
+    actions = list(_bulk_actions(docs))
+    runs = [
+        ("sequential", 1, AdaptiveBatchSizer(initial_docs=5000, min_docs=5000, max_docs=5000)),
+        ("adaptive", workers, AdaptiveBatchSizer(initial_docs=500, target_latency=0.25)),
+    ]
+    results = {}
+    for label, worker_count, sizer in runs:
+        with FakeBulkProcess(capacity=capacity, reject_rate=reject_rate) as server:
+            indexer = BulkIndexer(server.endpoint, workers=worker_count, sizer=sizer, backoff_base=0.05)
+            indexer.index(actions)
+            summary = indexer.close()
+        results[label] = summary
+        print(f"{label:<11} {summary['indexed']:>9,d} indexed  {summary['failed']:>6,d} failed  "
+              f"{summary['retried']:>7,d} retried  {summary['docs_per_s']:>12,.0f} docs/s  "
+              f"p99 {summary['p99_latency_s']:.3f} s  final batch {sizer.docs}")
+    return results
+
+
+def bench_rollup(size_mb=64, window_s=60):
+    """
+    Runs the rollup stage over a synthetic log and reports its throughput and how
+    many documents it emits compared with indexing every raw line.
+    """
+    fd, path = tempfile.mkstemp(suffix=".log")
+    os.close(fd)
+    try:
+        write_synthetic_log(path, size_mb)
+        aggregator = RollupAggregator(window_s=window_s)
+        lines = 0
+        emitted = 0
+        with open(path, "rb") as f:
+            started = time.perf_counter()
+            for batch in parse_stream(f):
+                lines += len(batch)
+                emitted += len(aggregator.add(batch))
+            emitted += len(aggregator.flush())
+            elapsed = time.perf_counter() - started
+    finally:
+        os.remove(path)
+    print(f"parse+rollup {lines:>12,d} lines  {elapsed:8.2f} s  {lines / elapsed:>12,.0f} lines/s")
+    print(f"documents    {lines:>12,d} raw -> {emitted:,d} rollup ({lines / max(emitted, 1):,.0f}x fewer)")
+    return lines, emitted
+
+
+def bench_dedup(size_mb=64, memory_mb=64, fp_rate=1e-3, probes=1000000):
+    """
+    Measures the request-id dedup stage: parsing with and without it, a replay of
+    the same log after reopening the filter from disk (every record must be
+    dropped), and the false-positive rate observed on ids that were never added.
+    """
+    fd, path = tempfile.mkstemp(suffix=".log")
+    os.close(fd)
+    state = tempfile.mkdtemp(prefix="dedup-")
+    try:
+        lines = write_synthetic_log(path, size_mb)
+
+        def run(dedup):
+            kept = 0
+            with open(path, "rb") as f:
+                started = time.perf_counter()
+                for batch in parse_stream(f):
+                    kept += len(dedup.filter_batch(batch) if dedup else batch)
+                return kept, time.perf_counter() - started
+
+        total, baseline = run(None)
+        with DedupFilter(state, memory_mb, fp_rate) as dedup:
+            first, with_dedup = run(dedup)
+            dedup.commit()
+            capacity = dedup.capacity
+        with DedupFilter(state) as dedup:
+            replayed, replay = run(dedup)
+            fresh = hash_strings([f"req{i:012d}AbCdEf==" for i in range(lines, lines + probes)])
+            started = time.perf_counter()
+            false_positives = int((~dedup.check_and_add(fresh)).sum())
+            check = time.perf_counter() - started
+    finally:
+        os.remove(path)
+        shutil.rmtree(state, ignore_errors=True)
+    print(f"parse          {total:>12,d} lines  {baseline:8.2f} s  {total / baseline:>12,.0f} lines/s")
+    print(f"parse+dedup    {first:>12,d} kept   {with_dedup:8.2f} s  {total / with_dedup:>12,.0f} lines/s")
+    print(f"replay         {replayed:>12,d} kept   {replay:8.2f} s  {total / replay:>12,.0f} lines/s "
+          f"(after reopening from disk)")
+    print(f"check_and_add  {probes:>12,d} ids    {check:8.2f} s  {probes / check:>12,.0f} ids/s")
+    print(f"false positives {false_positives:,d}/{probes:,d} = {false_positives / probes:.2e} "
+          f"(target {fp_rate:.0e}; {memory_mb} MB remembers {capacity:,} ids)")
+    return {"lines": total, "kept": first, "replayed": replayed, "false_positives": false_positives}
+
+
+def bench_backfill(endpoint, docs=500000, workers=4):
+    """
+    Loads the same synthetic documents into a live OpenSearch node twice, into
+    fresh index prefixes: once with steady-state settings and once inside
+    `backfill_settings`, and prints docs/s for both.
+    """
+    text = "\n".join(synthetic_log_lines(docs)) + "\n"
+    documents = list(parse_chunk(text.encode("utf-8")).iter_docs())
+    results = {}
+    for label, prefix, backfill in (("steady", "bench-steady", False), ("backfill", "bench-backfill", True)):
+        opensearch_request(endpoint, "DELETE", f"/{prefix}-*?allow_no_indices=true&expand_wildcards=all")
+        opensearch_request(endpoint, "PUT", f"/_index_template/{prefix}", cloudfront_index_template(prefix))
+        actions = build_bulk_actions(documents, prefix, granularity="hourly")
+        started = time.perf_counter()
+        if backfill:
+            with backfill_settings(endpoint, prefix):
+                indexer = BulkIndexer(endpoint, workers=workers)
+                indexer.index(actions)
+                summary = indexer.close()
+        else:
+            indexer = BulkIndexer(endpoint, workers=workers)
+            indexer.index(actions)
+            summary = indexer.close()
+            opensearch_request(endpoint, "POST", f"/{prefix}-*/_refresh")
+        elapsed = time.perf_counter() - started
+        results[label] = summary["indexed"] / elapsed
+        print(f"{label:<9} {summary['indexed']:>9,d} indexed in {elapsed:7.2f} s  "
+              f"{results[label]:>10,.0f} docs/s (incl. final refresh)  p99 {summary['p99_latency_s']:.3f} s")
+        opensearch_request(endpoint, "DELETE", f"/_index_template/{prefix}")
+        opensearch_request(endpoint, "DELETE", f"/{prefix}-*?allow_no_indices=true&expand_wildcards=all")
+    print(f"Backfill mode speed-up: {results['backfill'] / results['steady']:.2f}x")
+    return results
+
+
+def _node_counters(endpoint):
+    """
+    Sums the write pool rejections and GC time of all nodes, and returns the
+    largest heap, from `_nodes/stats`.
+    """
+    nodes = opensearch_request(endpoint, "GET", "/_nodes/stats/jvm,thread_pool")["nodes"].values()
+    return {
+        "heap_max_mb": max(node["jvm"]["mem"]["heap_max_in_bytes"] for node in nodes) // 2**20,
+        "rejected": sum(node["thread_pool"]["write"]["rejected"] for node in nodes),
+        "gc_ms": sum(collector["collection_time_in_millis"]
+                     for node in nodes for collector in node["jvm"]["gc"]["collectors"].values()),
+    }
+
+
+def bench_indexing(endpoint, docs=500000, workers=4, baseline=None, prefix="bench-indexing"):
+    """
+    Loads synthetic CloudFront documents into a live node and reports docs/s,
+    bulk latency, write pool rejections and GC time spent during the load, next
+    to the node's heap. With `baseline` (the endpoint of an untuned node), the
+    same load runs there too and the speed-up is printed.
+
+    Returns:
+        dict: Endpoint label -> result dict.
+    """
+    text = "\n".join(synthetic_log_lines(docs)) + "\n"
+    documents = list(parse_chunk(text.encode("utf-8")).iter_docs())
+    results = {}
+    targets = [("tuned", endpoint)] + ([("baseline", baseline)] if baseline else [])
+    for label, target in targets:
+        opensearch_request(target, "DELETE", f"/{prefix}-*?allow_no_indices=true&expand_wildcards=all")
+        opensearch_request(target, "PUT", f"/_index_template/{prefix}", cloudfront_index_template(prefix))
+        before = _node_counters(target)
+        started = time.perf_counter()
+        indexer = BulkIndexer(target, workers=workers)
+        indexer.index(build_bulk_actions(documents, prefix, granularity="hourly"))
+        summary = indexer.close()
+        opensearch_request(target, "POST", f"/{prefix}-*/_refresh")
+        elapsed = time.perf_counter() - started
+        after = _node_counters(target)
+        results[label] = dict(summary, docs_per_s=round(summary["indexed"] / elapsed, 1),
+                              heap_max_mb=after["heap_max_mb"], rejected=after["rejected"] - before["rejected"],
+                              gc_ms=after["gc_ms"] - before["gc_ms"])
+        result = results[label]
+        print(f"{label:<9} {result['indexed']:>9,d} indexed in {elapsed:7.2f} s  {result['docs_per_s']:>10,.0f} docs/s  "
+              f"p99 {result['p99_latency_s']:.3f} s  heap {result['heap_max_mb']:,d} MiB  "
+              f"{result['rejected']:,d} rejected  GC {result['gc_ms']:,d} ms")
+        opensearch_request(target, "DELETE", f"/_index_template/{prefix}")
+        opensearch_request(target, "DELETE", f"/{prefix}-*?allow_no_indices=true&expand_wildcards=all")
+    if baseline:
+        print(f"Tuned node speed-up: {results['tuned']['docs_per_s'] / results['baseline']['docs_per_s']:.2f}x")
+    return results
+
+
+def bench_archive(hours=24, lines_per_hour=200000):
+    """
+    Writes `hours` of synthetic gzipped hourly logs, compacts them into the Parquet
+    archive and compares a one-hour hit-ratio query against re-parsing the raw logs.
+    """
+    from datetime import datetime, timedelta, timezone
+    import archive
+
+    workdir = tempfile.mkdtemp(prefix="archive-bench-")
+    src, dest = os.path.join(workdir, "logs"), os.path.join(workdir, "archive")
+    os.makedirs(src)
+    start = 1704067200
+    header = "#Version: 1.0\n#Fields: " + " ".join(CLOUDFRONT_FIELDS) + "\n"
+    try:
+        for hour in range(hours):
+            stamp = time.strftime("%Y-%m-%d-%H", time.gmtime(start + hour * 3600))
+            with gzip.open(os.path.join(src, f"E2BENCH.{stamp}.0000.gz"), "wt", compresslevel=1) as f:
+                f.write(header)
+                f.write("\n".join(synthetic_log_lines(lines_per_hour, seed=hour, start=start + hour * 3600,
+                                                      offset=hour * lines_per_hour)) + "\n")
+
+        started = time.perf_counter()
+        rows = archive.compact(src, dest)
+        compact_s = time.perf_counter() - started
+        print(f"compact      {rows:>12,d} rows  {compact_s:8.2f} s  {rows / compact_s:>12,.0f} rows/s")
+
+        window_start = datetime.fromtimestamp(start, timezone.utc) + timedelta(hours=hours // 2)
+        window_end = window_start + timedelta(hours=1)
+        started = time.perf_counter()
+        hits = total = 0
+        for name in sorted(os.listdir(src)):
+            with gzip.open(os.path.join(src, name), "rb") as f:
+                for batch in parse_stream(f):
+                    ts = batch["timestamp"]
+                    keep = (ts >= window_start.timestamp()) & (ts < window_end.timestamp())
+                    results = batch["x-edge-result-type"]
+                    for result_type in HIT_RESULT_TYPES:
+                        hits += int((results.equals(result_type) & keep).sum())
+                    total += int(keep.sum())
+        raw_s = time.perf_counter() - started
+        print(f"raw scan     {total:>12,d} rows  {raw_s:8.3f} s  hit ratio {hits / max(total, 1):.4f}")
+
+        dataset = archive.open_archive(dest)
+        started = time.perf_counter()
+        result = archive.hit_ratio(dataset, start=window_start, end=window_end)
+        query_s = time.perf_counter() - started
+        print(f"archive      {result['requests']:>12,d} rows  {query_s:8.3f} s  hit ratio {result['hit_ratio']:.4f}")
+        print(f"Archive query speed-up: {raw_s / query_s:.1f}x")
+        return raw_s, query_s
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_cachesim(requests=5000000, objects=200000, edges=20, workers=None):
+    """
+    Measures cache simulator throughput on a synthetic Zipf-distributed trace.
+    """
+    import numpy as np
+    import cachesim
+
+    rng = np.random.default_rng(0)
+    uri = np.minimum(rng.zipf(1.1, requests), objects) - 1
+    trace = cachesim.Trace(
+        timestamps=np.sort(rng.integers(0, 86400, requests)), edge=rng.integers(0, edges, requests),
+        uri=uri.astype(np.int32), query=np.zeros(requests, dtype=np.int32),
+        sizes=(uri % 1000 + 1) * 1024, cacheable=np.ones(requests, dtype=bool),
+        observed_hits=np.zeros(requests, dtype=bool), edges=[f"EDGE{i}" for i in range(edges)],
+        uris=[f"/p{i % 10}/o{i}" for i in range(objects)], queries=[""],
+    )
+    scenarios = [cachesim.Scenario(f"ttl-{ttl}", ttl) for ttl in (300, 86400)]
+    started = time.perf_counter()
+    runs = cachesim.run_scenarios(trace, scenarios, 512 * 1024 * 1024, workers)
+    elapsed = time.perf_counter() - started
+    simulated = requests * len(scenarios)
+    for scenario, hits in zip(scenarios, runs):
+        print(f"{scenario.name:<10} hit ratio {hits.mean():.4f}")
+    print(f"simulated {simulated:>12,d} requests  {elapsed:8.2f} s  {simulated / elapsed:>12,.0f} requests/s")
+    return simulated / elapsed
+
+
+# Ubuntu's stock nginx.conf, reduced to what matters for throughput, proxying the same upstream.
+STOCK_NGINX_CONF = """
+worker_processes 1;
+pid {prefix}/nginx.pid;
+events {{ worker_connections 768; }}
+http {{
+    include {mime_types};
+    sendfile on;
+    tcp_nopush on;
+    keepalive_timeout 65;
+    access_log {prefix}/access.log;
+    error_log {prefix}/error.log;
+    gzip on;
+    upstream origin_app {{ server {upstream}; }}
+    server {{
+        listen {port};
+        root {root};
+        location /static/ {{ try_files $uri =404; }}
+        location / {{ proxy_pass http://origin_app; }}
+    }}
+}}
+"""
+
+
+def _serve_stub_origin(port, delay_ms):
+    import asyncio
+    from replay import serve_stub
+    asyncio.run(serve_stub(port=port, body_bytes=8192, delay_ms=delay_ms))
+
+
+def bench_nginx(instance_type="t3.medium", nginx="nginx", requests=50000, concurrency=256, upstream_delay_ms=5.0):
+    """
+    Runs a local nginx with the stock configuration and with the one rendered for
+    `instance_type`, both in front of the same stub upstream, and replays the same
+    request mix through each: half static files, half proxied application URLs.
+    """
+    import asyncio
+    import subprocess
+    import numpy as np
+    from nginx import nginx_settings, render_nginx_conf
+    from replay import replay
+
+    workdir = tempfile.mkdtemp(prefix="nginx-bench-")
+    upstream_port, stock_port, tuned_port = 18181, 18182, 18183
+    stub = multiprocessing.Process(target=_serve_stub_origin, args=(upstream_port, upstream_delay_ms), daemon=True)
+    stub.start()
+    mime_types = "/etc/nginx/mime.types"
+    if not os.path.exists(mime_types):
+        mime_types = os.path.join(workdir, "mime.types")
+        with open(mime_types, "w") as f:
+            f.write("types { text/html html; text/css css; application/javascript js; }\n")
+    os.makedirs(os.path.join(workdir, "html", "static"))
+    for i in range(20):
+        with open(os.path.join(workdir, "html", "static", f"asset{i}.css"), "w") as f:
+            f.write("body { color: #333; }\n" * 2000)
+
+    rng = random.Random(0)
+    paths = [f"/static/asset{rng.randrange(20)}.css" if rng.random() < 0.5 else f"/api/items/{rng.randrange(200)}"
+             for _ in range(requests)]
+    methods = ["GET"] * requests
+    offsets = np.zeros(requests)
+    results = {}
+    try:
+        for label, port in (("stock", stock_port), ("tuned", tuned_port)):
+            prefix = os.path.join(workdir, label)
+            os.makedirs(prefix)
+            if label == "stock":
+                conf = STOCK_NGINX_CONF.format(prefix=prefix, mime_types=mime_types, root=f"{workdir}/html",
+                                               upstream=f"127.0.0.1:{upstream_port}", port=port)
+            else:
+                conf = render_nginx_conf(nginx_settings(
+                    instance_type, upstream=f"127.0.0.1:{upstream_port}", user=os.environ.get("USER", "root"),
+                    pid_path=f"{prefix}/nginx.pid", modules_include=None, mime_types=mime_types,
+                    access_log=f"{prefix}/access.log", error_log=f"{prefix}/error.log",
+                    cache_path=f"{prefix}/cache", root=f"{workdir}/html", listen=port))
+                conf = conf.replace("location / {", "location /static/ {\n            try_files $uri =404;\n"
+                                    "        }\n\n        location / {", 1)
+            conf_path = os.path.join(prefix, "nginx.conf")
+            with open(conf_path, "w") as f:
+                f.write(conf)
+            subprocess.run([nginx, "-t", "-p", prefix, "-c", conf_path], check=True, capture_output=True)
+            subprocess.run([nginx, "-p", prefix, "-c", conf_path], check=True)
+            try:
+                time.sleep(0.5)
+                stats = asyncio.run(replay(f"http://127.0.0.1:{port}", offsets, methods, paths,
+                                           concurrency=concurrency, connections=concurrency))
+            finally:
+                subprocess.run([nginx, "-p", prefix, "-c", conf_path, "-s", "stop"], check=False)
+            summary = stats.summary()
+            results[label] = summary
+            print(f"{label:<6} {summary['requests_per_s']:>10,.0f} req/s  "
+                  f"p50 {summary['service_time']['p50_ms']:7.2f} ms  p99 {summary['service_time']['p99_ms']:7.2f} ms  "
+                  f"error rate {summary['error_rate']}")
+    finally:
+        stub.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f"Tuned config speed-up: {results['tuned']['requests_per_s'] / results['stock']['requests_per_s']:.2f}x")
+    return results
+
+
+STUB_TERRAFORM = """#!/bin/sh
+# Stand-in for terraform: plans changes until the first apply, then none.
+case "$1" in
+  init) mkdir -p .terraform ;;
+  plan) [ -f stub.tfstate ] && exit 0 || exit 2 ;;
+  apply) sleep 0.2; touch stub.tfstate ;;
+  output) echo '{"cloudfront_distribution_id": {"value": "EBENCH0000000"}}' ;;
+esac
+"""
+
+
+# Absolute paths the deploy's remote steps touch. The local host stand-in maps
+# them into its own directory, in commands, uploaded files and scripts alike.
+HOST_PATHS_RE = r"(^|[^A-Za-z0-9_./-])(/home/ubuntu|/etc/|/var/|/tmp/cloudfront-setup)"
+
+# Stand-ins for the Ubuntu tools the nginx and OpenSearch steps call. They act on
+# the host directory in $BENCH_HOST; `docker compose up` leaves the marker the
+# OpenSearch stand-in waits for.
+STUB_HOST_TOOLS = {
+    "sudo": """#!/bin/bash
+# A script from the host directory runs with its paths mapped into it.
+case "$1" in
+  "$BENCH_HOST"/*.sh)
+    script=$1; shift
+    sed -E "s#{pattern}#\\\\1$BENCH_HOST\\\\2#g" "$script" > "$script.local"
+    exec bash "$script.local" "$@" ;;
+esac
+exec "$@"
+""".replace("{pattern}", HOST_PATHS_RE),
+    "apt": """#!/bin/sh
+case " $* " in *" nginx "*)
+  mkdir -p "$BENCH_HOST/etc/nginx" && echo "# stock" > "$BENCH_HOST/etc/nginx/nginx.conf" && touch "$BENCH_HOST/.nginx" ;;
+esac
+exit 0
+""",
+    "apt-get": "#!/bin/sh\nexit 0\n",
+    "apt-cache": "#!/bin/sh\nexit 1\n",
+    "systemctl": "#!/bin/sh\nexit 0\n",
+    "sysctl": "#!/bin/sh\nexit 0\n",
+    "nginx": """#!/bin/sh
+[ "$1" = -v ] || exit 0
+[ -f "$BENCH_HOST/.nginx" ] || exit 127
+echo "nginx version: nginx/1.24.0 (Ubuntu)" >&2
+""",
+    "docker": """#!/bin/sh
+case "$*" in
+  "compose config --services") printf 'opensearch\\ndashboards\\n' ;;
+  "compose ps --status running --quiet") [ -f "$BENCH_HOST/.compose-up" ] && printf 'a\\nb\\n' ;;
+  "compose up"*) touch "$BENCH_HOST/.compose-up" ;;
+esac
+exit 0
+""",
+    # Owners and groups name users that only exist on the instance.
+    "install": """#!/bin/bash
+args=()
+while [ $# -gt 0 ]; do case "$1" in -o|-g) shift 2 ;; *) args+=("$1"); shift ;; esac; done
+exec {install} "${args[@]}"
+""",
+}
+
+
+class _LocalChannel:
+    """
+    Runs a command in a local bash, exposing the parts of paramiko.Channel that
+    `ssh.stream_channel` and `ssh.run_script` use, so remote steps can be timed
+    without a host.
+    """
+
+    def __init__(self, host):
+        import subprocess
+        self._subprocess = subprocess
+        self._host = host
+        self._buffers = {"out": b"", "err": b""}
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self._exited = threading.Event()
+
+    def exec_command(self, command):
+        pipe = self._subprocess.PIPE
+        self._proc = self._subprocess.Popen(["bash", "-c", self._host.map_paths(command)], stdin=pipe,
+                                            stdout=pipe, stderr=pipe, env=dict(os.environ, BENCH_HOST=self._host.root))
+        self._pumps = [threading.Thread(target=self._pump, args=(self._proc.stdout, "out"), daemon=True),
+                       threading.Thread(target=self._pump, args=(self._proc.stderr, "err"), daemon=True)]
+        for pump in self._pumps:
+            pump.start()
+        threading.Thread(target=self._watch_exit, daemon=True).start()
+
+    def _pump(self, stream, key):
+        for chunk in iter(lambda: os.read(stream.fileno(), 65536), b""):
+            with self._lock:
+                self._buffers[key] += chunk
+            os.write(self._wake_w, b"x")
+
+    def _watch_exit(self):
+        # Like paramiko's exit-status message: wakes the reader once output is complete.
+        for pump in self._pumps:
+            pump.join()
+        self._proc.wait()
+        self._exited.set()
+        # This thread owns the write end: the reader may close its end as soon
+        # as it sees the exit, so the write can fail with EPIPE but never hits
+        # a reused descriptor.
+        try:
+            os.write(self._wake_w, b"x")
+        except OSError:
+            pass
+        os.close(self._wake_w)
+
+    def _ready(self, key):
+        try:
+            os.read(self._wake_r, 65536)
+        except BlockingIOError:
+            pass
+        return bool(self._buffers[key])
+
+    def _take(self, key, size):
+        with self._lock:
+            data, self._buffers[key] = self._buffers[key][:size], self._buffers[key][size:]
+        return data
+
+    def fileno(self):
+        return self._wake_r
+
+    def sendall(self, data):
+        self._proc.stdin.write(self._host.map_paths(data.decode("utf-8")).encode("utf-8"))
+
+    def shutdown_write(self):
+        self._proc.stdin.close()
+
+    def recv_ready(self):
+        return self._ready("out")
+
+    def recv_stderr_ready(self):
+        return self._ready("err")
+
+    def recv(self, size):
+        return self._take("out", size)
+
+    def recv_stderr(self, size):
+        return self._take("err", size)
+
+    def exit_status_ready(self):
+        return self._exited.is_set()
+
+    def recv_exit_status(self):
+        return self._proc.wait()
+
+    def close(self):
+        os.close(self._wake_r)
+
+
+class _LocalSSHClient:
+    """
+    Stand-in for paramiko.SSHClient (and its transport) connected to a host
+    that lives in the directory `root`; sessions are `_LocalChannel`s.
+    """
+
+    def __init__(self, root):
+        import re
+        self.root = root
+        self._paths = re.compile(HOST_PATHS_RE, re.MULTILINE)
+        for path in ("home/ubuntu", "etc/sysctl.d", "var", "tmp"):
+            os.makedirs(os.path.join(root, path), exist_ok=True)
+
+    def map_paths(self, text):
+        return self._paths.sub(lambda m: m.group(1) + self.root + m.group(2), text)
+
+    def get_transport(self):
+        return self
+
+    def getpeername(self):
+        return ("127.0.0.1", 22)
+
+    def is_active(self):
+        return True
+
+    def open_session(self):
+        return _LocalChannel(self)
+
+
+class _LocalSCPClient:
+    """Stand-in for scp.SCPClient copying into a `_LocalSSHClient`'s host directory."""
+
+    def __init__(self, transport):
+        self._host = transport
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def putfo(self, fileobj, remote_path):
+        with open(self._host.map_paths(remote_path), "wb") as f:
+            shutil.copyfileobj(fileobj, f)
+
+    def put(self, local_path, remote_path):
+        shutil.copyfile(local_path, self._host.map_paths(remote_path))
+
+
+class _FakeHostServer(ThreadingHTTPServer):
+    """
+    OpenSearch and Dashboards of the local host: health and status answer 503
+    until `docker compose up` has run there, every write is acknowledged. It
+    also takes the SSH readiness probe's plain TCP connects.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _FakeHostHandler)
+        self.host = None
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class _FakeHostHandler(BaseHTTPRequestHandler):
+    def _reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        host = self.server.host
+        if host is None or not os.path.exists(os.path.join(host.root, ".compose-up")):
+            self._reply(503, {"error": "not started"})
+        elif self.path.startswith("/api/status"):
+            self._reply(200, {"status": {"overall": {"state": "green"}}})
+        else:
+            self._reply(200, {"status": "green", "number_of_nodes": 1, "timed_out": False})
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._reply(200, {"acknowledged": True})
+
+    do_POST = do_PUT
+    do_DELETE = do_PUT
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_deploy(runs=3, max_seconds=None, trace=None):
+    """
+    Times `deploy.deploy_stages()` end to end against stand-ins: EC2 and S3 on
+    moto, Terraform as a stub binary (through the Terraform cache), every SSH
+    session and SCP upload on a local bash and a per-run host directory with stub
+    apt, nginx, docker and systemctl, and OpenSearch, Dashboards and sshd as a
+    local server the readiness probes reach in place of the instance's DNS name.
+    The real stages run: readiness probes, the nginx and OpenSearch command
+    lists, artifact sync and the index template. Each run deploys to a fresh
+    instance; the first is cold, later runs hit the Terraform cache. Exits
+    non-zero when the slowest warm run takes longer than `max_seconds`, to catch
+    startup-time regressions.
+    """
+    import functools
+    import socket
+    import statistics
+    from unittest import mock
+    from moto import mock_aws
+    import artifacts
+    import bundle
+    import deploy
+    import tfcache
+    from orchestrator import run_stages
+    from ssh import ssh_manager
+    from tracing import export, instrument_boto3, span, tracer
+
+    workdir = tempfile.mkdtemp(prefix="deploy-bench-")
+    bin_dir, tf_dir = os.path.join(workdir, "bin"), os.path.join(workdir, "terraform")
+    os.makedirs(bin_dir)
+    shutil.copytree(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "terraform"), tf_dir,
+                    ignore=shutil.ignore_patterns(".terraform*", "*.tfstate*"))
+    tools = dict(STUB_HOST_TOOLS, terraform=STUB_TERRAFORM)
+    tools["install"] = tools["install"].replace("{install}", shutil.which("install"))
+    for name, script in tools.items():
+        with open(os.path.join(bin_dir, name), "w") as f:
+            f.write(script)
+        os.chmod(os.path.join(bin_dir, name), 0o755)
+
+    config = {"region": "us-east-1", "key_name": "bench", "key_path": "/dev/null", "bucket_name": "deploy-bench-logs",
+              "instance_type": "t3.medium", "create_bucket": True}
+    environ = {"AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing", "AWS_DEFAULT_REGION": "us-east-1",
+               "PATH": bin_dir + os.pathsep + os.environ.get("PATH", "")}
+    server = _FakeHostServer()
+    create_connection = socket.create_connection
+
+    def connect(address, *args, **kwargs):
+        # The instance's public DNS name (from moto) resolves to the local host.
+        if address[0].endswith(".amazonaws.com") and address[1] in (22, 9200, 5601):
+            address = ("127.0.0.1", server.server_port)
+        return create_connection(address, *args, **kwargs)
+
+    timings = []
+    try:
+        with server, mock.patch.dict(os.environ, environ), \
+                mock.patch.object(tfcache, "CACHE_DIR", os.path.join(workdir, "tf-cache")), \
+                mock.patch.object(tfcache, "PLUGIN_CACHE_DIR", os.path.join(workdir, "tf-plugins")), \
+                mock.patch.object(deploy, "cached_init", functools.partial(tfcache.cached_init, tf_dir)), \
+                mock.patch.object(deploy, "cached_apply", functools.partial(tfcache.cached_apply, terraform_dir=tf_dir)), \
+                mock.patch.object(ssh_manager, "client", lambda *args, **kwargs: server.host), \
+                mock.patch.object(artifacts, "SCPClient", _LocalSCPClient), \
+                mock.patch.object(bundle, "SCPClient", _LocalSCPClient), \
+                mock.patch("socket.create_connection", connect), \
+                mock_aws():
+            instrument_boto3()
+            for run in range(runs):
+                server.host = _LocalSSHClient(os.path.join(workdir, f"host-{run}"))
+                tracer.reset()
+                started = time.perf_counter()
+                with span("deploy", run=run):
+                    run_stages(deploy.deploy_stages(), config, state_path=os.path.join(workdir, "state.json"),
+                               fresh=True)
+                timings.append(time.perf_counter() - started)
+                print(f"run {run + 1}/{runs} ({'cold' if run == 0 else 'warm'}): {timings[-1]:.2f} s")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("\nLast run:")
+    tracer.print_summary()
+    if trace:
+        print("Trace written to {} and {}".format(*export(trace)))
+    warm = timings[1:] or timings
+    print(f"\ncold {timings[0]:.2f} s, warm median {statistics.median(warm):.2f} s, warm max {max(warm):.2f} s")
+    if max_seconds is not None and max(warm) > max_seconds:
+        print(f"REGRESSION: warm deploy took {max(warm):.2f} s, limit {max_seconds:.2f} s")
+        raise SystemExit(1)
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the CloudFront log tooling.")
+    sub = parser.add_subparsers(dest="suite", required=True)
+
+    p = sub.add_parser("parser", help="Naive per-line vs columnar log parsing")
+    p.add_argument("--size-mb", type=int, default=2048, help="Size of the synthetic log to generate")
+    p.add_argument("--file", help="Reuse (or create) a synthetic log at this path")
+
+    p = sub.add_parser("bulk", help="Sequential vs adaptive concurrent _bulk indexing on a fake server")
+    p.add_argument("--docs", type=int, default=200000, help="Documents to index")
+    p.add_argument("--workers", type=int, default=4, help="Concurrent bulk workers")
+    p.add_argument("--capacity", type=int, default=4, help="Concurrent requests the fake server accepts")
+    p.add_argument("--reject-rate", type=float, default=0.01, help="Random item rejection probability")
+
+    p = sub.add_parser("rollup", help="Streaming rollup throughput and document reduction")
+    p.add_argument("--size-mb", type=int, default=64, help="Size of the synthetic log to generate")
+    p.add_argument("--window", type=int, default=60, help="Rollup window in seconds")
+
+    p = sub.add_parser("dedup", help="Request-id dedup throughput, restart replay and false-positive rate")
+    p.add_argument("--size-mb", type=int, default=64, help="Size of the synthetic log to generate")
+    p.add_argument("--memory-mb", type=int, default=64, help="Memory budget of the filter")
+    p.add_argument("--fp-rate", type=float, default=1e-3, help="Target false-positive rate")
+    p.add_argument("--probes", type=int, default=1000000, help="Unseen ids checked for false positives")
+
+    p = sub.add_parser("backfill", help="Steady-state vs backfill index settings on a live OpenSearch node")
+    p.add_argument("--endpoint", required=True, help="OpenSearch endpoint, e.g. http://localhost:9200")
+    p.add_argument("--docs", type=int, default=500000, help="Documents to index per run")
+    p.add_argument("--workers", type=int, default=4, help="Concurrent bulk workers")
+
+    p = sub.add_parser("indexing", help="Indexing throughput, rejections and GC time on a live OpenSearch node")
+    p.add_argument("--endpoint", required=True, help="OpenSearch endpoint, e.g. http://localhost:9200")
+    p.add_argument("--baseline", help="Endpoint of an untuned node to compare with")
+    p.add_argument("--docs", type=int, default=500000, help="Documents to index")
+    p.add_argument("--workers", type=int, default=4, help="Concurrent bulk workers")
+
+    p = sub.add_parser("archive", help="Parquet archive query vs re-parsing raw gzipped logs")
+    p.add_argument("--hours", type=int, default=24, help="Hourly log files to generate")
+    p.add_argument("--lines-per-hour", type=int, default=200000, help="Records per hourly file")
+
+    p = sub.add_parser("cachesim", help="Cache simulator throughput on a synthetic trace")
+    p.add_argument("--requests", type=int, default=5000000, help="Requests in the synthetic trace")
+    p.add_argument("--edges", type=int, default=20, help="Edge locations")
+    p.add_argument("--workers", type=int, help="Simulation processes (default: all cores)")
+
+    p = sub.add_parser("nginx", help="Stock vs instance-tuned nginx config on a local nginx")
+    p.add_argument("--instance-type", default="t3.medium", help="Instance type the tuned config is sized for")
+    p.add_argument("--nginx", default="nginx", help="nginx binary to run")
+    p.add_argument("--requests", type=int, default=50000, help="Requests per configuration")
+    p.add_argument("--concurrency", type=int, default=256, help="Requests in flight")
+
+    p = sub.add_parser("deploy", help="End-to-end deploy flow against moto and local stand-ins")
+    p.add_argument("--runs", type=int, default=3, help="Deploys to run; the first is cold")
+    p.add_argument("--max-seconds", type=float, help="Fail when a warm deploy takes longer than this")
+    p.add_argument("--trace", metavar="PREFIX", help="Write the last run's span tree and Chrome trace")
+
+    args = parser.parse_args(argv)
+    if args.suite == "parser":
+        bench_parser(args.size_mb, args.file)
+    elif args.suite == "bulk":
+        bench_bulk(args.docs, args.workers, args.capacity, args.reject_rate)
+    elif args.suite == "rollup":
+        bench_rollup(args.size_mb, args.window)
+    elif args.suite == "dedup":
+        bench_dedup(args.size_mb, args.memory_mb, args.fp_rate, args.probes)
+    elif args.suite == "backfill":
+        bench_backfill(args.endpoint, args.docs, args.workers)
+    elif args.suite == "indexing":
+        bench_indexing(args.endpoint, args.docs, args.workers, args.baseline)
+    elif args.suite == "archive":
+        bench_archive(args.hours, args.lines_per_hour)
+    elif args.suite == "cachesim":
+        bench_cachesim(args.requests, edges=args.edges, workers=args.workers)
+    elif args.suite == "nginx":
+        bench_nginx(args.instance_type, args.nginx, args.requests, args.concurrency)
+    elif args.suite == "deploy":
+        bench_deploy(args.runs, args.max_seconds, args.trace)
+
+
+if __name__ == "__main__":
+    main()
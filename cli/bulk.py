@@ -0,0 +1,368 @@
+import http.client
+import json
+import queue
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+# Per-item errors that mean "node is overloaded, try again later" rather than "bad document".
+RETRYABLE_ERRORS = {"es_rejected_execution_exception", "rejected_execution_exception",
+                    "circuit_breaking_exception"}
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+
+
+class ConnectionPool:
+    """
+    A fixed set of keep-alive HTTP connections to one OpenSearch node.
+
+    Connections are created lazily and handed out one per caller; a connection
+    that errors is closed and replaced so the socket is never reused mid-failure.
+    """
+
+    def __init__(self, endpoint, size=4, timeout=60):
+        parsed = urlparse(endpoint)
+        self.scheme = parsed.scheme or "http"
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if self.scheme == "https" else 9200)
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _new_connection(self):
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body, headers):
+        """
+        Sends one request over a pooled connection.
+
+        Returns:
+            tuple: (HTTP status, response body bytes).
+        """
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._new_connection()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                payload = response.read()
+            except Exception:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._idle.put(conn)
+            return response.status, payload
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class AdaptiveBatchSizer:
+    """
+    Picks the number of documents per `_bulk` request from observed latency and payload size.
+
+    Additive-increase / multiplicative-decrease: the batch grows while requests
+    finish comfortably under `target_latency` and halves when they are slow, always
+    staying under `max_bytes` given the average document size.
+    """
+
+    def __init__(self, initial_docs=1000, min_docs=100, max_docs=20000,
+                 max_bytes=10 * 1024 * 1024, target_latency=1.0):
+        self.docs = initial_docs
+        self.min_docs = min_docs
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.target_latency = target_latency
+        self.avg_doc_bytes = 500.0
+        self._lock = threading.Lock()
+
+    def observe(self, docs, payload_bytes, latency):
+        with self._lock:
+            if docs:
+                self.avg_doc_bytes = 0.8 * self.avg_doc_bytes + 0.2 * (payload_bytes / docs)
+            if latency > self.target_latency:
+                self.docs = max(self.min_docs, int(self.docs * 0.5))
+            elif latency < self.target_latency * 0.5 and docs >= self.docs * 0.9:
+                self.docs = min(self.max_docs, self.docs + max(self.min_docs, self.docs // 4))
+            byte_cap = int(self.max_bytes / max(self.avg_doc_bytes, 1.0))
+            self.docs = max(self.min_docs, min(self.docs, byte_cap))
+
+    def limits(self):
+        with self._lock:
+            return self.docs, self.max_bytes
+
+
+class ConcurrencyLimiter:
+    """
+    Caps the number of in-flight `_bulk` requests, adapting the cap to pushback.
+
+    When most of a request is rejected the node's write queue is full, so the cap
+    drops by one (never below 1); each clean response raises it by 1/cap, up to
+    `maximum`. Smaller batches would not help there, so this is separate from
+    `AdaptiveBatchSizer`.
+    """
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def observe(self, rejected_fraction):
+        with self._cond:
+            if rejected_fraction > 0.5:
+                self.limit = max(1.0, self.limit - 1)
+            elif rejected_fraction == 0:
+                self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+class BulkStats:
+    """Counters and latency samples shared by the bulk workers."""
+
+    def __init__(self):
+        self.indexed = 0
+        self.failed = 0
+        self.retried = 0
+        self.requests = 0
+        self.bytes = 0
+        self.latencies = []
+        self.errors = []
+        self.started = time.perf_counter()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record_request(self, latency, payload_bytes):
+        with self._lock:
+            self.requests += 1
+            self.bytes += payload_bytes
+            self.latencies.append(latency)
+
+    def record_items(self, indexed=0, failed=0, retried=0, error=None):
+        with self._lock:
+            self.indexed += indexed
+            self.failed += failed
+            self.retried += retried
+            if error is not None and len(self.errors) < 10:
+                self.errors.append(error)
+
+    def percentile(self, pct):
+        with self._lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100.0))]
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        return {
+            "indexed": self.indexed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "requests": self.requests,
+            "bytes": self.bytes,
+            "elapsed_s": round(elapsed, 3),
+            "docs_per_s": round(self.indexed / elapsed, 1) if elapsed else 0.0,
+            "p50_latency_s": round(self.percentile(50), 4),
+            "p99_latency_s": round(self.percentile(99), 4),
+        }
+
+
+class BulkIndexer:
+    """
+    Feeds encoded `_bulk` action pairs to OpenSearch with several concurrent workers.
+
+    The caller's thread builds batches (sized by `AdaptiveBatchSizer`) and puts them
+    on a bounded queue, so a slow cluster blocks the producer instead of buffering
+    without limit. Workers send batches over a `ConnectionPool`, gated by a
+    `ConcurrencyLimiter`. A request refused outright (429/503) is resent by the same
+    worker after an exponential backoff with full jitter; when only some items come
+    back as 429/`es_rejected_execution_exception`, just those items are re-queued
+    after the backoff while the worker moves on.
+
+    Usage:
+        with BulkIndexer(endpoint) as indexer:
+            indexer.index(actions)
+        print(indexer.stats.summary())
+    """
+
+    def __init__(self, endpoint, workers=4, sizer=None, max_retries=8,
+                 backoff_base=0.5, backoff_max=30.0, timeout=60):
+        self.pool = ConnectionPool(endpoint, size=workers, timeout=timeout)
+        self.sizer = sizer or AdaptiveBatchSizer()
+        self.limiter = ConcurrencyLimiter(workers)
+        self.stats = BulkStats()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._queue = queue.Queue(maxsize=workers * 2)
+        self._pending = []
+        self._pending_bytes = 0
+        self._retries_scheduled = 0
+        self._retry_cond = threading.Condition()
+        self._workers = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, action):
+        """
+        Queues one encoded action pair (as produced by `ingest.build_bulk_actions`).
+        """
+        self._pending.append(action)
+        self._pending_bytes += len(action)
+        max_docs, max_bytes = self.sizer.limits()
+        if len(self._pending) >= max_docs or self._pending_bytes >= max_bytes:
+            self.flush()
+
+    def index(self, actions):
+        for action in actions:
+            self.add(action)
+
+    def flush(self):
+        if self._pending:
+            self._queue.put((self._pending, 0))
+            self._pending = []
+            self._pending_bytes = 0
+
+    def drain(self):
+        """
+        Sends whatever is buffered and waits until every queued batch and
+        scheduled retry has been answered; the workers keep running.
+        """
+        self.flush()
+        while True:
+            self._queue.join()
+            with self._retry_cond:
+                while self._retries_scheduled:
+                    self._retry_cond.wait()
+            if not self._queue.unfinished_tasks:
+                break
+
+    def close(self):
+        """
+        Sends whatever is buffered, waits for all workers and scheduled retries,
+        and returns the stats summary.
+        """
+        self.drain()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self.pool.close()
+        self.stats.finished = time.perf_counter()
+        return self.stats.summary()
+
+    def _backoff_delay(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _schedule_retry(self, actions, attempt):
+        """
+        Puts rejected items back on the queue after a backoff, without holding a worker.
+        """
+        def requeue():
+            self._queue.put((actions, attempt))
+            with self._retry_cond:
+                self._retries_scheduled -= 1
+                self._retry_cond.notify_all()
+
+        with self._retry_cond:
+            self._retries_scheduled += 1
+        timer = threading.Timer(self._backoff_delay(attempt - 1), requeue)
+        timer.daemon = True
+        timer.start()
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            try:
+                if entry is None:
+                    return
+                actions, attempt = entry
+                self._send(actions, attempt)
+            except Exception as e:
+                self.stats.record_items(failed=len(actions), error=str(e))
+            finally:
+                self._queue.task_done()
+
+    def _send(self, actions, attempt=0):
+        payload = b"".join(actions)
+        while True:
+            try:
+                with self.limiter:
+                    started = time.perf_counter()
+                    status, body = self.pool.request(
+                        "POST", "/_bulk", payload, {"Content-Type": "application/x-ndjson"})
+            except (OSError, http.client.HTTPException) as e:
+                status, body = None, str(e).encode("utf-8")
+            latency = time.perf_counter() - started
+            self.stats.record_request(latency, len(payload))
+
+            # The whole request was refused: the node is saturated, so this worker
+            # backs off in place, which also slows the producer through the queue.
+            if status is None or status in RETRYABLE_STATUSES:
+                self.limiter.observe(1.0)
+                if attempt >= self.max_retries:
+                    self.stats.record_items(failed=len(actions), error="gave up after retries")
+                    return
+                self.stats.record_items(retried=len(actions))
+                time.sleep(self._backoff_delay(attempt))
+                attempt += 1
+                continue
+            if status >= 400:
+                self.stats.record_items(failed=len(actions), error=body[:500].decode("utf-8", "replace"))
+                return
+            break
+
+        response = json.loads(body)
+        retry = []
+        failed = 0
+        first_error = None
+        if response.get("errors"):
+            for action, item in zip(actions, response["items"]):
+                result = next(iter(item.values()))
+                error = result.get("error")
+                if not error:
+                    continue
+                error_type = error.get("type") if isinstance(error, dict) else str(error)
+                if result.get("status") == 429 or error_type in RETRYABLE_ERRORS:
+                    retry.append(action)
+                else:
+                    failed += 1
+                    first_error = first_error or error
+        self.sizer.observe(len(actions), len(payload), latency)
+        self.limiter.observe(len(retry) / len(actions))
+        if retry and attempt >= self.max_retries:
+            failed += len(retry)
+            first_error = first_error or "gave up after retries"
+            retry = []
+        self.stats.record_items(indexed=len(actions) - len(retry) - failed, failed=failed,
+                                retried=len(retry), error=json.dumps(first_error) if first_error else None)
+        if retry:
+            self._schedule_retry(retry, attempt + 1)
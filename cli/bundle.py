@@ -0,0 +1,282 @@
+import argparse
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scp import SCPClient
+
+from artifacts import STATE_DIR, remote_manifest
+from ssh import execute, run_script, ssh_manager
+from tracing import span
+
+BUNDLE_CACHE_DIR = os.path.expanduser("~/.cloudfront-setup/bundles")
+REMOTE_BUNDLE_DIR = f"{STATE_DIR}/bundles"
+# Port a host that has the bundle serves it on to its peers (private network only).
+BUNDLE_PORT = 8765
+
+# Ubuntu release of the AMI in ec2.launch_ec2.
+DEFAULT_RELEASE = "focal"
+DEB_PACKAGES = ["docker-ce", "docker-ce-cli", "containerd.io", "docker-buildx-plugin", "docker-compose-plugin",
+                "nginx"]
+IMAGES = ["opensearchproject/opensearch:2.9.0", "opensearchproject/opensearch-dashboards:2.9.0"]
+
+# Runs in a clean container of the target release; the .deb files of the packages
+# and every dependency the container lacks end up in /debs.
+DOWNLOAD_DEBS_SCRIPT = """set -e
+apt-get update
+apt-get install -y ca-certificates curl gnupg
+install -m 0755 -d /etc/apt/keyrings
+curl -fsSL https://download.docker.com/linux/ubuntu/gpg | gpg --dearmor -o /etc/apt/keyrings/docker.gpg
+echo "deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.gpg] https://download.docker.com/linux/ubuntu {release} stable" > /etc/apt/sources.list.d/docker.list
+apt-get update
+apt-get install -y --download-only --no-install-recommends -o Dir::Cache::archives=/debs {packages}
+rm -rf /debs/partial /debs/lock
+"""
+
+
+def bundle_spec(release=DEFAULT_RELEASE, packages=DEB_PACKAGES, images=IMAGES):
+    return {"release": release, "packages": sorted(packages), "images": sorted(images)}
+
+
+def bundle_key(spec):
+    """
+    Returns the cache key of a bundle: a SHA-256 of its spec.
+    """
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def file_sha256(path, chunk_size=8 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bundle_path(spec, cache_dir=BUNDLE_CACHE_DIR):
+    return os.path.join(cache_dir, f"provision-{spec['release']}-{bundle_key(spec)[:16]}.tar.gz")
+
+
+def build_bundle(spec=None, cache_dir=BUNDLE_CACHE_DIR, force=False, docker="docker"):
+    """
+    Builds (or reuses from the local cache) one compressed artifact with the .deb
+    packages and `docker save`d images needed to provision a host offline.
+
+    The packages are downloaded inside a clean container of the hosts' Ubuntu
+    release, so their dependencies match. A checksum file `<bundle>.sha256` is
+    written next to the bundle.
+
+    Args:
+        spec (dict | None): From `bundle_spec`; the defaults when None.
+        cache_dir (str): Where bundles are kept between deploys.
+        force (bool): Rebuild even if a cached bundle exists.
+        docker (str): Docker CLI to use.
+
+    Returns:
+        str: Path of the bundle.
+
+    Raises:
+        subprocess.CalledProcessError: If downloading packages or images fails.
+    """
+    spec = spec or bundle_spec()
+    path = bundle_path(spec, cache_dir)
+    if os.path.exists(path) and os.path.exists(path + ".sha256") and not force:
+        print(f"Bundle cache hit: {path}")
+        return path
+    print(f"Bundle cache miss; building {path}...")
+    os.makedirs(cache_dir, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix="bundle-", dir=cache_dir)
+    started = time.perf_counter()
+    try:
+        debs_dir = os.path.join(workdir, "debs")
+        os.makedirs(debs_dir)
+        with span("bundle.download_debs"):
+            script = DOWNLOAD_DEBS_SCRIPT.format(release=spec["release"], packages=" ".join(spec["packages"]))
+            subprocess.run([docker, "run", "--rm", "-v", f"{debs_dir}:/debs", f"ubuntu:{spec['release']}",
+                            "bash", "-c", script], check=True)
+        with span("bundle.save_images"):
+            for image in spec["images"]:
+                subprocess.run([docker, "pull", image], check=True)
+            subprocess.run([docker, "save", "-o", os.path.join(workdir, "images.tar")] + spec["images"], check=True)
+        with open(os.path.join(workdir, "manifest.json"), "w") as f:
+            json.dump(dict(spec, key=bundle_key(spec), created=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                           debs=sorted(os.listdir(debs_dir))), f, indent=2)
+
+        # pigz writes ordinary gzip on every core; hosts only need stock tar/gzip.
+        compressor = "pigz" if shutil.which("pigz") else "gzip"
+        tmp_path = path + ".tmp"
+        with span("bundle.compress"):
+            subprocess.run(["tar", "-I", compressor, "-cf", tmp_path, "-C", workdir,
+                            "manifest.json", "debs", "images.tar"], check=True)
+        digest = file_sha256(tmp_path)
+        os.replace(tmp_path, path)
+        with open(path + ".sha256", "w") as f:
+            f.write(f"{digest}  {os.path.basename(path)}\n")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f"Bundle built in {time.perf_counter() - started:.0f} s: {os.path.getsize(path) / 2**20:,.0f} MiB, "
+          f"sha256 {digest[:12]}")
+    return path
+
+
+def bundle_checksum(path):
+    """
+    Returns the SHA-256 recorded next to a bundle (computed if the file is missing).
+    """
+    try:
+        with open(path + ".sha256") as f:
+            return f.read().split()[0]
+    except OSError:
+        return file_sha256(path)
+
+
+def _remote_path(path):
+    return f"{REMOTE_BUNDLE_DIR}/{os.path.basename(path)}"
+
+
+def push_bundle(ssh_client, path, label=""):
+    """
+    Uploads the bundle to a host unless a copy with the same checksum is already
+    there, then verifies the remote checksum.
+
+    Returns:
+        bool: True if the bundle was uploaded.
+    """
+    remote, checksum = _remote_path(path), bundle_checksum(path)
+    prefix = f"[{label}] " if label else ""
+    if remote_manifest(ssh_client, [remote]).get(remote) == checksum:
+        print(f"{prefix}Bundle already present.")
+        return False
+    with span("bundle.push", bytes=os.path.getsize(path)):
+        execute(ssh_client, f"mkdir -p {REMOTE_BUNDLE_DIR}")
+        with SCPClient(ssh_client.get_transport()) as scp:
+            scp.put(path, remote + ".part")
+        run_script(ssh_client, [f"echo '{checksum}  {remote}.part' | sha256sum -c --quiet",
+                                f"mv {remote}.part {remote}"], label=label, echo=False)
+    print(f"{prefix}Bundle uploaded and verified.")
+    return True
+
+
+def fetch_from_peer(ssh_client, path, peer_ip, label=""):
+    """
+    Has the host download the bundle from a peer serving it (see `serve_bundle`)
+    and verify its checksum.
+    """
+    remote, checksum = _remote_path(path), bundle_checksum(path)
+    name = os.path.basename(path)
+    with span("bundle.fetch_from_peer", peer=peer_ip):
+        run_script(ssh_client, [
+            f"mkdir -p {REMOTE_BUNDLE_DIR}",
+            f"test \"$(sha256sum {remote} 2>/dev/null | cut -d' ' -f1)\" = {checksum} || "
+            f"{{ curl -fsS -o {remote}.part http://{peer_ip}:{BUNDLE_PORT}/{name} && "
+            f"echo '{checksum}  {remote}.part' | sha256sum -c --quiet && mv {remote}.part {remote}; }}",
+        ], label=label, echo=False)
+
+
+def serve_bundle(ssh_client, private_ip):
+    """
+    Starts a background HTTP server on the host's private address that serves the
+    bundle directory to peers, and returns once it answers.
+    """
+    pid_file = f"{REMOTE_BUNDLE_DIR}/.server.pid"
+    url = f"http://{private_ip}:{BUNDLE_PORT}/"
+    run_script(ssh_client, [
+        f"kill -0 \"$(cat {pid_file} 2>/dev/null)\" 2>/dev/null || {{ "
+        f"nohup python3 -m http.server {BUNDLE_PORT} --bind {private_ip} --directory {REMOTE_BUNDLE_DIR} "
+        f"> /dev/null 2>&1 < /dev/null & echo $! > {pid_file}; }}",
+        f"for i in $(seq 100); do curl -fs -o /dev/null {url} && exit 0; sleep 0.1; done; exit 1",
+    ], echo=False)
+
+
+def stop_serving(ssh_client):
+    pid_file = f"{REMOTE_BUNDLE_DIR}/.server.pid"
+    execute(ssh_client, f"test -f {pid_file} && kill \"$(cat {pid_file})\"; rm -f {pid_file}")
+
+
+def install_bundle(ssh_client, path, spec=None, label=""):
+    """
+    Installs from a bundle already on the host: unpacks it once, installs the
+    packages that are missing and loads the images Docker does not have yet, so
+    provisioning needs neither apt repositories nor Docker Hub.
+
+    Args:
+        ssh_client (paramiko.SSHClient): The active SSH client.
+        path (str): Local path of the bundle (its name locates the remote copy).
+        spec (dict | None): The spec the bundle was built from; the defaults when None.
+        label (str): Prefix for echoed output lines.
+    """
+    spec = spec or bundle_spec()
+    remote = _remote_path(path)
+    unpacked = remote[:-len(".tar.gz")]
+    packages = " ".join(spec["packages"])
+    image_checks = " && ".join(f"sudo docker image inspect {shlex.quote(image)} > /dev/null 2>&1"
+                               for image in spec["images"])
+    with span("bundle.install"):
+        run_script(ssh_client, [
+            f"test -f {unpacked}/manifest.json || {{ mkdir -p {unpacked} && tar -xzf {remote} -C {unpacked}; }}",
+            f"dpkg -s {packages} > /dev/null 2>&1 || "
+            f"sudo apt-get install -y --no-download --no-install-recommends {unpacked}/debs/*.deb",
+            "sudo usermod -aG docker ubuntu",
+            "sudo systemctl enable --now docker",
+            f"{image_checks} || sudo docker load -i {unpacked}/images.tar",
+        ], label=label)
+
+
+def distribute_bundle(hosts, key_path, path, max_parallel=8):
+    """
+    Gets the bundle onto every host while uploading it from here only once.
+
+    The first host receives it over SSH; afterwards every host that has it serves
+    it on its private address, and each round every such host hands it to one
+    more host, so the number of copies doubles per round.
+
+    Args:
+        hosts (list): Host records with 'dns' and 'private_ip' (see `ec2.describe_hosts`).
+        key_path (str): The path to the SSH private key file.
+        path (str): Local bundle path.
+        max_parallel (int): Peer transfers at once.
+    """
+    started = time.perf_counter()
+    clients = {host["dns"]: ssh_manager.client(host["dns"], key_path) for host in hosts}
+    seed = hosts[0]
+    push_bundle(clients[seed["dns"]], path, label=seed["dns"])
+    have, pending = [seed], list(hosts[1:])
+    try:
+        while pending:
+            for host in have:
+                serve_bundle(clients[host["dns"]], host["private_ip"])
+            pairs = list(zip(have, pending))
+            with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+                list(executor.map(lambda pair: fetch_from_peer(clients[pair[1]["dns"]], path, pair[0]["private_ip"],
+                                                               label=pair[1]["dns"]), pairs))
+            have += [target for _, target in pairs]
+            pending = pending[len(pairs):]
+            print(f"Bundle on {len(have)}/{len(hosts)} hosts.")
+    finally:
+        for host in have:
+            stop_serving(clients[host["dns"]])
+    print(f"Bundle distributed to {len(hosts)} hosts in {time.perf_counter() - started:.0f} s "
+          f"(uploaded once from here).")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build the offline provisioning bundle.")
+    parser.add_argument("--release", default=DEFAULT_RELEASE, help="Ubuntu release codename of the hosts")
+    parser.add_argument("--cache-dir", default=BUNDLE_CACHE_DIR, help="Local bundle cache")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if cached")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print(build_bundle(bundle_spec(release=args.release), cache_dir=args.cache_dir, force=args.force))
+
+
+if __name__ == "__main__":
+    main()
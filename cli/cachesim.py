@@ -0,0 +1,409 @@
+import argparse
+import json
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from fnmatch import fnmatchcase
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import archive
+from rollup import HIT_RESULT_TYPES, path_prefix
+
+TEMPLATES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "templates"))
+
+# What create_distribution and terraform/cloudfront.tf configure today.
+CURRENT_DEFAULT_TTL = 86400
+CURRENT_MAX_TTL = 31536000
+DEFAULT_TTL_GRID = (60, 300, 3600, 86400, 604800)
+CACHEABLE_METHODS = ("GET", "HEAD")
+# Status codes CloudFront caches for the behavior's TTL.
+CACHEABLE_STATUSES = (200, 203, 206, 300, 301, 410)
+
+TRACE_COLUMNS = ["timestamp", "x_edge_location", "cs_uri_stem", "cs_uri_query", "cs_method",
+                 "sc_status", "sc_bytes", "x_edge_result_type"]
+
+
+class Trace:
+    """
+    Request trace in integer-coded columnar form, sorted by (edge, timestamp).
+
+    Strings are dictionary-encoded once, so the simulator works on integer URI and
+    query ids; `edge_bounds[i]:edge_bounds[i + 1]` is the slice of edge `edges[i]`.
+    """
+
+    def __init__(self, timestamps, edge, uri, query, sizes, cacheable, observed_hits, edges, uris, queries):
+        order = np.lexsort((timestamps, edge))
+        self.timestamps = timestamps[order]
+        self.edge = edge[order]
+        self.uri = uri[order]
+        self.query = query[order]
+        self.sizes = sizes[order]
+        self.cacheable = cacheable[order]
+        self.observed_hits = observed_hits[order]
+        self.edges = edges
+        self.uris = uris
+        self.queries = queries
+        self.edge_bounds = np.searchsorted(self.edge, np.arange(len(edges) + 1))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def from_arrow(cls, table):
+        """
+        Builds a trace from an Arrow table with the archive's column names.
+        """
+        def encode(name, fill):
+            column = pc.fill_null(table[name], fill).combine_chunks().dictionary_encode()
+            return column.indices.to_numpy().astype(np.int32), column.dictionary.to_pylist()
+
+        edge, edges = encode("x_edge_location", "-")
+        uri, uris = encode("cs_uri_stem", "/")
+        query, queries = encode("cs_uri_query", "")
+        status = pc.fill_null(table["sc_status"], 0).to_numpy()
+        cacheable = (pc.is_in(table["cs_method"], pa.array(CACHEABLE_METHODS)).to_numpy(zero_copy_only=False)
+                     & np.isin(status, CACHEABLE_STATUSES))
+        observed = pc.is_in(table["x_edge_result_type"], pa.array(HIT_RESULT_TYPES)).to_numpy(zero_copy_only=False)
+        return cls(
+            timestamps=table["timestamp"].cast(pa.timestamp("s", tz="UTC")).cast(pa.int64()).to_numpy(),
+            edge=edge, uri=uri, query=query,
+            sizes=pc.fill_null(table["sc_bytes"], 0).to_numpy(),
+            cacheable=cacheable, observed_hits=observed,
+            edges=edges, uris=uris, queries=queries,
+        )
+
+
+def load_trace(archive_dir=None, src_dir=None, start=None, end=None, distribution=None):
+    """
+    Loads a request trace from the Parquet archive (preferred) or from a directory
+    of fetched `.gz` logs.
+    """
+    if archive_dir:
+        table = archive.scan(archive.open_archive(archive_dir), TRACE_COLUMNS,
+                             start=start, end=end, distribution=distribution)
+    else:
+        table = archive.load_log_dir(src_dir, TRACE_COLUMNS)
+    print(f"Loaded {len(table)} requests.")
+    return Trace.from_arrow(table)
+
+
+class CacheBehavior:
+    """One path-pattern cache behavior: a TTL and whether the query string is in the cache key."""
+
+    def __init__(self, path_pattern, default_ttl, query_string=False, max_ttl=CURRENT_MAX_TTL):
+        self.path_pattern = path_pattern
+        self.default_ttl = default_ttl
+        self.query_string = query_string
+        self.max_ttl = max(max_ttl, default_ttl)
+
+    def to_dict(self):
+        return {"path_pattern": self.path_pattern, "default_ttl": self.default_ttl,
+                "max_ttl": self.max_ttl, "query_string": self.query_string}
+
+
+class Scenario:
+    """
+    A candidate distribution configuration: ordered behaviors, first match wins,
+    falling back to the default behavior's TTL and query-string setting.
+    """
+
+    def __init__(self, name, default_ttl=CURRENT_DEFAULT_TTL, query_string=False, behaviors=()):
+        self.name = name
+        self.default_ttl = default_ttl
+        self.query_string = query_string
+        self.behaviors = list(behaviors)
+
+    def resolve(self, uris):
+        """
+        Returns per-URI arrays (behavior index, -1 for the default; TTL; query-string flag).
+        """
+        matched = np.array([next((i for i, b in enumerate(self.behaviors) if fnmatchcase(uri, b.path_pattern)), -1)
+                            for uri in uris], dtype=np.int32)
+        ttls = np.array([b.default_ttl for b in self.behaviors] + [self.default_ttl], dtype=np.int64)
+        query = np.array([b.query_string for b in self.behaviors] + [self.query_string], dtype=bool)
+        return matched, ttls[matched], query[matched]
+
+
+def simulate_edge(timestamps, keys, sizes, ttls, capacity):
+    """
+    Replays one edge location's requests through a TTL + LRU cache of `capacity` bytes.
+
+    An object is served from cache while it is younger than its TTL; an expired or
+    missing object is fetched from the origin and cached if its TTL is positive,
+    evicting least-recently-used objects until it fits.
+
+    Returns:
+        numpy.ndarray: Boolean hit flag per request.
+    """
+    cache = OrderedDict()
+    used = 0
+    hits = bytearray(len(keys))
+    for i, (now, key, size, ttl) in enumerate(zip(timestamps.tolist(), keys.tolist(),
+                                                  sizes.tolist(), ttls.tolist())):
+        entry = cache.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                hits[i] = 1
+                cache.move_to_end(key)
+                continue
+            used -= entry[1]
+            del cache[key]
+        if ttl <= 0 or size > capacity:
+            continue
+        cache[key] = (now + ttl, size)
+        used += size
+        while used > capacity:
+            used -= cache.popitem(last=False)[1][1]
+    return np.frombuffer(bytes(hits), dtype=bool)
+
+
+# Set before the worker pool forks so workers share the trace instead of receiving pickled copies.
+_TRACE = None
+
+
+def _simulate_slice(lo, hi, ttl_per_uri, query_per_uri, capacity):
+    trace = _TRACE
+    uri = trace.uri[lo:hi]
+    ttls = np.where(trace.cacheable[lo:hi], ttl_per_uri[uri], 0)
+    keys = uri.astype(np.int64) * (len(trace.queries) + 1) + np.where(query_per_uri[uri], trace.query[lo:hi] + 1, 0)
+    return lo, simulate_edge(trace.timestamps[lo:hi], keys, trace.sizes[lo:hi], ttls, capacity)
+
+
+def run_scenarios(trace, scenarios, capacity, workers=None):
+    """
+    Simulates every scenario over the trace, one task per (scenario, edge) spread
+    over a process pool.
+
+    Returns:
+        list[numpy.ndarray]: Boolean hit flag per request (trace order), per scenario.
+    """
+    global _TRACE
+    _TRACE = trace
+    workers = workers or os.cpu_count()
+    resolved = [scenario.resolve(trace.uris) for scenario in scenarios]
+    results = [np.zeros(len(trace), dtype=bool) for _ in scenarios]
+    bounds = list(zip(trace.edge_bounds[:-1].tolist(), trace.edge_bounds[1:].tolist()))
+    # Largest edges first so one big edge does not finish last on its own.
+    bounds.sort(key=lambda b: b[0] - b[1])
+    tasks = [(s, lo, hi) for lo, hi in bounds for s in range(len(scenarios)) if hi > lo]
+
+    if workers <= 1:
+        for s, lo, hi in tasks:
+            _, hits = _simulate_slice(lo, hi, resolved[s][1], resolved[s][2], capacity)
+            results[s][lo:hi] = hits
+        return results
+
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = {executor.submit(_simulate_slice, lo, hi, resolved[s][1], resolved[s][2], capacity): s
+                   for s, lo, hi in tasks}
+        for future, s in futures.items():
+            lo, hits = future.result()
+            results[s][lo:lo + len(hits)] = hits
+    return results
+
+
+def summarize(trace, hits, groups=None, group_count=0):
+    """
+    Returns hit ratio, origin requests and origin bytes, overall and per group.
+    """
+    misses = ~hits
+    summary = {
+        "requests": len(trace),
+        "hit_ratio": round(float(hits.mean()), 4) if len(trace) else None,
+        "origin_requests": int(misses.sum()),
+        "origin_bytes": int(trace.sizes[misses].sum()),
+    }
+    if groups is not None:
+        summary["groups"] = {
+            "requests": np.bincount(groups, minlength=group_count),
+            "origin_bytes": np.bincount(groups, weights=np.where(misses, trace.sizes, 0), minlength=group_count),
+            "bytes": np.bincount(groups, weights=trace.sizes, minlength=group_count),
+        }
+    return summary
+
+
+def query_sensitive(trace, uri_group, group_count, threshold=0.05):
+    """
+    Guesses, per group, whether the query string selects different content.
+
+    For URIs requested with several distinct query strings, the largest response
+    per (URI, query) is compared; if most such URIs return noticeably different
+    sizes, caching them under one key would serve the wrong object.
+    """
+    nonempty = np.array([bool(q) for q in trace.queries], dtype=bool)[trace.query]
+    if not nonempty.any():
+        return np.zeros(group_count, dtype=bool)
+    pairs = trace.uri[nonempty].astype(np.int64) * (len(trace.queries) + 1) + trace.query[nonempty]
+    unique, inverse = np.unique(pairs, return_inverse=True)
+    largest = np.zeros(len(unique), dtype=np.int64)
+    np.maximum.at(largest, inverse, trace.sizes[nonempty])
+    pair_uri = unique // (len(trace.queries) + 1)
+    starts = np.flatnonzero(np.r_[True, pair_uri[1:] != pair_uri[:-1]])
+    counts = np.diff(np.r_[starts, len(pair_uri)])
+    lows = np.minimum.reduceat(largest, starts)
+    highs = np.maximum.reduceat(largest, starts)
+    multi = counts > 1
+    varying = multi & (highs - lows > threshold * highs)
+    uri_groups = uri_group[pair_uri[starts]]
+    multi_per_group = np.bincount(uri_groups, weights=multi, minlength=group_count)
+    varying_per_group = np.bincount(uri_groups, weights=varying, minlength=group_count)
+    return (multi_per_group > 0) & (varying_per_group > 0.5 * np.maximum(multi_per_group, 1))
+
+
+def recommend(trace, capacity, ttl_grid=DEFAULT_TTL_GRID, max_behaviors=5, tolerance=0.01, workers=None):
+    """
+    Searches per-path-prefix TTLs and query-string settings and returns the
+    recommended scenario with its predicted effect.
+
+    The busiest top-level path prefixes become candidate behaviors. Each TTL in the
+    grid is simulated for all of them at once and, per prefix, the shortest TTL
+    whose origin bytes are within `tolerance` (a fraction) of the best TTL's is
+    kept: beyond that point a longer TTL only adds staleness. Prefixes interact
+    through the shared LRU, so the combination is simulated again; if it still
+    sends more bytes to the origin than the current configuration, the best TTL
+    per prefix is tried, and failing that the current configuration is kept.
+
+    Returns:
+        dict: Baseline and recommended summaries, the TTL grid results and the behaviors.
+    """
+    prefixes = [path_prefix(uri) for uri in trace.uris]
+    requests_per_uri = np.bincount(trace.uri, minlength=len(trace.uris))
+    totals = {}
+    for prefix, count in zip(prefixes, requests_per_uri.tolist()):
+        totals[prefix] = totals.get(prefix, 0) + count
+    candidates = [p for p, _ in sorted(totals.items(), key=lambda kv: -kv[1]) if p != "/"][:max_behaviors]
+    patterns = [f"{p}/*" for p in candidates]
+
+    group_of_prefix = {p: i for i, p in enumerate(candidates)}
+    uri_group = np.array([group_of_prefix.get(p, len(candidates)) for p in prefixes], dtype=np.int32)
+    group_count = len(candidates) + 1
+    groups = uri_group[trace.uri]
+    query_flags = query_sensitive(trace, uri_group, group_count)
+
+    def scenario_for(ttls, name):
+        behaviors = [CacheBehavior(pattern, ttl, bool(flag))
+                     for pattern, ttl, flag in zip(patterns, ttls[:-1], query_flags[:-1])]
+        scenario = Scenario(name, ttls[-1], bool(query_flags[-1]), behaviors)
+        # A behavior identical to the default one adds nothing.
+        scenario.behaviors = [b for b in scenario.behaviors
+                              if (b.default_ttl, b.query_string) != (scenario.default_ttl, scenario.query_string)]
+        return scenario
+
+    grid = [scenario_for([ttl] * group_count, f"ttl-{ttl}") for ttl in ttl_grid]
+    baseline = Scenario("current")
+    print(f"Simulating {len(grid) + 1} scenarios over {len(trace)} requests and {len(trace.edges)} edges...")
+    runs = run_scenarios(trace, [baseline] + grid, capacity, workers)
+    grid_summaries = [summarize(trace, hits, groups, group_count) for hits in runs[1:]]
+    current = summarize(trace, runs[0])
+
+    origin = np.array([s["groups"]["origin_bytes"] for s in grid_summaries])
+    shortest, best = [], []
+    for g in range(group_count):
+        lowest = origin[:, g].min()
+        shortest.append(int(ttl_grid[np.flatnonzero(origin[:, g] <= lowest * (1 + tolerance))[0]]))
+        best.append(int(ttl_grid[np.argmin(origin[:, g])]))
+
+    proposals = [scenario_for(shortest, "recommended"), scenario_for(best, "lowest-origin-bytes")]
+    recommended, summary = baseline, current
+    for scenario, hits in zip(proposals, run_scenarios(trace, proposals, capacity, workers)):
+        candidate = summarize(trace, hits)
+        if candidate["origin_bytes"] <= current["origin_bytes"]:
+            recommended, summary = scenario, candidate
+            break
+    if recommended is baseline:
+        print("No TTL combination of the grid sends fewer bytes to the origin than the current configuration.")
+
+    def public(summary):
+        return {k: v for k, v in summary.items() if k != "groups"}
+
+    return {
+        "observed_hit_ratio": round(float(trace.observed_hits.mean()), 4) if len(trace) else None,
+        "current": public(current),
+        "grid": [dict(public(s), ttl=ttl) for s, ttl in zip(grid_summaries, ttl_grid)],
+        "recommended": public(summary),
+        "default_ttl": recommended.default_ttl,
+        "default_max_ttl": max(CURRENT_MAX_TTL, recommended.default_ttl),
+        "default_query_string": recommended.query_string,
+        "behaviors": [b.to_dict() for b in recommended.behaviors],
+    }
+
+
+def render_behaviors(report, target_origin_id="origin1"):
+    """
+    Renders the recommended configuration as Terraform: the default cache
+    behavior's TTLs and query-string setting, followed by one
+    `ordered_cache_behavior` block per path pattern that differs from it.
+    """
+    from jinja2 import Environment, FileSystemLoader
+    env = Environment(loader=FileSystemLoader(TEMPLATES_DIR), keep_trailing_newline=True)
+    return env.get_template("ordered_cache_behavior.tf.j2").render(
+        default_ttl=report["default_ttl"],
+        default_max_ttl=report["default_max_ttl"],
+        default_query_string=report["default_query_string"],
+        behaviors=report["behaviors"],
+        target_origin_id=target_origin_id,
+        requests=report["recommended"]["requests"],
+        hit_ratio=report["recommended"]["hit_ratio"] or 0.0,
+        observed_hit_ratio=report["observed_hit_ratio"] or 0.0,
+        origin_requests=report["recommended"]["origin_requests"],
+        origin_bytes=report["recommended"]["origin_bytes"],
+    )
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Trace-driven CloudFront cache simulator.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--archive", help="Parquet archive written by archive.py compact")
+    source.add_argument("--src", help="Directory of fetched .gz logs")
+    parser.add_argument("--start", help="Inclusive start time, e.g. 2024-01-31T00:00")
+    parser.add_argument("--end", help="Exclusive end time")
+    parser.add_argument("--distribution", help="Restrict to one distribution id")
+    parser.add_argument("--edge-capacity-mb", type=int, default=1024, help="Modelled cache size per edge location")
+    parser.add_argument("--ttls", default=",".join(map(str, DEFAULT_TTL_GRID)), help="Comma-separated TTL grid")
+    parser.add_argument("--max-behaviors", type=int, default=5, help="Path-prefix behaviors to consider")
+    parser.add_argument("--workers", type=int, help="Simulation processes (default: all cores)")
+    parser.add_argument("--output", help="Write ordered_cache_behavior HCL here instead of stdout")
+    parser.add_argument("--report", help="Also write the full JSON report here")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    trace = load_trace(args.archive, args.src, _parse_time(args.start), _parse_time(args.end), args.distribution)
+    report = recommend(trace, args.edge_capacity_mb * 1024 * 1024,
+                       ttl_grid=tuple(int(t) for t in args.ttls.split(",")),
+                       max_behaviors=args.max_behaviors, workers=args.workers)
+
+    print(f"Observed hit ratio: {report['observed_hit_ratio']}")
+    for label, summary in [("current", report["current"])] + \
+            [(f"ttl {s['ttl']}", s) for s in report["grid"]] + [("recommended", report["recommended"])]:
+        print(f"{label:<12} hit ratio {summary['hit_ratio']:.4f}  origin requests {summary['origin_requests']:>10}"
+              f"  origin bytes {summary['origin_bytes']:>14}")
+
+    hcl = render_behaviors(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(hcl)
+        print(f"Recommended cache behaviors written to {args.output}")
+    else:
+        print(hcl)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
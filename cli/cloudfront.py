@@ -1,39 +1,157 @@
-def create_distribution(session, origin_domain_name):
-    cf = session.client('cloudfront')
+import hashlib
+import json
+
+from awsclients import clients, describe_cache
+
+
+def _cloudfront(session=None):
+    return session.client('cloudfront') if session else clients.client('cloudfront')
+
+
+def _origin_items(origins):
+    """
+    Normalises origins given as domain names or {'id', 'domain'} dicts to
+    (origin id, domain) pairs; unnamed origins become origin1, origin2, ...
+    """
+    if isinstance(origins, (str, dict)):
+        origins = [origins]
+    items = []
+    for number, origin in enumerate(origins, 1):
+        if isinstance(origin, str):
+            origin = {'domain': origin}
+        items.append((origin.get('id') or f'origin{number}', origin['domain']))
+    return items
+
+
+def _cache_behavior(origin_id, path_pattern=None):
+    behavior = {
+        'TargetOriginId': origin_id,
+        'ViewerProtocolPolicy': 'allow-all',
+        'TrustedSigners': {
+            'Enabled': False,
+            'Quantity': 0
+        },
+        'ForwardedValues': {
+            'QueryString': False,
+            'Cookies': {'Forward': 'none'}
+        },
+        'DefaultTTL': 86400,
+        'MinTTL': 0,
+        'MaxTTL': 31536000
+    }
+    if path_pattern:
+        behavior['PathPattern'] = path_pattern
+    return behavior
+
+
+def create_distribution(session, origins, path_patterns=None, log_bucket=None,
+                        log_prefix='cloudfront-logs/', comment='Created by automation'):
+    """
+    Creates a distribution in front of one or more HTTP origins.
+
+    The first origin serves the default cache behavior; `path_patterns` routes
+    other paths to other origins. The caller reference is derived from the
+    configuration, so repeating a call returns the distribution it created
+    instead of creating a duplicate.
+
+    Args:
+        session (boto3.Session): Session to use, or None for the shared client.
+        origins (str | list): Origin domain names, or dicts with 'domain' and an
+            optional 'id'.
+        path_patterns (dict): Path pattern (e.g. '/api/*') -> origin id or domain.
+        log_bucket (str): Bucket that receives the access logs, if any.
+        log_prefix (str): Key prefix of the access logs.
+        comment (str): Distribution comment.
+
+    Returns:
+        str: The distribution ID.
+    """
+    items = _origin_items(origins)
+    ids_by_domain = {domain: origin_id for origin_id, domain in items}
+    behaviors = [_cache_behavior(ids_by_domain.get(target, target), pattern)
+                 for pattern, target in (path_patterns or {}).items()]
+    unknown = {b['TargetOriginId'] for b in behaviors} - {origin_id for origin_id, _ in items}
+    if unknown:
+        raise Exception(f"Path patterns refer to unknown origins: {', '.join(sorted(unknown))}")
+
     distribution_config = {
-        'CallerReference': str(hash(origin_domain_name)),
         'Origins': {
-            'Quantity': 1,
+            'Quantity': len(items),
             'Items': [{
-                'Id': 'origin1',
-                'DomainName': origin_domain_name,
+                'Id': origin_id,
+                'DomainName': domain,
                 'OriginPath': '',
                 'CustomOriginConfig': {
                     'HTTPPort': 80,
                     'HTTPSPort': 443,
                     'OriginProtocolPolicy': 'http-only'
                 }
-            }]
-        },
-        'DefaultCacheBehavior': {
-            'TargetOriginId': 'origin1',
-            'ViewerProtocolPolicy': 'allow-all',
-            'TrustedSigners': {
-                'Enabled': False,
-                'Quantity': 0
-            },
-            'ForwardedValues': {
-                'QueryString': False,
-                'Cookies': {'Forward': 'none'}
-            },
-            'DefaultTTL': 86400,
-            'MinTTL': 0,
-            'MaxTTL': 31536000
+            } for origin_id, domain in items]
         },
-        'Comment': 'Created by automation',
+        'DefaultCacheBehavior': _cache_behavior(items[0][0]),
+        'Comment': comment,
         'Enabled': True
     }
+    if behaviors:
+        distribution_config['CacheBehaviors'] = {'Quantity': len(behaviors), 'Items': behaviors}
+    if log_bucket:
+        distribution_config['Logging'] = {
+            'Enabled': True,
+            'IncludeCookies': False,
+            'Bucket': f'{log_bucket}.s3.amazonaws.com',
+            'Prefix': log_prefix
+        }
+    distribution_config['CallerReference'] = hashlib.sha256(
+        json.dumps(distribution_config, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+
+    cf = _cloudfront(session)
+    describe_cache.invalidate(lambda key: key[0] == 'cloudfront.distributions')
+    try:
+        response = cf.create_distribution(DistributionConfig=distribution_config)
+    except cf.exceptions.DistributionAlreadyExists:
+        domains = sorted(domain for _, domain in items)
+        for summary in list_distributions(session):
+            if sorted(origin['DomainName'] for origin in summary['Origins'].get('Items', [])) == domains:
+                print(f"Distribution {summary['Id']} for these origins already exists. Reusing it.")
+                return summary['Id']
+        raise
+    return response['Distribution']['Id']
 
-    response = cf.create_distribution(DistributionConfig=distribution_config)
-    distribution_id = response['Distribution']['Id']
-    return distribution_id
+
+def list_distributions(session=None):
+    """
+    Returns the summaries of all distributions of the account, paginated and
+    cached for the describe cache's TTL. The cache is kept per session (None:
+    the shared client registry), since sessions may belong to different accounts.
+    """
+    def load():
+        paginator = _cloudfront(session).get_paginator('list_distributions')
+        summaries = []
+        for page in paginator.paginate():
+            summaries.extend(page['DistributionList'].get('Items', []))
+        return summaries
+    return describe_cache.get_or_load(('cloudfront.distributions', session), load)
+
+
+def enable_logging(distribution_id, log_bucket, log_prefix='cloudfront-logs/', session=None, dry_run=False):
+    """
+    Points a distribution's standard logging at `log_bucket`, unless it already is.
+
+    Returns:
+        bool: Whether the distribution was (or, with `dry_run`, would be) updated.
+    """
+    cf = _cloudfront(session)
+    response = cf.get_distribution_config(Id=distribution_id)
+    config = response['DistributionConfig']
+    logging = {
+        'Enabled': True,
+        'IncludeCookies': config.get('Logging', {}).get('IncludeCookies', False),
+        'Bucket': f'{log_bucket}.s3.amazonaws.com',
+        'Prefix': log_prefix
+    }
+    if config.get('Logging') == logging:
+        return False
+    if not dry_run:
+        config['Logging'] = logging
+        cf.update_distribution(Id=distribution_id, IfMatch=response['ETag'], DistributionConfig=config)
+    return True
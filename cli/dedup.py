@@ -0,0 +1,298 @@
+import json
+import math
+import os
+
+import numpy as np
+
+from logparser import StringColumn
+
+DEFAULT_DEDUP_DIR = os.path.expanduser("~/.cloudfront-setup/dedup")
+REQUEST_ID_FIELD = "x-edge-request-id"
+
+# A block is one 64-byte cache line: all bits of a key live in the same block,
+# so a lookup touches one line of the memory map instead of k scattered pages.
+BLOCK_WORDS = 8
+BLOCK_BITS = BLOCK_WORDS * 64
+MAX_HASHES = 16
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def _mix64(x):
+    """splitmix64 finaliser over a uint64 array (wrapping arithmetic)."""
+    x = x + _GOLDEN
+    x = (x ^ (x >> np.uint64(30))) * _MIX1
+    x = (x ^ (x >> np.uint64(27))) * _MIX2
+    return x ^ (x >> np.uint64(31))
+
+
+def hash_column(column):
+    """
+    Returns a 64-bit hash per value of a `StringColumn`, computed from the raw
+    bytes without decoding: values are gathered into a zero-padded matrix of
+    8-byte words that are mixed column by column.
+
+    Returns:
+        numpy.ndarray: uint64 hashes.
+    """
+    lengths = (column.ends - column.starts).astype(np.int64)
+    if len(lengths) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    width = max(8, int(-(-lengths.max() // 8) * 8))
+    offsets = np.arange(width)
+    positions = np.minimum(column.starts[:, None] + offsets, max(len(column.buf) - 1, 0))
+    data = np.where(offsets < lengths[:, None], column.buf[positions], 0).astype(np.uint8)
+    words = np.ascontiguousarray(data).view("<u8")
+    h = _mix64(lengths.astype(np.uint64))
+    for j in range(words.shape[1]):
+        h = _mix64(h ^ words[:, j])
+    return h
+
+
+def hash_strings(values):
+    """
+    Returns the same hashes as `hash_column` for a list of Python strings.
+    """
+    encoded = [value.encode("utf-8") for value in values]
+    lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=len(encoded))
+    ends = np.cumsum(lengths)
+    buf = np.frombuffer(b"".join(encoded) or b"\0", dtype=np.uint8)
+    return hash_column(StringColumn(buf, ends - lengths, ends))
+
+
+def filter_parameters(memory_bytes, fp_rate, generations):
+    """
+    Sizes the generations of a filter for a total memory budget.
+
+    The overall false-positive rate is split evenly between the generations
+    (a lookup consults all of them); each generation's capacity is what its bits
+    hold at that rate.
+
+    Returns:
+        dict: blocks, hashes and capacity per generation.
+    """
+    fp_per_generation = fp_rate / generations
+    blocks = max(1, memory_bytes // generations // (BLOCK_WORDS * 8))
+    bits = blocks * BLOCK_BITS
+    bits_per_item = -math.log(fp_per_generation) / (math.log(2) ** 2)
+    return {
+        "blocks": int(blocks),
+        "hashes": int(min(MAX_HASHES, max(1, round(-math.log2(fp_per_generation))))),
+        "capacity": int(bits / bits_per_item),
+    }
+
+
+class DedupFilter:
+    """
+    A rotating, memory-mapped blocked Bloom filter of 64-bit key hashes.
+
+    The filter has a fixed number of generations, each a file of cache-line
+    sized blocks. Keys are looked up in every generation and added to the current
+    one; when the current generation reaches its capacity the oldest is cleared
+    and becomes current. Memory therefore stays fixed however many keys pass
+    through, and the filter always remembers at least the last
+    (generations - 1) x capacity keys, which for CloudFront request ids covers any
+    realistic redelivery or re-run window.
+
+    Everything lives under `path` and survives restarts: the bit arrays are
+    `numpy.memmap` files and `meta.json` records sizing, counts and the current
+    generation. A filter is reopened with its stored sizing; the arguments only
+    apply when it is created.
+
+    `filter_batch` only stages the keys it lets through: later lookups see them,
+    but they reach the files on `commit`, which the caller runs once the records
+    are stored, so records lost to a failure or crash are not dropped as
+    duplicates on a rerun.
+
+    Lookups may report a new key as seen with about `fp_rate` probability (a
+    little more, since a blocked filter trades some accuracy for locality); a
+    seen key is never reported as new.
+    """
+
+    def __init__(self, path=DEFAULT_DEDUP_DIR, memory_mb=256, fp_rate=1e-3, generations=4):
+        self.path = path
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.meta = dict(filter_parameters(int(memory_mb * 2**20), fp_rate, generations),
+                             fp_rate=fp_rate, generations=generations, current=0, counts=[0] * generations)
+        self._generations = [self._open_generation(i) for i in range(self.meta["generations"])]
+        self._staged = None
+        self._pending = []
+        self.seen = 0
+        self.duplicates = 0
+        self._write_meta()
+
+    def _open_generation(self, index):
+        gen_path = os.path.join(self.path, f"gen-{index}.bloom")
+        shape = (self.meta["blocks"], BLOCK_WORDS)
+        mode = "r+" if os.path.exists(gen_path) else "w+"
+        return np.memmap(gen_path, dtype=np.uint64, mode=mode, shape=shape)
+
+    def _write_meta(self):
+        tmp_path = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, "meta.json"))
+
+    @property
+    def capacity(self):
+        """Keys the filter is guaranteed to remember."""
+        return (self.meta["generations"] - 1) * self.meta["capacity"]
+
+    def _locate(self, hashes):
+        blocks = (hashes % np.uint64(self.meta["blocks"])).astype(np.int64)
+        masks = np.zeros((len(hashes), BLOCK_WORDS), dtype=np.uint64)
+        rows = np.arange(len(hashes))
+        g = hashes
+        for _ in range(self.meta["hashes"]):
+            g = _mix64(g)
+            bit = (g >> np.uint64(55)).astype(np.int64)  # 0..511
+            masks[rows, bit >> 6] |= np.left_shift(np.uint64(1), (bit & 63).astype(np.uint64))
+        return blocks, masks
+
+    def _insert(self, generation, blocks, masks):
+        # Several keys may share a block: OR their masks together first, since a
+        # fancy-indexed |= would keep only one of them.
+        if len(blocks) == 0:
+            return
+        order = np.argsort(blocks, kind="stable")
+        blocks, masks = blocks[order], masks[order]
+        starts = np.flatnonzero(np.r_[True, blocks[1:] != blocks[:-1]])
+        generation[blocks[starts]] |= np.bitwise_or.reduceat(masks, starts, axis=0)
+
+    def _seen(self, blocks, masks, generations):
+        seen = np.zeros(len(blocks), dtype=bool)
+        for generation in generations:
+            seen |= ((generation[blocks] & masks) == masks).all(axis=1)
+        return seen
+
+    def _add(self, blocks, masks):
+        added = 0
+        while added < len(blocks):
+            current = self.meta["current"]
+            room = max(0, self.meta["capacity"] - self.meta["counts"][current])
+            if room == 0:
+                self._rotate()
+                continue
+            part = slice(added, added + room)
+            self._insert(self._generations[current], blocks[part], masks[part])
+            self.meta["counts"][current] += len(blocks[part])
+            added += len(blocks[part])
+
+    def _check(self, hashes):
+        # Returns the mask of new hashes and their blocks and masks; staged keys
+        # count as seen.
+        first = np.zeros(len(hashes), dtype=bool)
+        first[np.unique(hashes, return_index=True)[1]] = True
+        blocks, masks = self._locate(hashes)
+        generations = self._generations if self._staged is None else self._generations + [self._staged]
+        new = first & ~self._seen(blocks, masks, generations)
+        self.seen += len(hashes)
+        self.duplicates += int(len(hashes) - new.sum())
+        return new, blocks, masks
+
+    def check_and_add(self, hashes):
+        """
+        Returns a mask of the hashes not seen before (counting earlier occurrences
+        within the same array) and remembers all of them.
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if len(hashes) == 0:
+            return np.zeros(0, dtype=bool)
+        new, blocks, masks = self._check(hashes)
+        self._add(blocks[new], masks[new])
+        return new
+
+    def check_and_stage(self, hashes):
+        """
+        Like `check_and_add`, but the new hashes are only staged: later checks
+        treat them as seen, and they are remembered on disk by `commit`, once
+        the records they stand for are safely stored.
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if len(hashes) == 0:
+            return np.zeros(0, dtype=bool)
+        new, blocks, masks = self._check(hashes)
+        if self._staged is None:
+            self._staged = np.zeros((self.meta["blocks"], BLOCK_WORDS), dtype=np.uint64)
+        self._insert(self._staged, blocks[new], masks[new])
+        self._pending.append(hashes[new])
+        return new
+
+    @property
+    def pending(self):
+        """Staged keys not committed yet."""
+        return sum(len(hashes) for hashes in self._pending)
+
+    def commit(self):
+        """
+        Remembers the staged keys and writes the filter to disk.
+        """
+        if self._pending:
+            blocks, masks = self._locate(np.concatenate(self._pending))
+            self._add(blocks, masks)
+        self.discard()
+        self.flush()
+
+    def discard(self):
+        """
+        Forgets the staged keys, e.g. when their records failed to index; they
+        count as new again.
+        """
+        if self._pending:
+            blocks, _ = self._locate(np.concatenate(self._pending))
+            self._staged[blocks] = 0
+        self._pending = []
+
+    def _rotate(self):
+        oldest = (self.meta["current"] + 1) % self.meta["generations"]
+        self._generations[oldest][:] = 0
+        self.meta["counts"][oldest] = 0
+        self.meta["current"] = oldest
+
+    def filter_batch(self, batch, field=REQUEST_ID_FIELD):
+        """
+        Returns the batch without records whose request id was seen before.
+        Records without an id ('-') are always kept. The ids of the kept records
+        are staged, so they are only remembered across runs after `commit`.
+        """
+        column = batch[field]
+        keep = self.check_and_stage(hash_column(column))
+        keep |= column.equals("-")
+        return batch if keep.all() else batch.take(np.flatnonzero(keep))
+
+    def flush(self):
+        """
+        Writes the bit arrays and counters to disk.
+        """
+        for generation in self._generations:
+            generation.flush()
+        self._write_meta()
+
+    def close(self):
+        """
+        Writes the filter to disk; keys still staged are not remembered.
+        """
+        self.flush()
+        self._generations = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self):
+        return {
+            "seen": self.seen,
+            "duplicates": self.duplicates,
+            "memory_mb": round(self.meta["generations"] * self.meta["blocks"] * BLOCK_WORDS * 8 / 2**20, 1),
+            "capacity": self.capacity,
+            "fp_rate": self.meta["fp_rate"],
+        }
@@ -1,86 +1,246 @@
+import argparse
+import json
 import sys
 import os
 
 # Add terraform directory to sys.path dynamically
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'terraform')))
 
-from utils import get_boto3_session, ask_input, render_and_apply_terraform
+from utils import get_boto3_session, ask_input, build_tf_vars
 from ec2 import (
     launch_ec2,
     get_existing_instance_dns, # This function needs the region string, not the session object
-    setup_instance,
 )
 from ec2 import is_nginx_installed
-from ec2 import install_nginx
+from ec2 import install_nginx, tune_nginx
 from ec2 import install_opensearch_stack
-# REMOVE THIS LINE: from cloudfront import create_distribution
+from bundle import build_bundle, install_bundle, push_bundle
+from index_templates import install_index_template
+from orchestrator import DEFAULT_STATE, Stage, run_stages
+from readiness import dashboards_probe, opensearch_probe, tcp_probe, wait_until_ready
 from s3 import ensure_bucket
+from ssh import ssh_manager
+from tfcache import cached_apply, cached_init
+from tracing import export, instrument_boto3, span, tracer
 
-def main():
-    region = ask_input("Enter AWS Region: ")
-    session = get_boto3_session(region) # session object is correctly created here
+DEFAULT_AMI_ID = "ami-09d56f8956ab235b3"
+DEFAULT_INSTANCE_TYPE = "t3.medium"
 
-    key_name = ask_input("Enter EC2 Key Pair name: ")
-    key_path = ask_input("Enter full path to your private key file (e.g. /home/anjali/.ssh/data.pem): ")
-    instance_type = ask_input("Enter EC2 instance type [default: t3.medium]: ", default="t3.medium")
+def prompt_config():
+    """
+    Asks for the deploy settings interactively, the way deploy has always worked.
+    """
+    config = {}
+    config["region"] = ask_input("Enter AWS Region: ")
+    config["key_name"] = ask_input("Enter EC2 Key Pair name: ")
+    config["key_path"] = ask_input("Enter full path to your private key file (e.g. /home/anjali/.ssh/data.pem): ")
+    config["instance_type"] = ask_input("Enter EC2 instance type [default: t3.medium]: ", default=DEFAULT_INSTANCE_TYPE)
 
-    use_existing_ec2_input = ask_input("Use existing EC2 instance? (y/n): ").lower()
-    use_existing_ec2 = use_existing_ec2_input == 'y'
+    if ask_input("Use existing EC2 instance? (y/n): ").lower() == 'y':
+        config["instance_id"] = ask_input("Enter existing EC2 Instance ID: ")
 
-    if use_existing_ec2:
-        instance_id = ask_input("Enter existing EC2 Instance ID: ")
-        # --- FIX IS HERE ---
-        # Pass the 'region' string directly, as get_existing_instance_dns expects a region string
-        ec2_dns = get_existing_instance_dns(region, instance_id)
-        # --- END FIX ---
-    else:
-        instance_id, ec2_dns = launch_ec2(region, key_name, instance_type)
-        print(f"Launched new EC2: {ec2_dns}")
-
-    print(f"Using EC2 DNS: {ec2_dns}")
-
-    use_existing_distribution_input = ask_input("Use existing CloudFront distribution? (y/n): ").lower()
-    use_existing_distribution = use_existing_distribution_input == 'y'
-    distribution_id_input = None
-
-    if use_existing_distribution:
-        distribution_id_input = ask_input("Enter existing CloudFront Distribution ID: ")
-        print(f"Using existing CloudFront Distribution ID: {distribution_id_input}")
-    else:
-        print("Terraform will create a new CloudFront Distribution.")
+    if ask_input("Use existing CloudFront distribution? (y/n): ").lower() == 'y':
+        config["distribution_id"] = ask_input("Enter existing CloudFront Distribution ID: ")
 
     use_existing_bucket = ask_input("Use existing S3 bucket? (y/n): ").lower() == 'y'
     if use_existing_bucket:
-        bucket_name = ask_input("Enter existing bucket name: ")
+        config["bucket_name"] = ask_input("Enter existing bucket name: ")
     else:
-        bucket_name = ask_input("Enter new bucket name: ")
-        ensure_bucket(session, bucket_name, region)
-
-    print("Logging enabled on CloudFront distribution.")
-
-    terraform_outputs = render_and_apply_terraform(
-        region=region,
-        bucket_name=bucket_name,
-        key_name=key_name,
-        ami_id="ami-09d56f8956ab235b3",
-        instance_type=instance_type,
-        ec2_instance_id=instance_id,
-        use_existing_instance=use_existing_ec2,
-        use_existing_cloudfront=use_existing_distribution,
-        existing_cloudfront_id=distribution_id_input,
-        origin_domain=ec2_dns
+        config["bucket_name"] = ask_input("Enter new bucket name: ")
+    config["create_bucket"] = not use_existing_bucket
+    return config
+
+def load_config(path):
+    """
+    Reads a JSON deploy config, e.g.
+
+        {"region": "us-east-1", "key_name": "data", "key_path": "~/.ssh/data.pem",
+         "instance_type": "t3.large", "bucket_name": "my-cf-logs", "create_bucket": true}
+
+    Optional keys: instance_id (reuse an instance), distribution_id (reuse a
+    distribution), ami_id, bundle (true: provision from the offline bundle),
+    follow (true: create the SQS queue that `follow.py` consumes), benchmark
+    (true: run the indexing benchmark on the new node; benchmark_docs documents).
+
+    Raises:
+        Exception: If a required key is missing.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    missing = [key for key in ("region", "key_name", "key_path", "bucket_name") if not config.get(key)]
+    if missing:
+        raise Exception(f"Deploy config {path} is missing: {', '.join(missing)}")
+    config["key_path"] = os.path.expanduser(config["key_path"])
+    config.setdefault("instance_type", DEFAULT_INSTANCE_TYPE)
+    config.setdefault("create_bucket", True)
+    return config
+
+# --- Stages. Each gets the config and its dependencies' results and returns a JSON-serialisable result.
+
+def stage_instance(config, results):
+    region = config["region"]
+    if config.get("instance_id"):
+        instance_id = config["instance_id"]
+        ec2_dns = get_existing_instance_dns(region, instance_id)
+        if not ec2_dns:
+            raise Exception(f"Could not resolve a public address for instance {instance_id}")
+    else:
+        instance_id, ec2_dns = launch_ec2(region, config["key_name"], config["instance_type"])
+        print(f"Launched new EC2: {ec2_dns}")
+    print(f"Using EC2 DNS: {ec2_dns}")
+    return {"instance_id": instance_id, "dns": ec2_dns}
+
+def stage_bucket(config, results):
+    if config.get("create_bucket"):
+        ensure_bucket(get_boto3_session(config["region"]), config["bucket_name"], config["region"])
+    return {"bucket_name": config["bucket_name"]}
+
+def stage_terraform_init(config, results):
+    return {"skipped": cached_init()}
+
+def stage_terraform_apply(config, results):
+    instance = results["instance"]
+    tf_vars = build_tf_vars(
+        region=config["region"],
+        bucket_name=config["bucket_name"],
+        key_name=config["key_name"],
+        ami_id=config.get("ami_id", DEFAULT_AMI_ID),
+        instance_type=config["instance_type"],
+        ec2_instance_id=instance["instance_id"],
+        use_existing_instance=bool(config.get("instance_id")),
+        use_existing_cloudfront=bool(config.get("distribution_id")),
+        existing_cloudfront_id=config.get("distribution_id"),
+        origin_domain=instance["dns"],
+        enable_follow=bool(config.get("follow"))
     )
-
-    cloudfront_distribution_id = terraform_outputs.get('cloudfront_distribution_id', 'N/A')
+    return cached_apply(tf_vars)
+
+def stage_ssh_ready(config, results):
+    _, seconds = wait_until_ready("SSH", tcp_probe(results["instance"]["dns"], 22), timeout=300)
+    return {"seconds": round(seconds, 1)}
+
+def stage_bundle_build(config, results):
+    # Runs while the instance boots; a cached bundle is reused.
+    return {"path": build_bundle()} if config.get("bundle") else {}
+
+def stage_bundle(config, results):
+    path = results["bundle_build"].get("path")
+    if path:
+        ec2_dns = results["instance"]["dns"]
+        ssh_client = ssh_manager.client(ec2_dns, config["key_path"])
+        push_bundle(ssh_client, path, label=ec2_dns)
+        install_bundle(ssh_client, path, label=ec2_dns)
+    return {}
+
+def stage_nginx(config, results):
+    ec2_dns = results["instance"]["dns"]
+    if not is_nginx_installed(ec2_dns, config["key_path"]):
+        install_nginx(ec2_dns, config["key_path"], config["instance_type"], config["region"])
+    else:
+        tune_nginx(ec2_dns, config["key_path"], config["instance_type"], config["region"])
+    return {}
+
+def stage_opensearch(config, results):
+    # Readiness and the index template are separate stages, so they start the
+    # moment the containers are up.
+    install_opensearch_stack(results["instance"]["dns"], config["key_path"], install_template=False,
+                             instance_type=config["instance_type"], region=config["region"])
+    return {}
+
+def stage_opensearch_ready(config, results):
+    endpoint = f"http://{results['instance']['dns']}:9200"
+    _, seconds = wait_until_ready("OpenSearch", opensearch_probe(endpoint), timeout=600)
+    return {"endpoint": endpoint, "seconds": round(seconds, 1)}
+
+def stage_index_template(config, results):
+    install_index_template(results["opensearch_ready"]["endpoint"])
+    return {}
+
+def stage_dashboards_ready(config, results):
+    url = f"http://{results['instance']['dns']}:5601"
+    _, seconds = wait_until_ready("OpenSearch Dashboards", dashboards_probe(url), timeout=600)
+    return {"dashboards_url": url, "seconds": round(seconds, 1)}
+
+def stage_indexing_benchmark(config, results):
+    if not config.get("benchmark"):
+        return {}
+    # Imported here: only needed when the benchmark runs.
+    from bench import bench_indexing
+    result = bench_indexing(results["opensearch_ready"]["endpoint"], docs=config.get("benchmark_docs", 200000))["tuned"]
+    return {key: result[key] for key in ("docs_per_s", "p99_latency_s", "heap_max_mb", "rejected", "gc_ms")}
+
+def deploy_stages():
+    """
+    The deploy as a dependency graph. The bucket and `terraform init` do not need
+    the instance, so they run while it boots; nginx setup does not need Terraform,
+    so it runs alongside `terraform apply`. nginx and OpenSearch both use apt on
+    the same host, so they stay in sequence. Readiness of SSH, OpenSearch and
+    Dashboards is probed by stages of its own, so whatever depends on a component
+    starts as soon as that component answers. With `bundle` set, the offline
+    bundle is built (or taken from the cache) while the instance boots and
+    installed before nginx, so neither apt nor Docker Hub is needed. With
+    `benchmark` set, an indexing benchmark checks the instance-sized node last.
+    """
+    return [
+        Stage("instance", stage_instance),
+        Stage("bucket", stage_bucket),
+        Stage("terraform_init", stage_terraform_init),
+        Stage("terraform_apply", stage_terraform_apply, deps=["instance", "bucket", "terraform_init"]),
+        Stage("ssh_ready", stage_ssh_ready, deps=["instance"]),
+        Stage("bundle_build", stage_bundle_build),
+        Stage("bundle", stage_bundle, deps=["instance", "ssh_ready", "bundle_build"]),
+        Stage("nginx", stage_nginx, deps=["instance", "ssh_ready", "bundle"]),
+        Stage("opensearch", stage_opensearch, deps=["instance", "nginx"]),
+        Stage("opensearch_ready", stage_opensearch_ready, deps=["instance", "opensearch"]),
+        Stage("index_template", stage_index_template, deps=["opensearch_ready"]),
+        Stage("dashboards_ready", stage_dashboards_ready, deps=["instance", "opensearch"]),
+        Stage("indexing_benchmark", stage_indexing_benchmark, deps=["opensearch_ready", "index_template"]),
+    ]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Deploy the CloudFront logging and OpenSearch stack.")
+    parser.add_argument("--config", help="JSON deploy config; prompts interactively when omitted")
+    parser.add_argument("--state", default=DEFAULT_STATE, help="File recording finished stages for resuming")
+    parser.add_argument("--fresh", action="store_true", help="Ignore previous progress and run every stage")
+    parser.add_argument("--workers", type=int, default=4, help="Stages allowed to run at once")
+    parser.add_argument("--trace", metavar="PREFIX",
+                        help="Write the timing tree to PREFIX.json and a Chrome trace to PREFIX.trace.json")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = load_config(args.config) if args.config else prompt_config()
+    instrument_boto3()
+
+    try:
+        with span("deploy"):
+            results = run_stages(deploy_stages(), config, state_path=args.state,
+                                 max_workers=args.workers, fresh=args.fresh)
+    except Exception as e:
+        print(f"Deploy failed: {e}")
+        sys.exit(1)
+    finally:
+        # All remote steps shared one SSH connection per host.
+        ssh_manager.close()
+        print("\nDeploy timings:")
+        tracer.print_summary()
+        if args.trace:
+            print("Trace written to {} and {}".format(*export(args.trace)))
+
+    cloudfront_distribution_id = results["terraform_apply"].get('cloudfront_distribution_id', 'N/A')
     print(f"Final CloudFront Distribution ID: {cloudfront_distribution_id}")
-
-    if not is_nginx_installed(ec2_dns, key_path):
-        install_nginx(ec2_dns, key_path)
-
-    install_opensearch_stack(ec2_dns, key_path)
-
-    print(f"\nOpenSearch Dashboard should be available at: http://{ec2_dns}:5601")
+    for name in ("ssh", "opensearch", "dashboards"):
+        print(f"Time to ready, {name}: {results[name + '_ready']['seconds']:.1f} s")
+    benchmark = results["indexing_benchmark"]
+    if benchmark:
+        print(f"Indexing benchmark: {benchmark['docs_per_s']:,.0f} docs/s, p99 bulk latency {benchmark['p99_latency_s']} s, "
+              f"{benchmark['rejected']} rejections, {benchmark['gc_ms']} ms GC with a {benchmark['heap_max_mb']} MiB heap.")
+    print(f"\nOpenSearch Dashboard is available at: {results['dashboards_ready']['dashboards_url']}")
     print(f"CloudFront URL (may take time to propagate): https://{cloudfront_distribution_id}.cloudfront.net")
+    queue_url = results["terraform_apply"].get("follow_queue_url")
+    if queue_url:
+        print(f"Follow new logs with: python cli/follow.py --region {config['region']} --queue-url {queue_url} "
+              f"--endpoint http://{results['instance']['dns']}:9200")
 
 if __name__ == "__main__":
     main()
@@ -1,32 +1,59 @@
 import os
-import time
-import paramiko
-from scp import SCPClient
-import boto3
+
+from artifacts import STATE_DIR, Artifact, sync_artifacts
+from awsclients import clients, describe_cache, describe_instances, remember_instances
+from bundle import BUNDLE_PORT, install_bundle, push_bundle
+from opensearch import wait_for_opensearch
+from readiness import ec2_running_probe, wait_until_ready
+from index_templates import install_index_template
+from nginx import BROTLI_PACKAGES, nginx_settings, render_nginx_conf
+from opensearch_tuning import opensearch_settings, sysctl_conf
+from ssh import execute, run_script, ssh_manager
+from tracing import span, traced
 
 # Define the directory where Docker Compose and installation scripts are located
 FILES_DIR = os.path.join(os.path.dirname(__file__), "../files")
 
+SECURITY_GROUP = 'opensearch-sg'
+
 def get_ec2_client(region):
     """
-    Returns a boto3 EC2 client for the specified region.
+    Returns the shared boto3 EC2 client for the specified region.
     """
-    return boto3.client("ec2", region_name=region)
+    return clients.client("ec2", region)
 
-def launch_ec2(region, key_name, instance_type):
+def ensure_security_group(client):
     """
-    Launches an EC2 instance with a security group configured for OpenSearch and NGINX.
+    Returns the ID of the 'opensearch-sg' security group, creating it in the first
+    VPC of the region if needed.
+
+    Besides SSH, OpenSearch, Dashboards and HTTP from anywhere, members of the
+    group may reach each other on the OpenSearch transport port, which a
+    multi-node cluster needs, and on the port hosts share the provisioning bundle
+    on; these rules are added to groups created before they existed.
+
+    An existing group costs one DescribeSecurityGroups call, and the result is
+    cached per region so further launches in the same process make none.
 
     Args:
-        region (str): The AWS region to launch the instance in.
-        key_name (str): The name of the EC2 key pair to use.
-        instance_type (str): The desired EC2 instance type (e.g., 't2.micro').
+        client (botocore.client.EC2): EC2 client of the region.
 
     Returns:
-        tuple: A tuple containing the instance ID and its public DNS name.
+        str: The security group ID.
     """
-    ec2 = boto3.resource('ec2', region_name=region)
-    client = get_ec2_client(region)
+    cache_key = ("ec2.security_group", client.meta.region_name, SECURITY_GROUP)
+    sg_id = describe_cache.get(cache_key)
+    if sg_id:
+        return sg_id
+
+    groups = client.describe_security_groups(
+        Filters=[{'Name': 'group-name', 'Values': [SECURITY_GROUP]}])['SecurityGroups']
+    if groups:
+        sg_id = groups[0]['GroupId']
+        present = {permission.get('FromPort') for permission in groups[0]['IpPermissions']
+                   if any(pair.get('GroupId') == sg_id for pair in permission.get('UserIdGroupPairs', []))}
+        _authorize_group_ports(client, sg_id, [port for port in (9300, BUNDLE_PORT) if port not in present])
+        return describe_cache.put(cache_key, sg_id, ttl=3600)
 
     # Get the default VPC ID
     # This assumes there's at least one VPC. In a complex environment, you might
@@ -41,7 +68,6 @@ def launch_ec2(region, key_name, instance_type):
         raise
 
     # Create a security group for OpenSearch and NGINX
-    sg_id = None
     try:
         sg = client.create_security_group(
             GroupName='opensearch-sg',
@@ -59,34 +85,144 @@ def launch_ec2(region, key_name, instance_type):
         ])
         print(f"Security Group 'opensearch-sg' created with ID: {sg_id}")
     except client.exceptions.ClientError as e:
-        if "AlreadyExists" in str(e):
+        if "AlreadyExists" in str(e) or "InvalidGroup.Duplicate" in str(e):
             print("Security Group 'opensearch-sg' already exists. Reusing it.")
             sg_id = client.describe_security_groups(GroupNames=['opensearch-sg'])['SecurityGroups'][0]['GroupId']
         else:
             raise e
 
+    _authorize_group_ports(client, sg_id, (9300, BUNDLE_PORT))
+    return describe_cache.put(cache_key, sg_id, ttl=3600)
+
+def _authorize_group_ports(client, sg_id, ports):
+    """
+    Lets members of the group reach each other on `ports` (OpenSearch transport,
+    bundle fan-out).
+    """
+    # One call per rule: a request with a rule that already exists fails as a whole.
+    for port in ports:
+        try:
+            client.authorize_security_group_ingress(GroupId=sg_id, IpPermissions=[
+                {'IpProtocol': 'tcp', 'FromPort': port, 'ToPort': port, 'UserIdGroupPairs': [{'GroupId': sg_id}]},
+            ])
+        except client.exceptions.ClientError as e:
+            if "Duplicate" not in str(e):
+                raise
+
+def launch_ec2(region, key_name, instance_type):
+    """
+    Launches an EC2 instance with a security group configured for OpenSearch and NGINX.
+
+    Args:
+        region (str): The AWS region to launch the instance in.
+        key_name (str): The name of the EC2 key pair to use.
+        instance_type (str): The desired EC2 instance type (e.g., 't2.micro').
+
+    Returns:
+        tuple: A tuple containing the instance ID and its public DNS name.
+    """
+    client = get_ec2_client(region)
+
+    with span("ec2.ensure_security_group"):
+        sg_id = ensure_security_group(client)
+
     # Launch the EC2 instance
     # ami-084568db4383264d4 is a specific Ubuntu Server 20.04 LTS AMI.
     # Ensure this AMI ID is valid for your chosen AWS region.
-    instances = ec2.create_instances(
-        ImageId='ami-084568db4383264d4',
-        InstanceType=instance_type,
-        KeyName=key_name,
-        MinCount=1,
-        MaxCount=1,
-        SecurityGroupIds=[sg_id],
-        TagSpecifications=[{
-            'ResourceType': 'instance',
-            'Tags': [{'Key': 'Name', 'Value': 'OpenSearch-Instance'}]
-        }]
-    )
-
-    instance = instances[0]
-    print(f"Launching EC2 instance with ID: {instance.id}...")
-    instance.wait_until_running() # Wait for the instance to enter 'running' state
-    instance.load() # Reload instance attributes to get public_dns_name etc.
-    print(f"EC2 instance {instance.id} is running.")
-    return instance.id, instance.public_dns_name
+    with span("ec2.create_instances", count=1):
+        instances = client.run_instances(
+            ImageId='ami-084568db4383264d4',
+            InstanceType=instance_type,
+            KeyName=key_name,
+            MinCount=1,
+            MaxCount=1,
+            SecurityGroupIds=[sg_id],
+            TagSpecifications=[{
+                'ResourceType': 'instance',
+                'Tags': [{'Key': 'Name', 'Value': 'OpenSearch-Instance'}]
+            }]
+        )['Instances']
+
+    instance_id = instances[0]['InstanceId']
+    print(f"Launching EC2 instance with ID: {instance_id}...")
+    # Probe with short jittered backoff instead of the boto3 waiter's fixed 15 s polls.
+    with span("ec2.wait_until_running", instance_id=instance_id):
+        described, _ = wait_until_ready(f"EC2 instance {instance_id}", ec2_running_probe(client, [instance_id]))
+    remember_instances(region, described)
+    print(f"EC2 instance {instance_id} is running.")
+    return instance_id, described[0].get('PublicDnsName') or described[0].get('PublicIpAddress')
+
+def describe_hosts(region, instance_ids):
+    """
+    Describes instances as the host records used by fleet mode.
+
+    Args:
+        region (str): The AWS region of the instances.
+        instance_ids (list): EC2 instance IDs.
+
+    Returns:
+        list: One dict per instance, in the order given, with instance_id, dns
+            (public DNS name, or public IP), private_ip and zone.
+    """
+    found = {}
+    for instance in describe_instances(region, instance_ids).values():
+        found[instance['InstanceId']] = {
+            "instance_id": instance['InstanceId'],
+            "dns": instance.get('PublicDnsName') or instance.get('PublicIpAddress'),
+            "private_ip": instance.get('PrivateIpAddress'),
+            "zone": instance['Placement']['AvailabilityZone'],
+        }
+    missing = [instance_id for instance_id in instance_ids if instance_id not in found]
+    if missing:
+        raise Exception(f"Instances not found: {', '.join(missing)}")
+    return [found[instance_id] for instance_id in instance_ids]
+
+def launch_fleet(region, key_name, instance_type, count, name="OpenSearch-Fleet"):
+    """
+    Launches `count` identical instances with a single RunInstances call and waits
+    for all of them to be running.
+
+    MinCount equals MaxCount, so EC2 either starts the whole fleet or none of it
+    instead of leaving a partial fleet behind on capacity errors. The call names
+    no subnet, so every instance lands in the same availability zone and the
+    nodes' zone awareness has nothing to spread across.
+
+    Args:
+        region (str): The AWS region to launch the instances in.
+        key_name (str): The name of the EC2 key pair to use.
+        instance_type (str): The desired EC2 instance type.
+        count (int): Number of instances.
+        name (str): Value of the Name and Fleet tags.
+
+    Returns:
+        list: Host records as returned by `describe_hosts`.
+    """
+    client = get_ec2_client(region)
+    with span("ec2.ensure_security_group"):
+        sg_id = ensure_security_group(client)
+
+    with span("ec2.create_instances", count=count):
+        instances = client.run_instances(
+            ImageId='ami-084568db4383264d4',
+            InstanceType=instance_type,
+            KeyName=key_name,
+            MinCount=count,
+            MaxCount=count,
+            SecurityGroupIds=[sg_id],
+            TagSpecifications=[{
+                'ResourceType': 'instance',
+                'Tags': [{'Key': 'Name', 'Value': name}, {'Key': 'Fleet', 'Value': name}]
+            }]
+        )['Instances']
+    instance_ids = [instance['InstanceId'] for instance in instances]
+    print(f"Launching {count} EC2 instances: {', '.join(instance_ids)}...")
+    # One probe checks the whole fleet with a single DescribeInstances per round;
+    # its last answer is cached, so describe_hosts below makes no call.
+    with span("ec2.wait_until_running", count=count):
+        described, _ = wait_until_ready(f"{count} EC2 instances", ec2_running_probe(client, instance_ids))
+    remember_instances(region, described)
+    print(f"All {count} instances are running.")
+    return describe_hosts(region, instance_ids)
 
 def get_existing_instance_dns(region, instance_id):
     """
@@ -99,90 +235,55 @@ def get_existing_instance_dns(region, instance_id):
     Returns:
         str: The public DNS name or public IP address of the instance.
     """
-    ec2 = boto3.client('ec2', region_name=region)
     try:
-        # Describe instances to get details for the specified ID
-        response = ec2.describe_instances(InstanceIds=[instance_id])
-        instance = response['Reservations'][0]['Instances'][0]
+        # Answered from the describe cache when the instance was described recently
+        instance = describe_instances(region, [instance_id])[instance_id]
         # Prefer PublicDnsName, fall back to PublicIpAddress if DNS is not available
         return instance.get('PublicDnsName') or instance.get('PublicIpAddress')
     except Exception as e:
         print(f"Error getting instance DNS for {instance_id}: {e}")
         return None
 
-def connect_ssh(hostname, key_path, username='ubuntu', max_attempts=10, delay=10):
+def connect_ssh(hostname, key_path, username='ubuntu'):
     """
-    Establishes an SSH connection to the given hostname. Retries on failure.
+    Returns the shared SSH client for the given hostname, connecting (with
+    jittered exponential backoff) only if no live connection exists yet.
+
+    Every step of a deploy goes through this, so the host is authenticated once
+    and later steps just open new channels on the same transport.
 
     Args:
         hostname (str): The hostname or IP address to connect to.
         key_path (str): The path to the SSH private key file.
         username (str): The username for the SSH connection. Defaults to 'ubuntu'.
-        max_attempts (int): Maximum number of connection attempts.
-        delay (int): Delay in seconds between attempts.
 
     Returns:
         paramiko.SSHClient: An active SSH client object.
     Raises:
-        Exception: If SSH connection fails after max_attempts.
+        Exception: If no SSH connection could be established before the manager's timeout.
     """
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy()) # Automatically add host keys
-
-    for attempt in range(1, max_attempts + 1):
-        try:
-            print(f"Attempt {attempt}/{max_attempts}: Connecting to {hostname} via SSH...")
-            ssh.connect(hostname, username=username, key_filename=key_path)
-            print("SSH connection established.")
-            return ssh
-        except (paramiko.BadHostKeyException, paramiko.AuthenticationException,
-                paramiko.SSHException, paramiko.buffered_pipe.PipeTimeout,
-                EOFError) as e:
-            print(f"SSH connection failed (attempt {attempt}): {e}")
-            if attempt < max_attempts:
-                print(f"Waiting {delay} seconds before retrying...")
-                time.sleep(delay)
-            else:
-                # Raise an exception if all attempts fail
-                raise Exception(f"Failed to establish SSH connection to {hostname} after {max_attempts} attempts.")
+    return ssh_manager.client(hostname, key_path, username)
 
 def run_commands(ssh_client, commands):
     """
-    Executes a list of shell commands on the remote server via SSH.
+    Executes a list of shell commands on the remote server as one pipelined script.
 
     Args:
         ssh_client (paramiko.SSHClient): The active SSH client.
         commands (list): A list of shell commands to execute.
 
+    Returns:
+        ScriptResult: The exit code of each step and the tail of its output.
+
     Raises:
         Exception: If any command fails to execute successfully.
     """
-    for cmd in commands:
-        print(f"Running command: {cmd}")
-        # Use get_transport().open_session() for better handling of stderr
-        channel = ssh_client.get_transport().open_session()
-        channel.exec_command(cmd)
-        
-        # Read stdout and stderr
-        stdout = channel.makefile('rb', -1)
-        stderr = channel.makefile_stderr('rb', -1)
-        
-        output = stdout.read().decode('utf-8').strip()
-        error_output = stderr.read().decode('utf-8').strip()
-        
-        exit_status = channel.recv_exit_status() # Get the exit status
-
-        if exit_status != 0:
-            raise Exception(f"Command '{cmd}' failed with exit status {exit_status}:\n{error_output}")
-        if output:
-            print(f"Output: {output}")
-
-# --- START OF MODIFIED FUNCTIONS TO FIX NameError ---
+    label = ssh_client.get_transport().getpeername()[0]
+    return run_script(ssh_client, commands, label=label)
 
 def is_nginx_installed(ec2_dns, key_path):
     """
-    Checks if NGINX is installed on the remote server by establishing an SSH connection
-    and executing 'nginx -v'.
+    Checks if NGINX is installed on the remote server by executing 'nginx -v'.
 
     Args:
         ec2_dns (str): The public DNS name of the EC2 instance.
@@ -192,48 +293,84 @@ def is_nginx_installed(ec2_dns, key_path):
         bool: True if NGINX is installed, False otherwise.
     """
     print(f"Checking if NGINX is installed on {ec2_dns}...")
-    ssh_client = None # Initialize to None for robust error handling
     try:
-        # Establish SSH connection
         ssh_client = connect_ssh(ec2_dns, key_path)
-
-        # Execute the command to check NGINX version
-        # 'nginx -v' typically prints version info to stderr, not stdout
-        stdin, stdout, stderr = ssh_client.exec_command("nginx -v")
-        error_output = stderr.read().decode().strip() # Read stderr for version info
-        
-        exit_status = stdout.channel.recv_exit_status() # Get the exit status
-
-        # Check if the command exited successfully (status 0) AND if NGINX version string is found
+        # 'nginx -v' prints version info to stderr, not stdout
+        exit_status, _, error_output = execute(ssh_client, "nginx -v")
         if exit_status == 0 and "nginx version:" in error_output.lower():
             print("NGINX is already installed.")
             return True
-        else:
-            print("NGINX is not installed.")
-            # Optional: print more details for debugging
-            # print(f"Nginx check output (stderr): {error_output}")
-            # print(f"Nginx check exit status: {exit_status}")
-            return False
-
+        print("NGINX is not installed.")
+        return False
     except Exception as e:
         print(f"An error occurred while checking NGINX installation: {e}")
         return False
-    finally:
-        if ssh_client and ssh_client.get_transport() and ssh_client.get_transport().is_active():
-            ssh_client.close()
-            print("SSH connection closed after NGINX check.")
 
 
-def install_nginx(ec2_dns, key_path):
+@traced("nginx.configure")
+def configure_nginx(ssh_client, instance_type, region=None, upstream=None):
     """
-    Installs and starts NGINX on the remote server by establishing an SSH connection.
+    Renders an nginx configuration tuned for the instance type, uploads it over an
+    existing SSH connection, validates it with `nginx -t` and reloads nginx.
+
+    The previous configuration is kept as /etc/nginx/nginx.conf.bak and restored
+    if validation fails; the stock file is kept once as nginx.conf.orig. When the
+    rendered file matches the one already in place nothing is uploaded or reloaded.
+
+    Args:
+        ssh_client (paramiko.SSHClient): The active SSH client.
+        instance_type (str): EC2 instance type the config is sized for.
+        region (str | None): Region used to look up instance types missing from the table.
+        upstream (str | None): 'host:port' of an app to proxy and micro-cache; static files otherwise.
+
+    Raises:
+        Exception: If the configuration does not validate or nginx fails to reload.
+    """
+    # Brotli is only packaged on newer Ubuntu releases; fall back to gzip alone.
+    brotli = execute(ssh_client, f"apt-cache show {BROTLI_PACKAGES[0]} > /dev/null 2>&1")[0] == 0
+    if brotli:
+        packages = ' '.join(BROTLI_PACKAGES)
+        run_commands(ssh_client, [f"dpkg -s {packages} > /dev/null 2>&1 || sudo apt install -y {packages}"])
+
+    settings = nginx_settings(instance_type, region=region, upstream=upstream, brotli=brotli)
+    print(f"Configuring NGINX for {instance_type}: {settings['worker_processes']} workers x "
+          f"{settings['worker_connections']} connections, brotli {'on' if brotli else 'off'}.")
+    staged = f"{STATE_DIR}/nginx.conf"
+    label = ssh_client.get_transport().getpeername()[0]
+    changed = sync_artifacts(ssh_client, [Artifact.from_text(render_nginx_conf(settings), staged)], label)
+    if not changed and execute(ssh_client, f"cmp -s {staged} /etc/nginx/nginx.conf")[0] == 0:
+        print("NGINX configuration unchanged; not reloading.")
+        return
+
+    commands = [
+        "sudo test -f /etc/nginx/nginx.conf.orig || sudo cp /etc/nginx/nginx.conf /etc/nginx/nginx.conf.orig",
+        f"sudo install -d -o {settings['user']} -g {settings['user']} {settings['cache_path']}",
+        f"echo 'net.core.somaxconn = {settings['backlog']}' | sudo tee /etc/sysctl.d/60-nginx.conf > /dev/null",
+        "sudo sysctl -q -p /etc/sysctl.d/60-nginx.conf",
+        "sudo cp /etc/nginx/nginx.conf /etc/nginx/nginx.conf.bak",
+        f"sudo cp {staged} /etc/nginx/nginx.conf",
+        # Drop the staged copy on failure, so the next run does not take it as applied.
+        f"sudo nginx -t || {{ sudo cp /etc/nginx/nginx.conf.bak /etc/nginx/nginx.conf; rm -f {staged}; exit 1; }}",
+        "sudo systemctl reload nginx",
+    ]
+    run_commands(ssh_client, commands)
+    print("NGINX configuration validated and reloaded.")
+
+
+@traced("nginx.install")
+def install_nginx(ec2_dns, key_path, instance_type="t3.medium", region=None, upstream=None):
+    """
+    Installs NGINX on the remote server, then applies the configuration tuned for
+    the instance type.
 
     Args:
         ec2_dns (str): The public DNS name of the EC2 instance.
         key_path (str): The full path to the private key file (.pem) for SSH access.
+        instance_type (str): EC2 instance type the nginx config is sized for.
+        region (str | None): Region used to look up instance types missing from the table.
+        upstream (str | None): 'host:port' of an app to proxy and micro-cache.
     """
     print(f"Installing NGINX on {ec2_dns}...")
-    ssh_client = None
     try:
         ssh_client = connect_ssh(ec2_dns, key_path)
         commands = [
@@ -243,81 +380,114 @@ def install_nginx(ec2_dns, key_path):
             "sudo systemctl start nginx"
         ]
         run_commands(ssh_client, commands)
+        configure_nginx(ssh_client, instance_type, region, upstream)
         print("NGINX installed and started successfully.")
     except Exception as e:
         print(f"Failed to install NGINX: {e}")
         raise # Re-raise to signal failure to the caller
-    finally:
-        if ssh_client and ssh_client.get_transport() and ssh_client.get_transport().is_active():
-            ssh_client.close()
-            print("SSH connection closed after NGINX installation.")
 
-def install_opensearch_stack(ec2_dns, key_path):
+def tune_nginx(ec2_dns, key_path, instance_type="t3.medium", region=None, upstream=None):
     """
-    Uploads OpenSearch installation files and executes the installation script
-    on the remote server by establishing an SSH connection.
+    Applies the instance-sized NGINX configuration to an already installed NGINX.
+    """
+    configure_nginx(connect_ssh(ec2_dns, key_path), instance_type, region, upstream)
+
+@traced("opensearch.install_stack")
+def install_opensearch_stack(ec2_dns, key_path, compose=None, install_template=True,
+                             instance_type="t3.medium", region=None):
+    """
+    Syncs the OpenSearch installation files (only changed ones are uploaded),
+    applies the kernel settings, executes the idempotent installation script on
+    the remote server, and installs the CloudFront index template once the node is up.
 
     Args:
         ec2_dns (str): The public DNS name of the EC2 instance.
         key_path (str): The full path to the private key file (.pem) for SSH access.
+        compose (str | None): Rendered docker-compose.yml to use instead of a
+            single-node one sized for `instance_type`, e.g. one node of a fleet.
+        install_template (bool): Wait for the node and install the index template.
+            A fleet does this once, after every node has joined.
+        instance_type (str): EC2 instance type heap, thread pools and kernel settings are sized for.
+        region (str | None): Region used to look up instance types missing from the table.
     """
-    print(f"Uploading OpenSearch installation files to {ec2_dns}...")
-    ssh_client = None
+    print(f"Syncing OpenSearch installation files to {ec2_dns}...")
     try:
         ssh_client = connect_ssh(ec2_dns, key_path)
 
-        # Use SCPClient for file transfer
-        with SCPClient(ssh_client.get_transport()) as scp:
-            local_docker_compose_path = os.path.join(FILES_DIR, "docker-compose.yml")
-            local_install_script_path = os.path.join(FILES_DIR, "opensearch_install.sh")
-            
-            # Check if files exist locally before attempting to upload
-            if not os.path.exists(local_docker_compose_path):
-                raise FileNotFoundError(f"Missing docker-compose.yml at: {local_docker_compose_path}")
-            if not os.path.exists(local_install_script_path):
-                raise FileNotFoundError(f"Missing opensearch_install.sh at: {local_install_script_path}")
-
-            scp.put(local_docker_compose_path, "/home/ubuntu/docker-compose.yml")
-            scp.put(local_install_script_path, "/home/ubuntu/opensearch_install.sh")
-        print("OpenSearch installation files uploaded.")
+        local_install_script_path = os.path.join(FILES_DIR, "opensearch_install.sh")
+
+        # Check if files exist locally before attempting to upload
+        if not os.path.exists(local_install_script_path):
+            raise FileNotFoundError(f"Missing opensearch_install.sh at: {local_install_script_path}")
+
+        if compose is None:
+            # Imported here: fleet imports this module.
+            from fleet import single_node_compose
+            compose = single_node_compose(instance_type, region)
+        settings = opensearch_settings(instance_type, region)
+        sync_artifacts(ssh_client, [
+            Artifact.from_text(compose, "/home/ubuntu/docker-compose.yml"),
+            Artifact.from_file(local_install_script_path, "/home/ubuntu/opensearch_install.sh", mode="0755"),
+            # vm.max_map_count is a bootstrap check as soon as OpenSearch is not single-node.
+            Artifact.from_text(sysctl_conf(settings), f"{STATE_DIR}/sysctl-opensearch.conf"),
+        ], label=ec2_dns)
 
         print("Running OpenSearch installation script...")
         commands = [
-            "chmod +x /home/ubuntu/opensearch_install.sh",
+            f"sudo install -m 0644 {STATE_DIR}/sysctl-opensearch.conf /etc/sysctl.d/60-opensearch.conf",
+            "sudo sysctl -q -p /etc/sysctl.d/60-opensearch.conf",
             "sudo /home/ubuntu/opensearch_install.sh"
         ]
         run_commands(ssh_client, commands)
         print("OpenSearch stack installation initiated.")
+        if not install_template:
+            return
+
+        # Install the CloudFront index template before any logs arrive, so the
+        # first index is created with explicit mappings instead of dynamic ones.
+        endpoint = f"http://{ec2_dns}:9200"
+        with span("opensearch.wait_ready"):
+            wait_for_opensearch(endpoint)
+        install_index_template(endpoint)
     except Exception as e:
         print(f"Failed to install OpenSearch stack: {e}")
         raise # Re-raise to signal failure to the caller
-    finally:
-        if ssh_client and ssh_client.get_transport() and ssh_client.get_transport().is_active():
-            ssh_client.close()
-            print("SSH connection closed after OpenSearch installation.")
 
-def setup_instance(hostname, key_path):
+@traced("setup_instance")
+def setup_instance(hostname, key_path, instance_type="t3.medium", region=None, compose=None,
+                   install_template=True, bundle=None):
     """
     Sets up the EC2 instance by installing necessary software (NGINX, OpenSearch).
-    This function now uses the new versions of is_nginx_installed, install_nginx,
-    and install_opensearch_stack which handle their own SSH connections.
+    All steps share one SSH connection, which is closed at the end.
 
     Args:
         hostname (str): The public DNS name or IP address of the EC2 instance.
         key_path (str): The path to the SSH private key file.
+        instance_type (str): EC2 instance type the nginx config is sized for.
+        region (str | None): Region used to look up instance types missing from the table.
+        compose (str | None): Rendered docker-compose.yml for this host (see `install_opensearch_stack`).
+        install_template (bool): Install the index template once OpenSearch is up.
+        bundle (str | None): Local path of an offline provisioning bundle (see
+            bundle.py); Docker, nginx and the images are installed from it.
     """
     print(f"Setting up instance at {hostname}...")
     try:
-        # These functions now establish and close their own SSH connections
+        if bundle:
+            ssh_client = connect_ssh(hostname, key_path)
+            push_bundle(ssh_client, bundle, label=hostname)
+            install_bundle(ssh_client, bundle, label=hostname)
+
         if not is_nginx_installed(hostname, key_path):
-            install_nginx(hostname, key_path)
+            install_nginx(hostname, key_path, instance_type, region)
         else:
             print("NGINX is already installed. Skipping installation.")
+            tune_nginx(hostname, key_path, instance_type, region)
 
-        install_opensearch_stack(hostname, key_path)
+        install_opensearch_stack(hostname, key_path, compose, install_template, instance_type, region)
 
         print("Instance setup complete.")
     except Exception as e:
         print(f"An error occurred during instance setup: {e}")
         raise # Re-raise the exception to indicate failure in main script
-
+    finally:
+        ssh_manager.close(hostname)
@@ -0,0 +1,336 @@
+import argparse
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+from awsclients import clients
+from utils import ask_input
+
+DEFAULT_PREFIX = "cloudfront-logs/"
+DEFAULT_MANIFEST = os.path.expanduser("~/.cloudfront-setup/fetch-manifest.json")
+
+# <prefix><distribution-id>.<YYYY-MM-DD-HH>.<unique-id>.gz
+LOG_KEY_PATTERN = re.compile(r"(?P<distribution>[A-Z0-9]+)\.(?P<date>\d{4}-\d{2}-\d{2})-(?P<hour>\d{2})\.")
+
+
+def parse_log_key(key, prefix=DEFAULT_PREFIX):
+    """
+    Splits a CloudFront log key into (distribution id, 'YYYY-MM-DD', 'HH').
+
+    Returns:
+        tuple | None: The parts, or None if the key does not look like a CloudFront log.
+    """
+    match = LOG_KEY_PATTERN.match(key[len(prefix):] if key.startswith(prefix) else key)
+    if not match:
+        return None
+    return match.group("distribution"), match.group("date"), match.group("hour")
+
+
+class FetchManifest:
+    """
+    Persistent record of which log objects have been downloaded.
+
+    The manifest holds a watermark per distribution (the newest key, log date and
+    LastModified fetched) plus the ETag of every object fetched inside the
+    look-back window. Completions are appended to a journal file as they happen,
+    so a crashed run replays the journal on the next start and never re-downloads
+    a finished object. Watermarks only move in `advance`, which a run calls for a
+    distribution once all of its listed objects are fetched: the journal alone
+    never moves them, so after a crash or a failed download the next run lists
+    from the same dates again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.watermarks = {}
+        self.objects = {}
+        self._lock = threading.Lock()
+        self._journal = None
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            # Manifests from before per-distribution watermarks have a single
+            # "watermark"; it is dropped, so the next run lists everything once.
+            self.watermarks = data.get("watermarks", {})
+            self.objects = data.get("objects", {})
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # Torn last line from a crash.
+                    self._apply(entry)
+
+    def _apply(self, entry):
+        self.objects[entry["key"]] = {"etag": entry["etag"], "path": entry["path"],
+                                      "last_modified": entry["last_modified"]}
+
+    def is_done(self, key, etag):
+        entry = self.objects.get(key)
+        return entry is not None and entry["etag"] == etag
+
+    def record(self, key, etag, last_modified, path):
+        """
+        Marks an object as fetched and appends it to the journal immediately.
+        """
+        entry = {"key": key, "etag": etag, "last_modified": last_modified, "path": path}
+        with self._lock:
+            self._apply(entry)
+            if self._journal is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._journal = open(self.journal_path, "a")
+            self._journal.write(json.dumps(entry) + "\n")
+            self._journal.flush()
+
+    def watermark(self, distribution):
+        return self.watermarks.get(distribution, {})
+
+    def advance(self, distribution):
+        """
+        Moves the distribution's watermark to the newest object recorded for it.
+        Call only once every object listed for it has been fetched.
+        """
+        watermark = self.watermarks.setdefault(distribution, {})
+        with self._lock:
+            for key, entry in self.objects.items():
+                parts = parse_log_key(key.rsplit("/", 1)[-1], prefix="")
+                if not parts or parts[0] != distribution:
+                    continue
+                if key > watermark.get("key", ""):
+                    watermark["key"] = key
+                if entry.get("last_modified", "") > watermark.get("last_modified", ""):
+                    watermark["last_modified"] = entry["last_modified"]
+                if parts[1] > watermark.get("date", ""):
+                    watermark["date"] = parts[1]
+
+    def prune(self, lookback_days):
+        """
+        Drops ETags for partitions older than each distribution's listing start
+        (its watermark date minus `lookback_days`); those partitions are never
+        listed again, so their entries are dead weight.
+        """
+        oldest = {distribution: date_partitions(watermark, lookback_days)[1]
+                  for distribution, watermark in self.watermarks.items()}
+        for key in list(self.objects):
+            parts = parse_log_key(key.rsplit("/", 1)[-1], prefix="")
+            if parts and oldest.get(parts[0]) and parts[1] < oldest[parts[0]]:
+                del self.objects[key]
+
+    def save(self):
+        """
+        Writes the compacted manifest atomically and truncates the journal.
+        """
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"watermarks": self.watermarks, "objects": self.objects}, f)
+            os.replace(tmp_path, self.path)
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+
+
+def discover_distributions(s3, bucket, prefix=DEFAULT_PREFIX):
+    """
+    Finds the distribution ids that write into `prefix` with one small listing per
+    distribution, by jumping past each id's keys with StartAfter.
+    """
+    distributions = []
+    start_after = prefix
+    while True:
+        response = s3.list_objects_v2(Bucket=bucket, Prefix=prefix, StartAfter=start_after, MaxKeys=1)
+        contents = response.get("Contents", [])
+        if not contents:
+            return distributions
+        parts = parse_log_key(contents[0]["Key"], prefix)
+        if parts is None:
+            start_after = contents[0]["Key"]
+            continue
+        distributions.append(parts[0])
+        start_after = f"{prefix}{parts[0]}.~"  # '~' sorts after every date character.
+
+
+def date_partitions(watermark, lookback_days=1, today=None, max_partitions=31):
+    """
+    Returns the 'YYYY-MM-DD' partitions to list: from a distribution watermark's log date minus
+    `lookback_days` (CloudFront can deliver files late) up to today.
+
+    Returns:
+        tuple: (list of dates, start date). The list is empty when there is no
+        watermark yet or the window is wider than `max_partitions` days; callers
+        then do a single listing starting at the start date (None = everything).
+    """
+    last_date = watermark.get("date")
+    if not last_date:
+        return [], None
+    today = today or datetime.now(timezone.utc).date()
+    start = datetime.strptime(last_date, "%Y-%m-%d").date() - timedelta(days=lookback_days)
+    if (today - start).days >= max_partitions:
+        return [], start.isoformat()
+    return [(start + timedelta(days=i)).isoformat() for i in range((today - start).days + 1)], start.isoformat()
+
+
+def list_partition(s3, bucket, partition_prefix, start_after=None):
+    """
+    Lists all `.gz` objects under one partition prefix, optionally after a given key.
+
+    Returns:
+        list[dict]: Objects with 'Key', 'ETag', 'LastModified' and 'Size'.
+    """
+    objects = []
+    paginator = s3.get_paginator("list_objects_v2")
+    kwargs = {"Bucket": bucket, "Prefix": partition_prefix}
+    if start_after:
+        kwargs["StartAfter"] = start_after
+    for page in paginator.paginate(**kwargs):
+        objects.extend(obj for obj in page.get("Contents", []) if obj["Key"].endswith(".gz"))
+    return objects
+
+
+def list_new_objects(s3, bucket, manifest, executor, prefix=DEFAULT_PREFIX,
+                     distribution_ids=None, lookback_days=1):
+    """
+    Lists the date partitions that may contain unseen objects, in parallel, and
+    returns the objects whose ETag is not yet recorded in the manifest. Each
+    distribution is listed from its own watermark.
+
+    Returns:
+        tuple: (new objects sorted by key, distribution ids listed).
+    """
+    distribution_ids = distribution_ids or discover_distributions(s3, bucket, prefix)
+    listings = []
+    for distribution in distribution_ids:
+        days, start = date_partitions(manifest.watermark(distribution), lookback_days)
+        base = f"{prefix}{distribution}."
+        if days:
+            listings.extend((base + day, None) for day in days)
+        else:
+            listings.append((base, base + start if start else None))
+
+    futures = [executor.submit(list_partition, s3, bucket, p, after) for p, after in listings]
+    new_objects = []
+    for future in as_completed(futures):
+        for obj in future.result():
+            if not manifest.is_done(obj["Key"], obj["ETag"]):
+                new_objects.append(obj)
+    new_objects.sort(key=lambda obj: obj["Key"])
+    return new_objects, distribution_ids
+
+
+def download_object(s3, bucket, obj, dest_dir, prefix=DEFAULT_PREFIX, chunk_size=1024 * 1024):
+    """
+    Streams one object into `dest_dir/<date>/<name>` via a temporary '.part' file
+    that is renamed into place only once complete.
+
+    Returns:
+        str: The local path of the downloaded file.
+    """
+    parts = parse_log_key(obj["Key"], prefix)
+    partition = parts[1] if parts else "undated"
+    local_dir = os.path.join(dest_dir, partition)
+    os.makedirs(local_dir, exist_ok=True)
+    local_path = os.path.join(local_dir, os.path.basename(obj["Key"]))
+
+    body = s3.get_object(Bucket=bucket, Key=obj["Key"], IfMatch=obj["ETag"])["Body"]
+    part_path = local_path + ".part"
+    try:
+        with open(part_path, "wb") as f:
+            for chunk in iter(lambda: body.read(chunk_size), b""):
+                f.write(chunk)
+    finally:
+        body.close()
+    os.replace(part_path, local_path)
+    return local_path
+
+
+def fetch_new_logs(region, bucket, dest_dir, prefix=DEFAULT_PREFIX, manifest_path=DEFAULT_MANIFEST,
+                   distribution_ids=None, max_workers=16, lookback_days=1):
+    """
+    Downloads every log object that appeared since the last run.
+
+    Listing and downloads share the registry's S3 client for `region` (see
+    `awsclients.ClientRegistry`) from a bounded thread pool.
+    Each finished download is journaled before the next is reported, so an
+    interrupted run resumes where it stopped. A distribution's watermark only
+    advances when none of its downloads failed, so failed objects are listed and
+    retried by the next run however old they are.
+
+    Returns:
+        list[str]: Local paths of the files fetched in this run.
+    """
+    s3 = clients.client("s3", region)
+    manifest = FetchManifest(manifest_path)
+    fetched = []
+    failed = 0
+    failed_distributions = set()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        new_objects, distribution_ids = list_new_objects(s3, bucket, manifest, executor, prefix,
+                                                         distribution_ids, lookback_days)
+        print(f"Found {len(new_objects)} new log objects under s3://{bucket}/{prefix}")
+
+        futures = {executor.submit(download_object, s3, bucket, obj, dest_dir, prefix): obj
+                   for obj in new_objects}
+        for future in as_completed(futures):
+            obj = futures[future]
+            try:
+                local_path = future.result()
+            except Exception as e:
+                parts = parse_log_key(obj["Key"], prefix)
+                failed += 1
+                failed_distributions.add(parts[0] if parts else None)
+                print(f"Failed to fetch {obj['Key']}: {e}")
+                continue
+            manifest.record(obj["Key"], obj["ETag"], obj["LastModified"].isoformat(), local_path)
+            fetched.append(local_path)
+
+    for distribution in distribution_ids:
+        if distribution not in failed_distributions:
+            manifest.advance(distribution)
+    manifest.prune(lookback_days)
+    manifest.save()
+
+    print(f"Fetched {len(fetched)} objects ({failed} failed).")
+    for distribution in distribution_ids:
+        print(f"Watermark of {distribution}: {manifest.watermark(distribution).get('key', 'none')}"
+              + (" (held back by failed downloads)" if distribution in failed_distributions else ""))
+    return fetched
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Incrementally download new CloudFront log objects.")
+    parser.add_argument("--region", help="AWS region of the logging bucket")
+    parser.add_argument("--bucket", help="S3 bucket that receives CloudFront logs")
+    parser.add_argument("--dest", default="logs", help="Local directory for downloaded logs")
+    parser.add_argument("--prefix", default=DEFAULT_PREFIX, help="Log key prefix")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST, help="Path of the fetch manifest")
+    parser.add_argument("--distribution-id", action="append", dest="distribution_ids",
+                        help="Only fetch logs of this distribution (repeatable)")
+    parser.add_argument("--workers", type=int, default=16, help="Concurrent list/download workers")
+    parser.add_argument("--lookback-days", type=int, default=1,
+                        help="Days before the watermark to re-list for late deliveries")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    region = args.region or ask_input("Enter AWS Region: ")
+    bucket = args.bucket or ask_input("Enter log bucket name: ")
+    fetch_new_logs(region, bucket, args.dest, prefix=args.prefix, manifest_path=args.manifest,
+                   distribution_ids=args.distribution_ids, max_workers=args.workers,
+                   lookback_days=args.lookback_days)
+
+
+if __name__ == "__main__":
+    main()
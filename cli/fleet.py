@@ -0,0 +1,185 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from bundle import build_bundle, distribute_bundle
+from ec2 import describe_hosts, launch_fleet, setup_instance
+from index_templates import install_index_template
+from opensearch import wait_for_opensearch
+from opensearch_tuning import opensearch_settings
+from ssh import ssh_manager
+
+TEMPLATES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "templates"))
+
+OPENSEARCH_VERSION = "2.9.0"
+DEFAULT_CLUSTER_NAME = "cloudfront-logs"
+# Cluster-manager-eligible nodes that bootstrap the cluster; three tolerate losing one.
+MAX_INITIAL_MANAGERS = 3
+
+
+def node_name(cluster_name, index):
+    return f"{cluster_name}-{index + 1}"
+
+
+def compose_settings(hosts, index, cluster_name=DEFAULT_CLUSTER_NAME, opensearch_version=OPENSEARCH_VERSION,
+                     instance_type="t3.medium", region=None):
+    """
+    Derives the docker-compose variables for one node of a fleet.
+
+    Every node seeds discovery with the private addresses of all nodes; the first
+    (up to three) nodes bootstrap the cluster. Dashboards run on the first node only.
+    A fleet of one falls back to single-node discovery. Heap, thread pools and
+    limits are sized for `instance_type` (see `opensearch_tuning.opensearch_settings`).
+
+    Args:
+        hosts (list): Host records from `launch_fleet` / `describe_hosts`.
+        index (int): Position of the node in `hosts`.
+        cluster_name (str): OpenSearch cluster name; node names derive from it.
+        opensearch_version (str): Image tag of OpenSearch and Dashboards.
+        instance_type (str): EC2 instance type of the node.
+        region (str | None): Region used to look up instance types missing from the table.
+
+    Returns:
+        dict: Template variables for templates/docker-compose.yml.j2.
+    """
+    host = hosts[index]
+    settings = opensearch_settings(instance_type, region, dashboards=index == 0)
+    settings.update({
+        "cluster_name": cluster_name,
+        "node_name": node_name(cluster_name, index),
+        "opensearch_version": opensearch_version,
+        "single_node": len(hosts) == 1,
+        "publish_host": host["private_ip"],
+        "seed_hosts": [f"{h['private_ip']}:9300" for h in hosts],
+        "initial_cluster_managers": [node_name(cluster_name, i)
+                                     for i in range(min(len(hosts), MAX_INITIAL_MANAGERS))],
+        "zone": host.get("zone"),
+        "dashboards": index == 0,
+    })
+    return settings
+
+
+def single_node_compose(instance_type="t3.medium", region=None, cluster_name=DEFAULT_CLUSTER_NAME):
+    """
+    Renders the docker-compose.yml of a single-node deploy sized for `instance_type`.
+    """
+    return render_compose(compose_settings([{"private_ip": "127.0.0.1"}], 0, cluster_name,
+                                           instance_type=instance_type, region=region))
+
+
+def render_compose(settings):
+    """
+    Renders templates/docker-compose.yml.j2 with settings from `compose_settings`.
+    """
+    from jinja2 import Environment, FileSystemLoader
+    env = Environment(loader=FileSystemLoader(TEMPLATES_DIR), keep_trailing_newline=True,
+                      trim_blocks=True, lstrip_blocks=True)
+    return env.get_template("docker-compose.yml.j2").render(**settings)
+
+
+def setup_fleet(hosts, key_path, instance_type="t3.medium", region=None, max_parallel=8,
+                cluster_name=DEFAULT_CLUSTER_NAME, setup=setup_instance, bundle=None):
+    """
+    Runs `setup_instance` on every host concurrently, at most `max_parallel` at a time.
+
+    A failing host does not stop the others; its error is collected and reported.
+    With a bundle, it is first uploaded once and fanned out between the hosts.
+    Once every host is set up, waits for all nodes to join and installs the index
+    template once, with one replica per shard.
+
+    Args:
+        hosts (list): Host records from `launch_fleet` / `describe_hosts`.
+        key_path (str): The path to the SSH private key file.
+        instance_type (str): EC2 instance type the configs are sized for.
+        region (str | None): Region used to look up instance types missing from the table.
+        max_parallel (int): Hosts set up at once.
+        cluster_name (str): OpenSearch cluster name.
+        setup (callable): Per-host setup, `setup_instance` unless replaced.
+        bundle (str | None): Local path of an offline provisioning bundle.
+
+    Returns:
+        dict: Host DNS name -> None on success or the error message.
+    """
+    outcomes = {}
+    started = time.perf_counter()
+    if bundle:
+        distribute_bundle(hosts, key_path, bundle, max_parallel=max_parallel)
+
+    def run(index):
+        host = hosts[index]
+        host_started = time.perf_counter()
+        compose = render_compose(compose_settings(hosts, index, cluster_name,
+                                                  instance_type=instance_type, region=region))
+        setup(host["dns"], key_path, instance_type, region, compose=compose, install_template=False, bundle=bundle)
+        return time.perf_counter() - host_started
+
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        futures = {executor.submit(run, i): host for i, host in enumerate(hosts)}
+        for future in as_completed(futures):
+            host = futures[future]
+            try:
+                elapsed = future.result()
+            except Exception as e:
+                outcome, status = str(e), f"FAILED: {e}"
+            else:
+                outcome, status = None, f"done in {elapsed:.0f} s"
+            outcomes[host["dns"]] = outcome
+            print(f"[fleet {len(outcomes)}/{len(hosts)}] {host['dns']} ({host['instance_id']}) {status}")
+
+    failed = {dns: error for dns, error in outcomes.items() if error}
+    print(f"Fleet setup finished in {time.perf_counter() - started:.0f} s: "
+          f"{len(hosts) - len(failed)} ok, {len(failed)} failed.")
+    for dns, error in failed.items():
+        print(f"  {dns}: {error}")
+    if failed:
+        return outcomes
+
+    endpoint = f"http://{hosts[0]['dns']}:9200"
+    health = wait_for_opensearch(endpoint, min_nodes=len(hosts))
+    print(f"Cluster '{health.get('cluster_name')}' has {health.get('number_of_nodes')} nodes, "
+          f"status {health.get('status')}.")
+    install_index_template(endpoint, replicas=min(1, len(hosts) - 1))
+    return outcomes
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Launch and configure a fleet of origin/OpenSearch hosts.")
+    parser.add_argument("--region", required=True, help="AWS region")
+    parser.add_argument("--key-path", required=True, help="Private key used to reach the hosts")
+    parser.add_argument("--key-name", help="EC2 key pair for new instances")
+    parser.add_argument("--count", type=int, default=3, help="Instances to launch")
+    parser.add_argument("--instance-ids", nargs="+", help="Configure these existing instances instead of launching")
+    parser.add_argument("--instance-type", default="t3.medium", help="EC2 instance type")
+    parser.add_argument("--max-parallel", type=int, default=8, help="Hosts set up at once")
+    parser.add_argument("--cluster-name", default=DEFAULT_CLUSTER_NAME, help="OpenSearch cluster name")
+    parser.add_argument("--bundle", action="store_true",
+                        help="Provision from the offline bundle (built or taken from the local cache)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.instance_ids:
+        hosts = describe_hosts(args.region, args.instance_ids)
+    elif args.key_name:
+        hosts = launch_fleet(args.region, args.key_name, args.instance_type, args.count)
+    else:
+        raise Exception("Either --key-name (to launch) or --instance-ids is required")
+    for host in hosts:
+        print(f"{host['instance_id']}: {host['dns']} ({host['private_ip']}, {host['zone']})")
+
+    bundle = build_bundle() if args.bundle else None
+    try:
+        outcomes = setup_fleet(hosts, os.path.expanduser(args.key_path), args.instance_type, args.region,
+                               max_parallel=args.max_parallel, cluster_name=args.cluster_name, bundle=bundle)
+    finally:
+        ssh_manager.close()
+    if any(outcomes.values()):
+        sys.exit(1)
+    print(f"\nOpenSearch Dashboard should be available at: http://{hosts[0]['dns']}:5601")
+
+
+if __name__ == "__main__":
+    main()
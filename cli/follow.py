@@ -0,0 +1,365 @@
+import argparse
+import asyncio
+import json
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote_plus
+
+from awsclients import clients
+from utils import ask_input
+from bulk import BulkIndexer
+from index_templates import INDEX_PREFIX
+from ingest import DEFAULT_PREFIX, build_batch_actions, stream_log_batches
+from opensearch import wait_for_opensearch
+
+
+def parse_notification(body):
+    """
+    Extracts the created objects from an S3 event notification.
+
+    Handles notifications delivered directly by S3 and ones wrapped in an SNS
+    envelope. The `s3:TestEvent` S3 sends when the notification is configured
+    contains no records.
+
+    Returns:
+        list[tuple]: (bucket, key, event epoch seconds) per ObjectCreated record.
+    """
+    message = json.loads(body)
+    if "Message" in message and "Records" not in message:
+        message = json.loads(message["Message"])
+    objects = []
+    for record in message.get("Records", []):
+        if not record.get("eventName", "").startswith("ObjectCreated"):
+            continue
+        event_time = datetime.fromisoformat(record["eventTime"].replace("Z", "+00:00")).timestamp()
+        objects.append((record["s3"]["bucket"]["name"], unquote_plus(record["s3"]["object"]["key"]), event_time))
+    return objects
+
+
+class LagMetrics:
+    """
+    End-to-end lag of follow mode, in seconds, over the most recent objects.
+
+    - notification: S3 object created -> notification received
+    - object: S3 object created -> its records indexed
+    - record: newest CloudFront request in the object -> indexed, i.e. how long
+      a request takes to become searchable in Dashboards
+    """
+
+    KINDS = ("notification", "object", "record")
+
+    def __init__(self, window=10000):
+        self.samples = {kind: deque(maxlen=window) for kind in self.KINDS}
+        self.counters = {"messages": 0, "objects": 0, "records": 0, "indexed": 0, "failed": 0, "errors": 0}
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def observe(self, kind, seconds):
+        with self._lock:
+            self.samples[kind].append(max(0.0, seconds))
+
+    def count(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.counters[name] += value
+
+    def percentile(self, kind, pct):
+        with self._lock:
+            samples = sorted(self.samples[kind])
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100.0))]
+
+    def summary(self):
+        summary = dict(self.counters, in_flight=self.in_flight)
+        for kind in self.KINDS:
+            summary[f"{kind}_lag_p50_s"] = round(self.percentile(kind, 50), 3)
+            summary[f"{kind}_lag_p99_s"] = round(self.percentile(kind, 99), 3)
+        return summary
+
+    def prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for name, value in self.counters.items():
+            lines.append(f"# TYPE cloudfront_follow_{name}_total counter")
+            lines.append(f"cloudfront_follow_{name}_total {value}")
+        lines.append("# TYPE cloudfront_follow_in_flight gauge")
+        lines.append(f"cloudfront_follow_in_flight {self.in_flight}")
+        for kind in self.KINDS:
+            lines.append(f"# TYPE cloudfront_follow_{kind}_lag_seconds summary")
+            for quantile in (50, 90, 99):
+                lines.append(f'cloudfront_follow_{kind}_lag_seconds{{quantile="{quantile / 100}"}} '
+                             f"{self.percentile(kind, quantile):.3f}")
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(metrics, port):
+    """
+    Serves `metrics` at http://0.0.0.0:`port`/metrics from a daemon thread.
+
+    Returns:
+        ThreadingHTTPServer: Call `shutdown()` to stop it.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.prometheus().encode("utf-8")
+            self.send_response(200 if self.path == "/metrics" else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Follower:
+    """
+    Indexes new log objects as their S3 ObjectCreated notifications arrive on SQS.
+
+    At most `max_in_flight` messages are processed at once; the receiver asks SQS
+    only for as many messages as there are free slots, so nothing received waits
+    in a local backlog. Each object is streamed into its own `BulkIndexer` in a
+    worker thread, and its message is deleted only once every record was
+    indexed. Failed messages become visible again after the queue's visibility
+    timeout and go to the dead-letter queue after repeated failures. Documents
+    use the request id as `_id`, so reprocessing a message does not duplicate
+    anything. While an object is processed its message's visibility is extended.
+
+    Stopping (`stop` set, e.g. by SIGTERM) ends receiving, waits up to
+    `drain_timeout` seconds for in-flight messages and makes the messages of the
+    last long poll (which takes up to `wait_time` seconds to return) visible again
+    right away instead of after the visibility timeout.
+    """
+
+    def __init__(self, sqs, s3, queue_url, endpoint, index=INDEX_PREFIX, granularity="daily",
+                 prefix=DEFAULT_PREFIX, max_in_flight=4, bulk_workers=2, wait_time=20,
+                 visibility_timeout=300, drain_timeout=60, metrics=None):
+        self.sqs = sqs
+        self.s3 = s3
+        self.queue_url = queue_url
+        self.endpoint = endpoint
+        self.index = index
+        self.granularity = granularity
+        self.prefix = prefix
+        self.max_in_flight = max_in_flight
+        self.bulk_workers = bulk_workers
+        self.wait_time = wait_time
+        self.visibility_timeout = visibility_timeout
+        self.drain_timeout = drain_timeout
+        self.metrics = metrics or LagMetrics()
+
+    def _ingest_object(self, bucket, key):
+        records = 0
+        newest = None
+        with BulkIndexer(self.endpoint, workers=self.bulk_workers) as indexer:
+            for batch in stream_log_batches(self.s3, bucket, key):
+                records += len(batch)
+                timestamps = batch.columns.get("timestamp")
+                if len(batch) and timestamps is not None:
+                    newest = max(newest or 0, int(timestamps.max()))
+                indexer.index(build_batch_actions(batch, self.index, self.granularity))
+        stats = indexer.stats
+        for error in stats.errors:
+            print(f"Bulk error in s3://{bucket}/{key}: {error}")
+        return records, stats.indexed, stats.failed, newest
+
+    async def _keep_invisible(self, receipt):
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 2)
+            await asyncio.to_thread(self.sqs.change_message_visibility, QueueUrl=self.queue_url,
+                                    ReceiptHandle=receipt, VisibilityTimeout=self.visibility_timeout)
+
+    async def process(self, message, received_at):
+        """
+        Indexes the objects of one notification and deletes it when all succeeded.
+
+        Returns:
+            bool: Whether the message was deleted.
+        """
+        heartbeat = asyncio.create_task(self._keep_invisible(message["ReceiptHandle"]))
+        ok = True
+        try:
+            for bucket, key, created in parse_notification(message["Body"]):
+                if not key.startswith(self.prefix):
+                    continue
+                self.metrics.observe("notification", received_at - created)
+                records, indexed, failed, newest = await asyncio.to_thread(self._ingest_object, bucket, key)
+                now = time.time()
+                self.metrics.count(objects=1, records=records, indexed=indexed, failed=failed)
+                self.metrics.observe("object", now - created)
+                if newest is not None:
+                    self.metrics.observe("record", now - newest)
+                print(f"Indexed s3://{bucket}/{key}: {indexed}/{records} records, {now - created:.1f} s after upload.")
+                ok = ok and not failed
+        except Exception as e:
+            print(f"Failed to process message {message['MessageId']}: {e}")
+            self.metrics.count(errors=1)
+            ok = False
+        finally:
+            heartbeat.cancel()
+        if ok:
+            await asyncio.to_thread(self.sqs.delete_message, QueueUrl=self.queue_url,
+                                    ReceiptHandle=message["ReceiptHandle"])
+        return ok
+
+    async def _receive(self, count):
+        response = await asyncio.to_thread(
+            self.sqs.receive_message, QueueUrl=self.queue_url, MaxNumberOfMessages=count,
+            WaitTimeSeconds=self.wait_time, VisibilityTimeout=self.visibility_timeout)
+        return response.get("Messages", [])
+
+    async def _release(self, receiving):
+        messages = await receiving
+        if messages:
+            await asyncio.to_thread(self.sqs.change_message_visibility_batch, QueueUrl=self.queue_url, Entries=[
+                {"Id": str(i), "ReceiptHandle": m["ReceiptHandle"], "VisibilityTimeout": 0}
+                for i, m in enumerate(messages)])
+
+    async def run(self, stop, exit_when_idle=False):
+        """
+        Receives and processes notifications until `stop` (an `asyncio.Event`) is
+        set, or, with `exit_when_idle`, until the queue is empty and nothing is in
+        flight.
+
+        Returns:
+            dict: The lag metrics summary.
+        """
+        tasks = set()
+        release = None
+        stopping = asyncio.create_task(stop.wait())
+        while not stop.is_set():
+            free = self.max_in_flight - len(tasks)
+            if free == 0:
+                await asyncio.wait(tasks | {stopping}, return_when=asyncio.FIRST_COMPLETED)
+                tasks = {task for task in tasks if not task.done()}
+                continue
+            receiving = asyncio.create_task(self._receive(min(10, free)))
+            await asyncio.wait({receiving, stopping}, return_when=asyncio.FIRST_COMPLETED)
+            if stop.is_set():
+                # A boto3 call cannot be cancelled: let the open long poll finish
+                # alongside the drain and hand back whatever it returns.
+                release = asyncio.create_task(self._release(receiving))
+                break
+            messages = receiving.result()
+            received_at = time.time()
+            self.metrics.count(messages=len(messages))
+            for message in messages:
+                tasks.add(asyncio.create_task(self.process(message, received_at)))
+            tasks = {task for task in tasks if not task.done()}
+            self.metrics.in_flight = len(tasks)
+            if exit_when_idle and not messages and not tasks:
+                break
+        stopping.cancel()
+
+        if tasks:
+            print(f"Draining {len(tasks)} in-flight message(s)...")
+            done, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                print(f"{len(pending)} message(s) not finished within {self.drain_timeout} s; "
+                      "they become visible again after the visibility timeout.")
+        if release:
+            await release
+        self.metrics.in_flight = 0
+        return self.metrics.summary()
+
+
+async def _report(metrics, every):
+    while True:
+        await asyncio.sleep(every)
+        summary = metrics.summary()
+        print(f"[follow] {summary['objects']} objects, {summary['indexed']} indexed, {summary['failed']} failed, "
+              f"{summary['in_flight']} in flight; record lag p50 {summary['record_lag_p50_s']} s, "
+              f"p99 {summary['record_lag_p99_s']} s; object lag p99 {summary['object_lag_p99_s']} s")
+
+
+async def follow(follower, report_every=60, exit_when_idle=False):
+    """
+    Runs `follower` until SIGINT/SIGTERM, reporting lag every `report_every` seconds.
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    reporter = asyncio.create_task(_report(follower.metrics, report_every))
+    try:
+        return await follower.run(stop, exit_when_idle)
+    finally:
+        reporter.cancel()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Index new CloudFront logs as S3 notifies about them over SQS.")
+    parser.add_argument("--region", help="AWS region of the queue and logging bucket")
+    parser.add_argument("--queue-url", help="SQS queue receiving the ObjectCreated notifications "
+                                            "(the follow_queue_url Terraform output)")
+    parser.add_argument("--endpoint", help="OpenSearch endpoint, e.g. http://<ec2-dns>:9200")
+    parser.add_argument("--prefix", default=DEFAULT_PREFIX, help="Only index objects under this key prefix")
+    parser.add_argument("--index", default=INDEX_PREFIX, help="Target index name prefix")
+    parser.add_argument("--granularity", choices=["daily", "hourly", "none"], default="daily",
+                        help="Time partitioning of the target indices")
+    parser.add_argument("--max-in-flight", type=int, default=4, help="Messages processed concurrently")
+    parser.add_argument("--bulk-workers", type=int, default=2, help="Concurrent _bulk workers per object")
+    parser.add_argument("--visibility-timeout", type=int, default=300,
+                        help="Seconds a received message stays hidden; extended while it is processed")
+    parser.add_argument("--drain-timeout", type=float, default=60,
+                        help="Seconds to let in-flight messages finish on shutdown")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port at /metrics")
+    parser.add_argument("--report-every", type=float, default=60, help="Seconds between lag reports")
+    parser.add_argument("--exit-when-idle", action="store_true",
+                        help="Exit once the queue is empty instead of following it")
+    parser.add_argument("--wait-ready", type=float, default=300, metavar="SECONDS",
+                        help="Wait up to this long for OpenSearch to be ready before indexing (0: don't wait)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    region = args.region or ask_input("Enter AWS Region: ")
+    queue_url = args.queue_url or ask_input("Enter SQS queue URL: ")
+    endpoint = args.endpoint
+    if not endpoint:
+        host = ask_input("Enter OpenSearch host (EC2 DNS): ")
+        endpoint = f"http://{host}:9200"
+
+    if args.wait_ready:
+        wait_for_opensearch(endpoint, timeout=args.wait_ready)
+
+    metrics = LagMetrics()
+    server = serve_metrics(metrics, args.metrics_port) if args.metrics_port else None
+    follower = Follower(clients.client("sqs", region), clients.client("s3", region), queue_url, endpoint, index=args.index,
+                        granularity=None if args.granularity == "none" else args.granularity,
+                        prefix=args.prefix, max_in_flight=args.max_in_flight, bulk_workers=args.bulk_workers,
+                        visibility_timeout=args.visibility_timeout, drain_timeout=args.drain_timeout,
+                        metrics=metrics)
+    print(f"Following {queue_url} ({args.max_in_flight} in flight)...")
+    try:
+        summary = asyncio.run(follow(follower, args.report_every, args.exit_when_idle))
+    finally:
+        if server:
+            server.shutdown()
+
+    print(f"\nStopped: {summary['objects']} objects, {summary['indexed']} documents indexed, "
+          f"{summary['failed']} failed, {summary['errors']} errors; "
+          f"record lag p50 {summary['record_lag_p50_s']} s, p99 {summary['record_lag_p99_s']} s.")
+    if summary["failed"] or summary["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+from contextlib import contextmanager
+
+from opensearch import opensearch_request
+
+INDEX_PREFIX = "cloudfront-logs"
+ROLLUP_PREFIX = "cloudfront-rollups"
+TEMPLATE_NAME = "cloudfront-logs"
+ROLLUP_TEMPLATE_NAME = "cloudfront-rollups"
+BACKFILL_TEMPLATE_NAME = "cloudfront-logs-backfill"
+ISM_POLICY_NAME = "cloudfront-logs-retention"
+
+# Steady-state settings; backfill_settings() temporarily overrides the last two.
+DEFAULT_REFRESH_INTERVAL = "30s"
+DEFAULT_REPLICAS = 0
+
+
+def _keyword(ignore_above=256, doc_values=True, index=True):
+    field = {"type": "keyword", "ignore_above": ignore_above}
+    if not doc_values:
+        field["doc_values"] = False
+    if not index:
+        field["index"] = False
+    return field
+
+
+# Explicit mappings for the documents produced by ingest/logparser. Nothing is
+# analysed: every string is a keyword, sized to what dashboards aggregate on.
+# High-cardinality fields that are only ever looked up (request id, cookies,
+# query strings) skip doc_values; 'date'/'time' are dropped from _source because
+# '@timestamp' carries the same information.
+CLOUDFRONT_MAPPINGS = {
+    "dynamic": False,
+    "_source": {"excludes": ["date", "time"]},
+    "properties": {
+        "@timestamp": {"type": "date", "format": "strict_date_optional_time||epoch_second"},
+        "date": {"type": "keyword", "index": False, "doc_values": False},
+        "time": {"type": "keyword", "index": False, "doc_values": False},
+        "x_edge_location": _keyword(32),
+        "sc_bytes": {"type": "long"},
+        "c_ip": {"type": "ip"},
+        "cs_method": _keyword(16),
+        "cs_host": _keyword(),
+        "cs_uri_stem": _keyword(2048),
+        "sc_status": {"type": "short"},
+        "cs_referer": _keyword(1024, doc_values=False),
+        "cs_user_agent": _keyword(512),
+        "cs_uri_query": _keyword(2048, doc_values=False),
+        "cs_cookie": _keyword(1024, doc_values=False, index=False),
+        "x_edge_result_type": _keyword(32),
+        "x_edge_request_id": _keyword(128, doc_values=False),
+        "x_host_header": _keyword(),
+        "cs_protocol": _keyword(16),
+        "cs_bytes": {"type": "long"},
+        "time_taken": {"type": "float"},
+        "x_forwarded_for": _keyword(512, doc_values=False),
+        "ssl_protocol": _keyword(16),
+        "ssl_cipher": _keyword(64),
+        "x_edge_response_result_type": _keyword(32),
+        "cs_protocol_version": _keyword(16),
+        "fle_status": _keyword(32),
+        "fle_encrypted_fields": {"type": "integer", "doc_values": False},
+        "c_port": {"type": "integer", "doc_values": False},
+        "time_to_first_byte": {"type": "float"},
+        "x_edge_detailed_result_type": _keyword(64),
+        "sc_content_type": _keyword(128),
+        "sc_content_len": {"type": "long"},
+        "sc_range_start": {"type": "long", "doc_values": False},
+        "sc_range_end": {"type": "long", "doc_values": False},
+    },
+}
+
+
+# Mappings for the documents emitted by rollup.RollupAggregator.
+ROLLUP_MAPPINGS = {
+    "dynamic": False,
+    "properties": {
+        "@timestamp": {"type": "date"},
+        "doc_type": _keyword(16),
+        "window_s": {"type": "integer"},
+        "distribution": _keyword(),
+        "x_edge_location": _keyword(32),
+        "path_prefix": _keyword(512),
+        "requests": {"type": "long"},
+        "sc_bytes": {"type": "long"},
+        "hits": {"type": "long"},
+        "hit_ratio": {"type": "float"},
+        "status": {"type": "object", "dynamic": True},
+        "status_5xx": {"type": "long"},
+        "time_taken_p50": {"type": "float"},
+        "time_taken_p95": {"type": "float"},
+        "time_taken_p99": {"type": "float"},
+        "time_taken_max": {"type": "float"},
+        "emission": {"type": "integer"},
+        "top_uris": {"properties": {"value": _keyword(2048), "count": {"type": "long"},
+                                    "error": {"type": "long", "index": False}}},
+        "top_client_ips": {"properties": {"value": _keyword(64), "count": {"type": "long"},
+                                          "error": {"type": "long", "index": False}}},
+    },
+}
+
+
+def rollup_index_template(prefix=ROLLUP_PREFIX, replicas=DEFAULT_REPLICAS):
+    """
+    Returns the index template for daily rollup indices; they are small, so they
+    keep the default refresh and are searchable quickly.
+    """
+    return {
+        "index_patterns": [f"{prefix}-*"],
+        "priority": 100,
+        "template": {
+            "settings": {"index": {"number_of_shards": 1, "number_of_replicas": replicas,
+                                   "codec": "best_compression"}},
+            "mappings": ROLLUP_MAPPINGS,
+        },
+    }
+
+
+def cloudfront_index_template(prefix=INDEX_PREFIX, shards=1, replicas=DEFAULT_REPLICAS,
+                              refresh_interval=DEFAULT_REFRESH_INTERVAL):
+    """
+    Returns the composable index template body for the time-partitioned log indices.
+    """
+    return {
+        "index_patterns": [f"{prefix}-*"],
+        "priority": 100,
+        "template": {
+            "settings": {
+                "index": {
+                    "number_of_shards": shards,
+                    "number_of_replicas": replicas,
+                    "refresh_interval": refresh_interval,
+                    "codec": "best_compression",
+                    "translog.durability": "async",
+                    "translog.sync_interval": "30s",
+                    "mapping.total_fields.limit": 100,
+                }
+            },
+            "mappings": CLOUDFRONT_MAPPINGS,
+        },
+    }
+
+
+def retention_policy(retention_days=30, merge_after_days=2):
+    """
+    Returns an ISM policy that force-merges indices once their day is over and
+    deletes them after `retention_days`.
+    """
+    return {
+        "policy": {
+            "description": "CloudFront access log retention",
+            "default_state": "hot",
+            "states": [
+                {
+                    "name": "hot",
+                    "actions": [],
+                    "transitions": [{"state_name": "warm",
+                                     "conditions": {"min_index_age": f"{merge_after_days}d"}}],
+                },
+                {
+                    "name": "warm",
+                    "actions": [{"force_merge": {"max_num_segments": 1}}],
+                    "transitions": [{"state_name": "delete",
+                                     "conditions": {"min_index_age": f"{retention_days}d"}}],
+                },
+                {"name": "delete", "actions": [{"delete": {}}], "transitions": []},
+            ],
+            "ism_template": [{"index_patterns": [f"{INDEX_PREFIX}-*"], "priority": 100}],
+        }
+    }
+
+
+def index_name(doc, prefix=INDEX_PREFIX, granularity="daily"):
+    """
+    Returns the time-partitioned index a document belongs to, based on its own log
+    date/time, e.g. 'cloudfront-logs-2024.01.31' or 'cloudfront-logs-2024.01.31-13'.
+
+    Partitioning on event time (not ingest time) keeps backfills of old logs in
+    the right index. With granularity None, the prefix itself is returned.
+    """
+    date = doc.get("date")
+    if not granularity or not date:
+        return prefix
+    name = f"{prefix}-{date.replace('-', '.')}"
+    if granularity == "hourly":
+        name += "-" + doc.get("time", "00")[:2]
+    return name
+
+
+def install_index_template(endpoint, retention_days=30, replicas=DEFAULT_REPLICAS):
+    """
+    Installs the CloudFront index template and retention policy on an OpenSearch node.
+    """
+    print("Installing CloudFront index template...")
+    opensearch_request(endpoint, "PUT", f"/_index_template/{TEMPLATE_NAME}",
+                       cloudfront_index_template(replicas=replicas))
+    opensearch_request(endpoint, "PUT", f"/_index_template/{ROLLUP_TEMPLATE_NAME}",
+                       rollup_index_template(replicas=replicas))
+    try:
+        opensearch_request(endpoint, "PUT", f"/_plugins/_ism/policies/{ISM_POLICY_NAME}",
+                           retention_policy(retention_days))
+    except Exception as e:
+        if "version_conflict" not in str(e):
+            raise
+        print(f"ISM policy '{ISM_POLICY_NAME}' already exists. Keeping it.")
+    print("Index template installed.")
+
+
+@contextmanager
+def backfill_settings(endpoint, prefix=INDEX_PREFIX):
+    """
+    Switches the log indices into bulk-load mode for the duration of a backfill.
+
+    Refresh is disabled and replicas dropped, both on existing indices and, via a
+    higher-priority override template, on indices created during the backfill.
+    On exit the override is removed, every index gets back its previous settings
+    (template defaults for indices created meanwhile) and a refresh makes the new
+    documents searchable.
+    """
+    pattern = f"{prefix}-*"
+    previous = opensearch_request(
+        endpoint, "GET",
+        f"/{pattern}/_settings/index.refresh_interval,index.number_of_replicas?allow_no_indices=true")
+    # Composable templates do not merge, so the override repeats the mappings.
+    override = cloudfront_index_template(prefix, replicas=0, refresh_interval="-1")
+    override["priority"] = 200
+
+    print("Entering backfill mode (refresh disabled, no replicas)...")
+    opensearch_request(endpoint, "PUT", f"/_index_template/{BACKFILL_TEMPLATE_NAME}", override)
+    opensearch_request(endpoint, "PUT", f"/{pattern}/_settings?allow_no_indices=true",
+                       {"index": {"refresh_interval": "-1", "number_of_replicas": 0}})
+    try:
+        yield
+    finally:
+        print("Leaving backfill mode, restoring index settings...")
+        opensearch_request(endpoint, "DELETE", f"/_index_template/{BACKFILL_TEMPLATE_NAME}")
+        opensearch_request(endpoint, "PUT", f"/{pattern}/_settings?allow_no_indices=true",
+                           {"index": {"refresh_interval": DEFAULT_REFRESH_INTERVAL,
+                                      "number_of_replicas": DEFAULT_REPLICAS}})
+        for index, body in previous.items():
+            settings = body.get("settings", {}).get("index", {})
+            original = {
+                "refresh_interval": settings.get("refresh_interval", DEFAULT_REFRESH_INTERVAL),
+                "number_of_replicas": int(settings.get("number_of_replicas", DEFAULT_REPLICAS)),
+            }
+            if original != {"refresh_interval": DEFAULT_REFRESH_INTERVAL,
+                            "number_of_replicas": DEFAULT_REPLICAS}:
+                opensearch_request(endpoint, "PUT", f"/{index}/_settings", {"index": original})
+        opensearch_request(endpoint, "POST", f"/{pattern}/_refresh?allow_no_indices=true")
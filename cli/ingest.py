@@ -0,0 +1,303 @@
+import argparse
+import gzip
+import json
+import operator
+import sys
+from contextlib import ExitStack
+from itertools import repeat
+from json.encoder import encode_basestring_ascii
+
+import numpy as np
+
+from awsclients import clients
+from utils import ask_input
+from bulk import BulkIndexer
+from index_templates import INDEX_PREFIX, backfill_settings, index_name
+from fetcher import parse_log_key
+from rollup import RollupAggregator, build_rollup_actions, sample_rows
+from logparser import MISSING_INT, StringColumn, field_key, parse_stream
+from opensearch import wait_for_opensearch
+from dedup import DEFAULT_DEDUP_DIR, DedupFilter
+
+DEFAULT_PREFIX = "cloudfront-logs/"
+# Staged request ids after which ingest waits for the indexer and commits them
+# to the dedup filter, between objects; bounds the ids held in memory.
+DEDUP_CHECKPOINT_IDS = 1000000
+
+
+def list_log_objects(s3, bucket, prefix=DEFAULT_PREFIX):
+    """
+    Yields the keys of all gzip log objects under the given prefix, one page at a time.
+
+    Args:
+        s3: A boto3 S3 client.
+        bucket (str): The CloudFront logging bucket.
+        prefix (str): Key prefix configured in the distribution's logging_config.
+    """
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(".gz"):
+                yield obj["Key"]
+
+
+def stream_log_batches(s3, bucket, key, chunk_size=4 * 1024 * 1024):
+    """
+    Streams a single log object from S3 as columnar `LogBatch` chunks.
+
+    Decompression happens incrementally; only one chunk of `chunk_size`
+    decompressed bytes is held in memory at a time.
+    """
+    body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+    try:
+        with gzip.GzipFile(fileobj=body, mode="rb") as gz:
+            yield from parse_stream(gz, chunk_size)
+    finally:
+        body.close()
+
+
+def build_bulk_actions(docs, index=INDEX_PREFIX, granularity="daily"):
+    """
+    Yields NDJSON-encoded (action, source) line pairs for the `_bulk` API.
+
+    Documents are routed to daily or hourly indices named after `index` (see
+    `index_templates.index_name`). The CloudFront request id is used as the
+    document id so that re-ingesting the same object overwrites documents
+    instead of duplicating them.
+    """
+    for doc in docs:
+        action = {"index": {"_index": index_name(doc, index, granularity)}}
+        request_id = doc.get("x_edge_request_id")
+        if request_id:
+            action["index"]["_id"] = request_id
+        yield (json.dumps(action) + "\n" + json.dumps(doc) + "\n").encode("utf-8")
+
+
+def _json_safe(data):
+    """
+    Whether every value in a chunk can be put between JSON quotes as is, i.e.
+    is ASCII without quotes, backslashes or control characters.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    return not ((buf >= 128) | (buf == 34) | (buf == 92) | ((buf < 32) & (buf != 9) & (buf != 10))).any()
+
+
+def _pick(values, rows):
+    return list(operator.itemgetter(*rows)(values)) if len(rows) > 1 else [values[row] for row in rows]
+
+
+def build_batch_actions(batch, index=INDEX_PREFIX, granularity="daily"):
+    """
+    Yields the NDJSON (action, source) line pairs of a `LogBatch`, byte for byte
+    what `build_bulk_actions(batch.iter_docs(), ...)` yields, without building a
+    document dict per record.
+
+    Records are grouped by which of their fields are '-' (a handful of patterns
+    per log, e.g. with and without a query string); each pattern becomes one
+    %-format template and every record one C-level format call over values cut
+    from a single split of the chunk. Chunks holding values that JSON would
+    escape (non-ASCII, quotes, backslashes) take the per-document path.
+    """
+    names = [name for name in batch.fields if name in batch.columns]
+    if not len(batch) or batch.data is None or len(names) > 60 or not _json_safe(batch.data):
+        yield from build_bulk_actions(batch.iter_docs(), index, granularity)
+        return
+
+    lists = batch.tolists(names)
+    formats = []
+    missing = np.zeros(len(batch), dtype=np.uint64)
+    for bit, name in enumerate(names):
+        column = batch.columns[name]
+        if isinstance(column, StringColumn):
+            absent = column.equals("-") | (column.ends == column.starts)
+            formats.append(f'"{field_key(name)}": "%s"')
+        elif column.dtype.kind == "i":
+            absent = column == MISSING_INT
+            formats.append(f'"{field_key(name)}": %d')
+        else:
+            absent = np.isnan(column)
+            formats.append(f'"{field_key(name)}": %r')
+        missing |= absent.astype(np.uint64) << np.uint64(bit)
+
+    dates, times = lists.get("date"), lists.get("time")
+    request_ids = lists.get("x-edge-request-id")
+    # Quoted target index per distinct date (and hour), looked up per record in C.
+    if granularity and dates:
+        keys = dates if granularity != "hourly" or not times else list(
+            zip(dates, map(operator.getitem, times, repeat(slice(0, 2)))))
+        targets = {}
+        for key in set(keys):
+            date, hour = key if isinstance(key, tuple) else (key, None)
+            doc = {name: value for name, value in (("date", date), ("time", hour)) if value not in (None, "-", "")}
+            targets[key] = encode_basestring_ascii(index_name(doc, index, granularity))
+        indices = list(map(targets.__getitem__, keys))
+    else:
+        indices = [encode_basestring_ascii(index)] * len(batch)
+
+    patterns, inverse = np.unique(missing, return_inverse=True)
+    lines = np.empty(len(batch), dtype=object)
+    for number, pattern in enumerate(patterns.tolist()):
+        present = [bit for bit in range(len(names)) if not pattern >> bit & 1]
+        present_names = {names[bit] for bit in present}
+        head = '{"index": {"_index": %s'
+        args = [indices]
+        if "x-edge-request-id" in present_names:
+            head += ', "_id": "%s"'
+            args.append(request_ids)
+        body = [formats[bit] for bit in present]
+        args.extend(lists[names[bit]] for bit in present)
+        if "date" in present_names and "time" in present_names:
+            body.append('"@timestamp": "%sT%sZ"')
+            args.extend((dates, times))
+        template = head + '}}\n{' + ", ".join(body) + "}\n"
+        if len(patterns) == 1:
+            yield from map(str.encode, map(template.__mod__, zip(*args)))
+            return
+        rows = np.flatnonzero(inverse == number).tolist()
+        lines[rows] = list(map(template.__mod__, zip(*(_pick(values, rows) for values in args))))
+    yield from map(str.encode, lines.tolist())
+
+
+def checkpoint_dedup(dedup, indexer, failed_before):
+    """
+    Waits until the indexer has an answer for every queued document, then
+    commits the dedup filter's staged request ids if nothing failed since the
+    last checkpoint, or discards them so a rerun indexes those records again.
+
+    Returns:
+        int: The indexer's failure count, for the next checkpoint.
+    """
+    indexer.drain()
+    failed = indexer.stats.failed
+    if failed == failed_before:
+        dedup.commit()
+    else:
+        print(f"{failed - failed_before} documents failed to index; "
+              f"not remembering {dedup.pending:,} request ids.")
+        dedup.discard()
+    return failed
+
+
+def ingest(s3, bucket, endpoint, prefix=DEFAULT_PREFIX, index=INDEX_PREFIX, workers=4,
+           granularity="daily", backfill=False, rollup_window=None, sample_rate=1.0, dedup=None):
+    """
+    Streams every CloudFront log object under `prefix` into OpenSearch.
+
+    Listing, decompression, parsing and encoding are generators feeding a
+    `BulkIndexer`, whose bounded queue keeps memory constant regardless of log size.
+    With `backfill`, the target indices run without refresh and replicas until
+    the load finishes. With `rollup_window` (seconds), batches also pass through a
+    `RollupAggregator` whose rollup documents are indexed, and only a
+    `sample_rate` fraction of the raw lines is kept. With `dedup` (a
+    `DedupFilter`), records whose request id was already ingested, in this run or
+    an earlier one, are dropped before rollups and indexing; their ids are
+    committed to the filter at checkpoints, once the indexer has drained with no
+    failures.
+
+    Returns:
+        dict: Objects processed, raw/rollup/duplicate document counts and the indexer's stats.
+    """
+    objects = 0
+    raw_docs = 0
+    rollup_docs = 0
+    duplicates = 0
+    failed = 0
+    aggregator = RollupAggregator(window_s=rollup_window) if rollup_window else None
+    with ExitStack() as stack:
+        if backfill:
+            stack.enter_context(backfill_settings(endpoint, index))
+        with BulkIndexer(endpoint, workers=workers) as indexer:
+            for key in list_log_objects(s3, bucket, prefix):
+                print(f"Ingesting s3://{bucket}/{key}...")
+                parts = parse_log_key(key, prefix)
+                for batch in stream_log_batches(s3, bucket, key):
+                    if dedup:
+                        received = len(batch)
+                        batch = dedup.filter_batch(batch)
+                        duplicates += received - len(batch)
+                    if aggregator:
+                        rollups = aggregator.add(batch, parts[0] if parts else None)
+                        rollup_docs += len(rollups)
+                        indexer.index(build_rollup_actions(rollups))
+                    if sample_rate < 1:
+                        batch = sample_rows(batch, sample_rate)
+                    raw_docs += len(batch)
+                    indexer.index(build_batch_actions(batch, index, granularity))
+                objects += 1
+                if dedup and dedup.pending >= DEDUP_CHECKPOINT_IDS:
+                    failed = checkpoint_dedup(dedup, indexer, failed)
+            if aggregator:
+                rollups = aggregator.flush()
+                rollup_docs += len(rollups)
+                indexer.index(build_rollup_actions(rollups))
+            if dedup:
+                checkpoint_dedup(dedup, indexer, failed)
+    stats = indexer.stats.summary()
+    stats.update(objects=objects, raw_docs=raw_docs, rollup_docs=rollup_docs, duplicates=duplicates)
+    for error in indexer.stats.errors:
+        print(f"Bulk error: {error}")
+    return stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Stream CloudFront access logs from S3 into OpenSearch.")
+    parser.add_argument("--region", help="AWS region of the logging bucket")
+    parser.add_argument("--bucket", help="S3 bucket that receives CloudFront logs")
+    parser.add_argument("--endpoint", help="OpenSearch endpoint, e.g. http://<ec2-dns>:9200")
+    parser.add_argument("--prefix", default=DEFAULT_PREFIX, help="Log key prefix")
+    parser.add_argument("--index", default=INDEX_PREFIX, help="Target index name prefix")
+    parser.add_argument("--granularity", choices=["daily", "hourly", "none"], default="daily",
+                        help="Time partitioning of the target indices")
+    parser.add_argument("--backfill", action="store_true",
+                        help="Disable refresh and replicas while loading, restore afterwards")
+    parser.add_argument("--rollup-window", type=int,
+                        help="Also index per-window rollups of this many seconds (e.g. 60)")
+    parser.add_argument("--sample-rate", type=float,
+                        help="Fraction of raw lines to index (default 1, or 0 with --rollup-window)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent _bulk workers")
+    parser.add_argument("--dedup", nargs="?", const=DEFAULT_DEDUP_DIR, metavar="DIR",
+                        help=f"Drop records whose x-edge-request-id was already ingested, tracked in a "
+                             f"persistent filter under DIR (default {DEFAULT_DEDUP_DIR})")
+    parser.add_argument("--dedup-memory-mb", type=int, default=256,
+                        help="Memory budget of a new dedup filter")
+    parser.add_argument("--dedup-fp-rate", type=float, default=1e-3,
+                        help="False-positive rate of a new dedup filter (unique records wrongly dropped)")
+    parser.add_argument("--wait-ready", type=float, default=300, metavar="SECONDS",
+                        help="Wait up to this long for OpenSearch to be ready before indexing (0: don't wait)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    region = args.region or ask_input("Enter AWS Region: ")
+    bucket = args.bucket or ask_input("Enter log bucket name: ")
+    endpoint = args.endpoint
+    if not endpoint:
+        host = ask_input("Enter OpenSearch host (EC2 DNS): ")
+        endpoint = f"http://{host}:9200"
+
+    if args.wait_ready:
+        # Starts indexing the moment the cluster reaches yellow, e.g. right after a deploy.
+        wait_for_opensearch(endpoint, timeout=args.wait_ready)
+
+    s3 = clients.client("s3", region)
+    dedup = DedupFilter(args.dedup, args.dedup_memory_mb, args.dedup_fp_rate) if args.dedup else None
+    stats = ingest(s3, bucket, endpoint, prefix=args.prefix, index=args.index, workers=args.workers,
+                   granularity=None if args.granularity == "none" else args.granularity,
+                   backfill=args.backfill, rollup_window=args.rollup_window,
+                   sample_rate=args.sample_rate if args.sample_rate is not None
+                   else (0.0 if args.rollup_window else 1.0), dedup=dedup)
+    if dedup:
+        dedup.close()
+        print(f"Dropped {stats['duplicates']} duplicate records "
+              f"(dedup filter: {dedup.meta['fp_rate']} false-positive rate, remembers {dedup.capacity:,} request ids).")
+
+    print(f"\nProcessed {stats['objects']} log objects: "
+          f"{stats['indexed']} documents indexed, {stats['failed']} failed "
+          f"({stats['raw_docs']} raw, {stats['rollup_docs']} rollups; {stats['docs_per_s']} docs/s, p99 bulk latency {stats['p99_latency_s']} s).")
+    if stats["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# vCPUs and memory (MiB) of the instance types this tool is usually run with.
+# Anything else is looked up with DescribeInstanceTypes.
+INSTANCE_TYPES = {
+    "t2.micro": (1, 1024),
+    "t2.small": (1, 2048),
+    "t2.medium": (2, 4096),
+    "t2.large": (2, 8192),
+    "t2.xlarge": (4, 16384),
+    "t2.2xlarge": (8, 32768),
+    "t3.micro": (2, 1024),
+    "t3.small": (2, 2048),
+    "t3.medium": (2, 4096),
+    "t3.large": (2, 8192),
+    "t3.xlarge": (4, 16384),
+    "t3.2xlarge": (8, 32768),
+    "t3a.medium": (2, 4096),
+    "t3a.large": (2, 8192),
+    "t3a.xlarge": (4, 16384),
+    "t3a.2xlarge": (8, 32768),
+    "m5.large": (2, 8192),
+    "m5.xlarge": (4, 16384),
+    "m5.2xlarge": (8, 32768),
+    "m5.4xlarge": (16, 65536),
+    "m6i.large": (2, 8192),
+    "m6i.xlarge": (4, 16384),
+    "m6i.2xlarge": (8, 32768),
+    "m6i.4xlarge": (16, 65536),
+    "c5.large": (2, 4096),
+    "c5.xlarge": (4, 8192),
+    "c5.2xlarge": (8, 16384),
+    "c5.4xlarge": (16, 32768),
+    "c6i.large": (2, 4096),
+    "c6i.xlarge": (4, 8192),
+    "c6i.2xlarge": (8, 16384),
+    "c6i.4xlarge": (16, 32768),
+    "r5.large": (2, 16384),
+    "r5.xlarge": (4, 32768),
+    "r5.2xlarge": (8, 65536),
+    "r6i.large": (2, 16384),
+    "r6i.xlarge": (4, 32768),
+    "r6i.2xlarge": (8, 65536),
+}
+
+# Used when the type is unknown and cannot be looked up (t3.medium, the deploy default).
+DEFAULT_SPEC = (2, 4096)
+
+
+def get_instance_spec(instance_type, region=None):
+    """
+    Returns the vCPU count and memory of an EC2 instance type.
+
+    Args:
+        instance_type (str): e.g. 't3.medium'.
+        region (str | None): If given, unknown types are looked up with DescribeInstanceTypes.
+
+    Returns:
+        dict: {'instance_type', 'vcpus', 'memory_mib'}.
+    """
+    spec = INSTANCE_TYPES.get(instance_type)
+    if spec is None and region:
+        try:
+            import boto3
+            info = boto3.client("ec2", region_name=region).describe_instance_types(
+                InstanceTypes=[instance_type])["InstanceTypes"][0]
+            spec = (info["VCpuInfo"]["DefaultVCpus"], info["MemoryInfo"]["SizeInMiB"])
+        except Exception as e:
+            print(f"Could not look up instance type {instance_type}: {e}")
+    if spec is None:
+        print(f"Unknown instance type {instance_type}; assuming {DEFAULT_SPEC[0]} vCPUs and {DEFAULT_SPEC[1]} MiB.")
+        spec = DEFAULT_SPEC
+    return {"instance_type": instance_type, "vcpus": spec[0], "memory_mib": spec[1]}
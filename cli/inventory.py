@@ -0,0 +1,136 @@
+import argparse
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from awsclients import enabled_regions, list_instances
+from cloudfront import enable_logging, list_distributions
+from tracing import instrument_boto3, span, tracer
+
+LIVE_STATES = ["pending", "running", "stopping", "stopped"]
+
+
+def collect_instances(regions, workers=8):
+    """
+    Lists the instances of every region concurrently, one paginated
+    DescribeInstances per region.
+
+    Returns:
+        dict: Public DNS name or IP -> (region, instance).
+    """
+    def in_region(region):
+        with span(f"inventory.{region}"):
+            return region, list_instances(region, [{"Name": "instance-state-name", "Values": LIVE_STATES}])
+
+    by_address = {}
+    with ThreadPoolExecutor(max_workers=min(workers, len(regions)) or 1) as executor:
+        for region, instances in executor.map(in_region, regions):
+            for instance in instances:
+                for address in (instance.get("PublicDnsName"), instance.get("PublicIpAddress")):
+                    if address:
+                        by_address[address] = (region, instance)
+    return by_address
+
+
+def inventory(regions, workers=8):
+    """
+    Lists every distribution origin together with the EC2 instance behind it.
+
+    Distributions come from one paginated ListDistributions call, instances from
+    one paginated DescribeInstances per region, instead of a describe per origin.
+
+    Returns:
+        list[dict]: One row per (distribution, origin).
+    """
+    with span("inventory.distributions"):
+        distributions = list_distributions()
+    instances = collect_instances(regions, workers)
+    rows = []
+    for distribution in distributions:
+        for origin in distribution["Origins"].get("Items", []):
+            region, instance = instances.get(origin["DomainName"], (None, None))
+            rows.append({
+                "distribution_id": distribution["Id"],
+                "domain": distribution["DomainName"],
+                "status": distribution["Status"],
+                "enabled": distribution["Enabled"],
+                "origin_id": origin["Id"],
+                "origin": origin["DomainName"],
+                "instance_id": instance["InstanceId"] if instance else None,
+                "instance_region": region,
+                "instance_state": instance["State"]["Name"] if instance else None,
+            })
+    return rows
+
+
+def configure_logging(distribution_ids, log_bucket, log_prefix, workers=4, dry_run=False):
+    """
+    Points the standard logging of all given distributions at `log_bucket`
+    concurrently, skipping those already configured.
+
+    CloudFront's control plane allows only a few updates per second; the shared
+    client's adaptive retries slow the workers down when it throttles.
+
+    Returns:
+        dict: Distribution ID -> 'updated', 'unchanged' or the error message.
+    """
+    def configure(distribution_id):
+        with span(f"inventory.logging.{distribution_id}"):
+            try:
+                changed = enable_logging(distribution_id, log_bucket, log_prefix, dry_run=dry_run)
+            except Exception as e:
+                return distribution_id, str(e)
+        return distribution_id, "updated" if changed else "unchanged"
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(configure, distribution_ids))
+
+
+def print_rows(rows):
+    print(f"{'DISTRIBUTION':<16} {'STATUS':<10} {'ORIGIN':<45} {'INSTANCE':<21} {'REGION':<15} STATE")
+    for row in rows:
+        print(f"{row['distribution_id']:<16} {row['status']:<10} {row['origin']:<45} "
+              f"{row['instance_id'] or '-':<21} {row['instance_region'] or '-':<15} {row['instance_state'] or '-'}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Inventory CloudFront distributions, their origins and the "
+                                                 "EC2 instances behind them, across regions.")
+    parser.add_argument("--regions", help="Comma-separated regions to scan (default: all enabled regions)")
+    parser.add_argument("--workers", type=int, default=8, help="Regions scanned concurrently")
+    parser.add_argument("--json", action="store_true", help="Print the inventory as JSON")
+    parser.add_argument("--enable-logging", metavar="BUCKET",
+                        help="Also point every distribution's access logs at this bucket")
+    parser.add_argument("--log-prefix", default="cloudfront-logs/", help="Key prefix of the access logs")
+    parser.add_argument("--update-workers", type=int, default=4, help="Distributions updated concurrently")
+    parser.add_argument("--dry-run", action="store_true", help="Report what --enable-logging would change")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    instrument_boto3()
+    with span("inventory"):
+        regions = args.regions.split(",") if args.regions else enabled_regions()
+        rows = inventory(regions, args.workers)
+        results = {}
+        if args.enable_logging:
+            distribution_ids = list(dict.fromkeys(row["distribution_id"] for row in rows))
+            results = configure_logging(distribution_ids, args.enable_logging, args.log_prefix,
+                                        args.update_workers, args.dry_run)
+
+    if args.json:
+        print(json.dumps({"origins": rows, "logging": results}, indent=2, default=str))
+    else:
+        print_rows(rows)
+        for distribution_id, result in results.items():
+            print(f"Logging for {distribution_id}: {result}{' (dry run)' if args.dry_run else ''}")
+        print(f"\n{len({row['distribution_id'] for row in rows})} distributions, {len(rows)} origins "
+              f"in {len(regions)} regions.")
+        tracer.print_summary(max_depth=1)
+    if any(result not in ("updated", "unchanged") for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+
+from instance_types import get_instance_spec
+
+TEMPLATES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "templates"))
+
+# Paths of the stock Ubuntu nginx package.
+UBUNTU_PATHS = {
+    "user": "www-data",
+    "pid_path": "/run/nginx.pid",
+    "modules_include": "/etc/nginx/modules-enabled/*.conf",
+    "mime_types": "/etc/nginx/mime.types",
+    "access_log": "/var/log/nginx/access.log",
+    "error_log": "/var/log/nginx/error.log",
+    "cache_path": "/var/cache/nginx/microcache",
+    "root": "/var/www/html",
+    "listen": 80,
+}
+
+BROTLI_PACKAGES = ["libnginx-mod-http-brotli-filter", "libnginx-mod-http-brotli-static"]
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+def nginx_settings(instance_type, region=None, upstream=None, brotli=False, cache_max_size="2g", **overrides):
+    """
+    Derives nginx tuning from the instance's vCPUs and memory.
+
+    One worker per vCPU; connections per worker scale with memory per worker; the
+    micro-cache key zone and open-file cache scale with memory; compression is a
+    notch cheaper on 1-2 vCPU (usually burstable) instances.
+
+    Args:
+        instance_type (str): EC2 instance type, e.g. 't3.medium'.
+        region (str | None): Region used to look up types missing from the table.
+        upstream (str | None): 'host:port' of an application to proxy and micro-cache;
+            static files from the web root are served when None.
+        brotli (bool): Whether the brotli module is installed.
+        cache_max_size (str): On-disk limit of the proxy cache.
+        **overrides: Values replacing any derived or path setting.
+
+    Returns:
+        dict: Template variables for templates/nginx.conf.j2.
+    """
+    spec = get_instance_spec(instance_type, region)
+    vcpus, memory_mib = spec["vcpus"], spec["memory_mib"]
+    worker_connections = _clamp(memory_mib * 4 // vcpus, 1024, 16384)
+    settings = dict(UBUNTU_PATHS)
+    settings.update(spec)
+    settings.update({
+        "worker_processes": vcpus,
+        "worker_connections": worker_connections,
+        # A proxied request holds two descriptors: client and upstream.
+        "worker_rlimit_nofile": worker_connections * 2 + 1024,
+        "backlog": _clamp(worker_connections * vcpus, 1024, 65535),
+        "keepalive_timeout": "75s",
+        "keepalive_requests": 10000,
+        "open_file_cache_max": _clamp(memory_mib * 2, 1000, 100000),
+        "gzip_comp_level": 4 if vcpus <= 2 else 5,
+        "brotli": brotli,
+        "upstream": upstream,
+        "upstream_keepalive": _clamp(vcpus * 16, 16, 256),
+        # 1 MiB of key zone holds about 8000 cache keys.
+        "cache_keys_zone_mb": _clamp(memory_mib // 256, 10, 256),
+        "cache_max_size": cache_max_size,
+        "microcache_ttl": "1s",
+    })
+    settings.update(overrides)
+    return settings
+
+
+def render_nginx_conf(settings):
+    """
+    Renders templates/nginx.conf.j2 with settings from `nginx_settings`.
+    """
+    from jinja2 import Environment, FileSystemLoader
+    env = Environment(loader=FileSystemLoader(TEMPLATES_DIR), keep_trailing_newline=True,
+                      trim_blocks=True, lstrip_blocks=True)
+    return env.get_template("nginx.conf.j2").render(**settings)
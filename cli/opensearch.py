@@ -0,0 +1,59 @@
+import json
+import urllib.error
+import urllib.request
+
+
+def opensearch_request(endpoint, method, path, body=None, content_type="application/json", timeout=30):
+    """
+    Sends a single HTTP request to an OpenSearch node and returns the decoded JSON reply.
+
+    Args:
+        endpoint (str): Base URL of the node, e.g. 'http://ec2-1-2-3-4.compute.amazonaws.com:9200'.
+        method (str): HTTP method ('GET', 'PUT', 'POST', ...).
+        path (str): Request path, e.g. '/_bulk'.
+        body (dict | bytes | str | None): JSON-serialisable object or a pre-encoded payload.
+        content_type (str): Content-Type header sent with the body.
+        timeout (int): Socket timeout in seconds.
+
+    Returns:
+        dict: The parsed JSON response (empty dict for an empty body).
+
+    Raises:
+        Exception: If OpenSearch answers with an HTTP error status.
+    """
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body).encode("utf-8")
+    elif isinstance(body, str):
+        body = body.encode("utf-8")
+
+    url = endpoint.rstrip("/") + path
+    request = urllib.request.Request(url, data=body, method=method)
+    if body is not None:
+        request.add_header("Content-Type", content_type)
+
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            payload = response.read()
+    except urllib.error.HTTPError as e:
+        detail = e.read().decode("utf-8", errors="replace")
+        raise Exception(f"OpenSearch {method} {path} failed with status {e.code}: {detail}")
+
+    return json.loads(payload) if payload else {}
+
+
+def wait_for_opensearch(endpoint, timeout=300, delay=5, min_nodes=1):
+    """
+    Waits until the cluster is at least yellow with at least `min_nodes` nodes,
+    probing with jittered exponential backoff capped at `delay` seconds; each
+    probe lets the node hold the request until the condition holds.
+
+    Returns:
+        dict: The cluster health.
+
+    Raises:
+        Exception: If the cluster is not ready within `timeout` seconds.
+    """
+    from readiness import opensearch_probe, wait_until_ready
+    health, _ = wait_until_ready(f"OpenSearch at {endpoint}", opensearch_probe(endpoint, min_nodes),
+                                 timeout=timeout, maximum=delay)
+    return health
\ No newline at end of file
@@ -0,0 +1,73 @@
+from instance_types import get_instance_spec
+
+# Largest heap that safely keeps zero-based compressed object pointers; past
+# roughly 30-32 GB the JVM falls back to 64-bit pointers and a bigger heap holds
+# fewer objects than a smaller one.
+COMPRESSED_OOPS_LIMIT_MB = 30 * 1024
+MIN_HEAP_MB = 256
+# Memory left to the OS, Docker and the page cache before the heap is halved,
+# plus what OpenSearch Dashboards (Node.js) takes when it runs on the same host.
+SYSTEM_RESERVED_MB = 512
+DASHBOARDS_RESERVED_MB = 1024
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+def opensearch_settings(instance_type, region=None, dashboards=True, **overrides):
+    """
+    Derives OpenSearch JVM, thread pool and host tuning from the instance's
+    vCPUs and memory.
+
+    The heap gets at most half of the memory not reserved for the system and a
+    co-located Dashboards, leaving the rest to the page cache Lucene reads
+    segments through, and stays under the compressed-oops limit. Xms equals Xmx
+    and the heap is locked in memory, so it is neither resized nor swapped. The
+    write pool has one thread per vCPU; its queue, whose entries are bulk
+    requests held on the heap, shrinks with the heap so a small node answers 429
+    (which the bulk indexer backs off on) instead of collecting garbage
+    continuously. Log ingestion is write-heavy, so nodes with a few GB of heap
+    give indexing buffers 20% of it.
+
+    Args:
+        instance_type (str): EC2 instance type, e.g. 't3.medium'.
+        region (str | None): Region used to look up types missing from the table.
+        dashboards (bool): Whether Dashboards runs on the same host.
+        **overrides: Values replacing any derived setting.
+
+    Returns:
+        dict: Template variables for templates/docker-compose.yml.j2 and
+            `sysctl_conf`.
+    """
+    spec = get_instance_spec(instance_type, region)
+    vcpus, memory_mib = spec["vcpus"], spec["memory_mib"]
+    reserved = SYSTEM_RESERVED_MB + (DASHBOARDS_RESERVED_MB if dashboards else 0)
+    heap_mb = (memory_mib - reserved) // 2 // 128 * 128
+    heap_mb = _clamp(heap_mb, MIN_HEAP_MB, COMPRESSED_OOPS_LIMIT_MB)
+    settings = dict(spec)
+    settings.update({
+        "heap_mb": heap_mb,
+        "write_threads": vcpus,
+        "write_queue_size": _clamp(heap_mb * 2, 1000, 10000),
+        "search_queue_size": 1000,
+        "index_buffer_size": "20%" if heap_mb >= 2048 else "10%",
+        # Node.js heap of Dashboards, inside DASHBOARDS_RESERVED_MB.
+        "dashboards_heap_mb": DASHBOARDS_RESERVED_MB * 3 // 4,
+        "memory_lock": True,
+        "nofile": 65536,
+        "nproc": 4096,
+        "vm_max_map_count": 262144,
+        "vm_swappiness": 1,
+    })
+    settings.update(overrides)
+    return settings
+
+
+def sysctl_conf(settings):
+    """
+    Returns the kernel settings for /etc/sysctl.d/60-opensearch.conf.
+    """
+    return (f"# Generated for {settings['instance_type']} by cli/opensearch_tuning.py\n"
+            f"vm.max_map_count = {settings['vm_max_map_count']}\n"
+            f"vm.swappiness = {settings['vm_swappiness']}\n")
@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from tracing import span
+
+DEFAULT_STATE = os.path.expanduser("~/.cloudfront-setup/deploy-state.json")
+
+
+class Stage:
+    """
+    One step of a deploy.
+
+    `func(config, results)` receives the deploy config and a dict of the results of
+    its dependencies, and returns a JSON-serialisable result that is persisted so a
+    resumed deploy can skip the stage.
+    """
+
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+class StageState:
+    """
+    Persistent record of finished stages and their results, written atomically
+    after every stage so that a crash loses at most the stages still running.
+
+    The config the state was produced with is stored alongside; a different config
+    starts from scratch, since earlier results would not apply to it.
+    """
+
+    def __init__(self, path, config):
+        self.path = path
+        self.config = config
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return self
+        with open(self.path) as f:
+            data = json.load(f)
+        if data.get("config") != self.config:
+            print(f"Deploy config changed since {self.path} was written; starting from scratch.")
+            return self
+        self.stages = data.get("stages", {})
+        return self
+
+    def done(self, name):
+        return self.stages.get(name, {}).get("status") == "done"
+
+    def result(self, name):
+        return self.stages[name].get("result")
+
+    def record(self, name, status, result=None, error=None, elapsed=None):
+        with self._lock:
+            entry = {"status": status, "finished_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+            if result is not None:
+                entry["result"] = result
+            if error is not None:
+                entry["error"] = error
+            if elapsed is not None:
+                entry["elapsed_s"] = round(elapsed, 2)
+            self.stages[name] = entry
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"config": self.config, "stages": self.stages}, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+def _check_graph(stages):
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in names]
+        if missing:
+            raise Exception(f"Stage '{stage.name}' depends on unknown stage(s): {', '.join(missing)}")
+    by_name = {stage.name: stage for stage in stages}
+    visiting, visited = set(), set()
+
+    def visit(name):
+        if name in visited:
+            return
+        if name in visiting:
+            raise Exception(f"Dependency cycle through stage '{name}'")
+        visiting.add(name)
+        for dep in by_name[name].deps:
+            visit(dep)
+        visiting.discard(name)
+        visited.add(name)
+
+    for stage in stages:
+        visit(stage.name)
+
+
+def run_stages(stages, config, state_path=DEFAULT_STATE, max_workers=4, fresh=False):
+    """
+    Runs a dependency graph of stages on a thread pool, as early as their
+    dependencies allow, skipping stages already recorded as done.
+
+    When a stage fails no new stages are started, the running ones are allowed to
+    finish (and are recorded), and the failure is raised; running again resumes
+    from the failed stage.
+
+    Args:
+        stages (list[Stage]): The graph.
+        config (dict): Deploy configuration passed to every stage and stored with the state.
+        state_path (str): JSON file recording finished stages.
+        max_workers (int): Stages allowed to run at once.
+        fresh (bool): Ignore any previous state.
+
+    Returns:
+        dict: Stage name -> result.
+
+    Raises:
+        Exception: If a stage fails.
+    """
+    _check_graph(stages)
+    state = StageState(state_path, config)
+    if not fresh:
+        state.load()
+    results = {s.name: state.result(s.name) for s in stages if state.done(s.name)}
+    for name in results:
+        print(f"[{name}] already done, skipping.")
+    pending = {s.name: s for s in stages if s.name not in results}
+    running = {}
+    failure = None
+    started = time.perf_counter()
+
+    def execute(stage):
+        stage_started = time.perf_counter()
+        print(f"[{stage.name}] starting...")
+        with span(f"stage:{stage.name}"):
+            result = stage.func(config, {dep: results[dep] for dep in stage.deps})
+        return result, time.perf_counter() - stage_started
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if failure is None:
+                for name, stage in list(pending.items()):
+                    if all(dep in results for dep in stage.deps):
+                        running[executor.submit(execute, stage)] = stage
+                        del pending[name]
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    result, elapsed = future.result()
+                except Exception as e:
+                    state.record(stage.name, "failed", error=str(e))
+                    print(f"[{stage.name}] FAILED: {e}")
+                    failure = failure or (stage.name, e)
+                    continue
+                results[stage.name] = result
+                state.record(stage.name, "done", result=result, elapsed=elapsed)
+                print(f"[{stage.name}] done in {elapsed:.1f} s")
+
+    if failure is not None:
+        skipped = ", ".join(sorted(pending)) or "none"
+        raise Exception(f"Stage '{failure[0]}' failed: {failure[1]} (not started: {skipped}). "
+                        f"Re-run to resume from {state_path}.")
+    print(f"All stages finished in {time.perf_counter() - started:.1f} s")
+    return results
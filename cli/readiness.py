@@ -0,0 +1,183 @@
+import argparse
+import random
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from opensearch import opensearch_request
+
+
+class NotReady(Exception):
+    """Raised by a probe whose component answered but is not ready yet."""
+
+
+def backoff_delays(base=1.0, maximum=15.0):
+    """
+    Yields exponentially growing, fully jittered delays: uniform(0, min(maximum, base * 2**n)).
+    """
+    attempt = 0
+    while True:
+        yield random.uniform(0, min(maximum, base * (2 ** attempt)))
+        attempt += 1
+
+
+def wait_until_ready(name, probe, timeout=300, base=0.5, maximum=10.0):
+    """
+    Calls `probe` until it returns instead of raising, sleeping jittered
+    exponential backoff delays in between, within an overall deadline.
+
+    Args:
+        name (str): Component name used in messages.
+        probe (callable): Returns a value once the component is ready; raises
+            (e.g. `NotReady` or a connection error) while it is not.
+        timeout (float): Seconds until giving up.
+        base (float): First backoff ceiling in seconds.
+        maximum (float): Largest backoff ceiling in seconds.
+
+    Returns:
+        tuple: (the probe's return value, seconds until ready).
+
+    Raises:
+        Exception: If the component is not ready within `timeout` seconds.
+    """
+    started = time.monotonic()
+    deadline = started + timeout
+    attempt = 0
+    for delay in backoff_delays(base, maximum):
+        attempt += 1
+        try:
+            value = probe()
+        except Exception as e:
+            last_error = e
+        else:
+            elapsed = time.monotonic() - started
+            print(f"{name} ready after {elapsed:.1f} s ({attempt} probes).")
+            return value, elapsed
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise Exception(f"{name} not ready after {timeout} seconds ({attempt} probes): {last_error}")
+        if attempt == 1 or attempt % 5 == 0:
+            print(f"Waiting for {name}: {last_error}")
+        time.sleep(min(delay, remaining))
+
+
+def tcp_probe(host, port, timeout=3):
+    """
+    Returns a probe that succeeds once `host:port` accepts a TCP connection.
+    """
+    def probe():
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    return probe
+
+
+def opensearch_probe(endpoint, min_nodes=1, wait_s=10):
+    """
+    Returns a probe for `_cluster/health` at yellow or better with `min_nodes`
+    nodes. The node itself holds the request for up to `wait_s` seconds until the
+    condition holds, so readiness is noticed when it happens, not at the next poll.
+    """
+    path = f"/_cluster/health?wait_for_status=yellow&timeout={wait_s}s"
+    if min_nodes > 1:
+        path += f"&wait_for_nodes=%3E%3D{min_nodes}"
+
+    def probe():
+        health = opensearch_request(endpoint, "GET", path, timeout=wait_s + 5)
+        if health.get("timed_out") or health.get("status") not in ("yellow", "green") \
+                or health.get("number_of_nodes", 1) < min_nodes:
+            raise NotReady(f"cluster status is {health.get('status')} with "
+                           f"{health.get('number_of_nodes')}/{min_nodes} nodes")
+        return health
+    return probe
+
+
+def dashboards_probe(url):
+    """
+    Returns a probe for the OpenSearch Dashboards status API (`/api/status`),
+    which answers 503 while the server starts and reports 'green' once usable.
+    """
+    def probe():
+        status = opensearch_request(url, "GET", "/api/status", timeout=10)
+        state = status.get("status", {}).get("overall", {}).get("state")
+        if state != "green":
+            raise NotReady(f"Dashboards status is {state}")
+        return state
+    return probe
+
+
+def ec2_running_probe(client, instance_ids):
+    """
+    Returns a probe that succeeds once every instance is running and has a
+    public address; it returns the described instances.
+    """
+    def probe():
+        reservations = client.describe_instances(InstanceIds=list(instance_ids))["Reservations"]
+        instances = [instance for reservation in reservations for instance in reservation["Instances"]]
+        waiting = [instance["InstanceId"] for instance in instances
+                   if instance["State"]["Name"] != "running"
+                   or not (instance.get("PublicDnsName") or instance.get("PublicIpAddress"))]
+        if len(instances) < len(instance_ids) or waiting:
+            raise NotReady(f"{len(waiting) or len(instance_ids)} instance(s) not running yet")
+        return instances
+    return probe
+
+
+def host_probes(host):
+    """
+    The probes of one deploy host: SSH, OpenSearch and Dashboards.
+    """
+    return {
+        "ssh": tcp_probe(host, 22),
+        "opensearch": opensearch_probe(f"http://{host}:9200"),
+        "dashboards": dashboards_probe(f"http://{host}:5601"),
+    }
+
+
+def wait_for_all(probes, timeout=300):
+    """
+    Waits for several components concurrently, each with its own backoff.
+
+    Args:
+        probes (dict): Component name -> probe.
+        timeout (float): Deadline for every component.
+
+    Returns:
+        dict: Component name -> seconds until ready.
+
+    Raises:
+        Exception: Naming every component that was not ready in time.
+    """
+    ready, failed = {}, {}
+    with ThreadPoolExecutor(max_workers=len(probes)) as executor:
+        futures = {executor.submit(wait_until_ready, name, probe, timeout): name for name, probe in probes.items()}
+        for future in as_completed(futures):
+            try:
+                ready[futures[future]] = future.result()[1]
+            except Exception as e:
+                failed[futures[future]] = e
+    if failed:
+        raise Exception("; ".join(str(e) for e in failed.values()))
+    return ready
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Wait for SSH, OpenSearch and Dashboards on a host.")
+    parser.add_argument("host", help="Public DNS name or IP of the host")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for each component")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        ready = wait_for_all(host_probes(args.host), args.timeout)
+    except Exception as e:
+        print(e)
+        sys.exit(1)
+    for name, seconds in sorted(ready.items(), key=lambda item: item[1]):
+        print(f"{name:<12} ready after {seconds:6.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+import argparse
+import asyncio
+import json
+import math
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import archive
+
+# Result types that went to the origin, i.e. the load the origin actually saw.
+ORIGIN_RESULT_TYPES = ("Miss", "RefreshHit")
+# Only side-effect free requests are replayed.
+REPLAY_METHODS = ("GET", "HEAD")
+REPLAY_COLUMNS = ["timestamp", "cs_method", "cs_uri_stem", "cs_uri_query", "x_edge_result_type"]
+
+
+class LatencyHistogram:
+    """
+    HDR-style latency histogram: fixed relative precision over any range.
+
+    Values (microseconds) below `2 * 10**digits` are counted exactly; above that
+    each power of two is split into the same number of linear sub-buckets, so
+    every recorded value is kept to within 10**-digits of its true value while
+    memory stays proportional to log(max / min).
+    """
+
+    def __init__(self, digits=3):
+        self.sub_bucket_bits = math.ceil(math.log2(2 * 10 ** digits))
+        self.sub_bucket_count = 1 << self.sub_bucket_bits
+        self.half_count = self.sub_bucket_count // 2
+        self.counts = {}
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value):
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self.sub_bucket_count + (shift - 1) * self.half_count + (value >> shift) - self.half_count
+
+    def _highest_equivalent(self, index):
+        if index < self.sub_bucket_count:
+            return index
+        shift, sub = divmod(index - self.sub_bucket_count, self.half_count)
+        shift += 1
+        return ((sub + self.half_count) << shift) + (1 << shift) - 1
+
+    def record(self, value_us):
+        value = max(0, int(value_us))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.min = value if self.min is None else min(self.min, value)
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+
+    def percentile(self, pct):
+        if not self.total:
+            return None
+        target = max(1, math.ceil(self.total * pct / 100.0))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._highest_equivalent(index), self.max)
+        return self.max
+
+    def summary(self, percentiles=(50, 90, 99, 99.9, 99.99)):
+        """
+        Returns count, mean and percentiles, in milliseconds.
+        """
+        result = {"count": self.total,
+                  "mean_ms": round(self.sum / self.total / 1000, 3) if self.total else None,
+                  "max_ms": round(self.max / 1000, 3)}
+        for pct in percentiles:
+            value = self.percentile(pct)
+            result[f"p{pct:g}_ms"] = round(value / 1000, 3) if value is not None else None
+        return result
+
+
+class AsyncConnectionPool:
+    """
+    Keep-alive HTTP/1.1 connections to one host, shared by all in-flight requests.
+
+    Idle connections are reused most-recently-used first; at most `size` are open
+    at once and further requests wait for one to come back.
+    """
+
+    def __init__(self, target, size=1000, timeout=30):
+        parsed = urlparse(target if "://" in target else f"http://{target}")
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.ssl = parsed.scheme == "https"
+        self.host_header = parsed.netloc
+        self.timeout = timeout
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+        self.opened = 0
+
+    async def _connection(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        self.opened += 1
+        return await asyncio.open_connection(self.host, self.port, ssl=self.ssl or None)
+
+    async def request(self, method, path):
+        """
+        Sends one request and drains the response body. Connecting counts
+        against the same `timeout`, so an origin that drops SYNs fails the
+        request with a timeout instead of waiting out the kernel's connect retries.
+
+        Returns:
+            tuple: (HTTP status, response body length).
+        """
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.timeout
+            reader, writer = await asyncio.wait_for(self._connection(), self.timeout)
+            try:
+                writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host_header}\r\n"
+                             f"User-Agent: cloudfront-replay\r\nAccept-Encoding: gzip\r\n\r\n".encode("latin-1"))
+                status, length, keep_alive = await asyncio.wait_for(
+                    self._read_response(reader, method), max(deadline - loop.time(), 0))
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+            return status, length
+
+    @staticmethod
+    async def _read_response(reader, method):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed by server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = headers.get("connection", "").lower() != "close" and status_line.startswith(b"HTTP/1.1")
+
+        length = 0
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            pass
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                length += len(await reader.readexactly(size))
+                await reader.readexactly(2)
+        elif "content-length" in headers:
+            length = len(await reader.readexactly(int(headers["content-length"])))
+        else:
+            length = len(await reader.read())
+            keep_alive = False
+        return status, length, keep_alive
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+
+class ReplayStats:
+    """Latency histograms, status counts and schedule lag for one replay run."""
+
+    def __init__(self):
+        # Latency from when the request was due: includes time spent queued behind
+        # the in-flight limit, so a stalled origin cannot hide its slowness.
+        self.response_time = LatencyHistogram()
+        # Latency from when the request was handed to the connection pool.
+        self.service_time = LatencyHistogram()
+        self.statuses = {}
+        self.errors = {}
+        self.bytes = 0
+        self.max_lag_s = 0.0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        sent = self.response_time.total + sum(self.errors.values())
+        failures = sum(self.errors.values()) + sum(c for s, c in self.statuses.items() if s >= 500)
+        return {
+            "requests": sent,
+            "elapsed_s": round(elapsed, 3),
+            "requests_per_s": round(sent / elapsed, 1) if elapsed else 0.0,
+            "bytes": self.bytes,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "errors": dict(self.errors),
+            "error_rate": round(failures / sent, 5) if sent else None,
+            "max_schedule_lag_s": round(self.max_lag_s, 3),
+            "response_time": self.response_time.summary(),
+            "service_time": self.service_time.summary(),
+        }
+
+
+def load_requests(archive_dir=None, src_dir=None, start=None, end=None, distribution=None):
+    """
+    Loads origin-bound GET/HEAD requests as (offset seconds, method, path) arrays,
+    sorted by time.
+
+    Logs have one-second resolution, so requests logged in the same second are
+    spread evenly across it, in log order.
+    """
+    if archive_dir:
+        table = archive.scan(archive.open_archive(archive_dir), REPLAY_COLUMNS,
+                             start=start, end=end, distribution=distribution)
+    else:
+        table = archive.load_log_dir(src_dir, REPLAY_COLUMNS)
+    if not len(table):
+        raise Exception("No log records found to replay.")
+
+    mask = pc.and_(pc.is_in(table["x_edge_result_type"], pa.array(ORIGIN_RESULT_TYPES)),
+                   pc.is_in(table["cs_method"], pa.array(REPLAY_METHODS)))
+    table = table.filter(mask).sort_by("timestamp")
+    seconds = table["timestamp"].cast(pa.timestamp("s", tz="UTC")).cast(pa.int64()).to_numpy()
+    if not len(seconds):
+        raise Exception("No origin-bound (Miss/RefreshHit) GET/HEAD requests in the selected logs.")
+
+    starts = np.flatnonzero(np.r_[True, seconds[1:] != seconds[:-1]])
+    counts = np.diff(np.r_[starts, len(seconds)])
+    rank = np.arange(len(seconds)) - np.repeat(starts, counts)
+    offsets = (seconds - seconds[0]) + rank / np.repeat(counts, counts)
+
+    queries = pc.fill_null(table["cs_uri_query"], "").to_pylist()
+    paths = [stem + ("?" + query if query else "")
+             for stem, query in zip(pc.fill_null(table["cs_uri_stem"], "/").to_pylist(), queries)]
+    return offsets, table["cs_method"].to_pylist(), paths
+
+
+async def replay(target, offsets, methods, paths, speed=1.0, concurrency=2000, connections=1000, timeout=30):
+    """
+    Re-issues requests against `target`, keeping their relative timing divided by `speed`.
+
+    A scheduler coroutine starts each request at its due time; at most `concurrency`
+    are in flight, sharing `connections` keep-alive connections. When the limit is
+    reached the scheduler falls behind instead of dropping requests, and the lag
+    is reported.
+
+    Returns:
+        ReplayStats: The collected measurements.
+    """
+    pool = AsyncConnectionPool(target, size=connections, timeout=timeout)
+    stats = ReplayStats()
+    in_flight = asyncio.Semaphore(concurrency)
+    tasks = set()
+    loop = asyncio.get_running_loop()
+    origin = loop.time()
+
+    async def send(method, path, due):
+        try:
+            sent = loop.time()
+            status, length = await pool.request(method, path)
+            done = loop.time()
+            stats.response_time.record((done - due) * 1e6)
+            stats.service_time.record((done - sent) * 1e6)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.bytes += length
+        except asyncio.TimeoutError:
+            stats.errors["timeout"] = stats.errors.get("timeout", 0) + 1
+        except Exception as e:
+            name = type(e).__name__
+            stats.errors[name] = stats.errors.get(name, 0) + 1
+        finally:
+            in_flight.release()
+
+    for offset, method, path in zip((offsets / speed).tolist(), methods, paths):
+        due = origin + offset
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await in_flight.acquire()
+        stats.max_lag_s = max(stats.max_lag_s, loop.time() - due)
+        task = asyncio.ensure_future(send(method, path, due))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks)
+    pool.close()
+    stats.finished = time.perf_counter()
+    return stats
+
+
+async def serve_stub(host="127.0.0.1", port=8080, body_bytes=1024, delay_ms=0.0):
+    """
+    Runs a minimal keep-alive HTTP server that answers every request with 200 and
+    a fixed body, to exercise `replay` without an nginx origin.
+    """
+    body = b"x" * body_bytes
+    header = (f"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: {body_bytes}\r\n"
+              f"Connection: keep-alive\r\n\r\n").encode("latin-1")
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                if delay_ms:
+                    await asyncio.sleep(delay_ms / 1000)
+                writer.write(header if request_line.startswith(b"HEAD") else header + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port, backlog=4096)
+    print(f"Stub origin listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay origin-bound CloudFront traffic against an origin.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="Replay logged Miss/RefreshHit requests")
+    source = p.add_mutually_exclusive_group(required=True)
+    source.add_argument("--archive", help="Parquet archive written by archive.py compact")
+    source.add_argument("--src", help="Directory of fetched .gz logs")
+    p.add_argument("--target", required=True, help="Origin to load, e.g. http://ec2-1-2-3-4.compute.amazonaws.com")
+    p.add_argument("--start", help="Inclusive start time, e.g. 2024-01-31T00:00")
+    p.add_argument("--end", help="Exclusive end time")
+    p.add_argument("--distribution", help="Restrict to one distribution id")
+    p.add_argument("--speed", type=float, default=1.0, help="Time compression factor (2 = twice as fast)")
+    p.add_argument("--concurrency", type=int, default=2000, help="Maximum requests in flight")
+    p.add_argument("--connections", type=int, default=1000, help="Maximum open connections")
+    p.add_argument("--timeout", type=float, default=30, help="Per-request timeout in seconds")
+    p.add_argument("--report", help="Write the JSON summary here as well")
+
+    p = sub.add_parser("stub", help="Run a local stub origin")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--body-bytes", type=int, default=1024)
+    p.add_argument("--delay-ms", type=float, default=0.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "stub":
+        asyncio.run(serve_stub(args.host, args.port, args.body_bytes, args.delay_ms))
+        return
+
+    offsets, methods, paths = load_requests(args.archive, args.src, _parse_time(args.start),
+                                            _parse_time(args.end), args.distribution)
+    print(f"Replaying {len(paths)} requests spanning {offsets[-1]:.0f} s at {args.speed}x against {args.target}...")
+    stats = asyncio.run(replay(args.target, offsets, methods, paths, args.speed,
+                               args.concurrency, args.connections, args.timeout))
+    summary = stats.summary()
+    print(json.dumps(summary, indent=2))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+import hashlib
+import heapq
+import json
+import time
+from collections import Counter
+from operator import itemgetter
+
+import numpy as np
+
+from index_templates import ROLLUP_PREFIX
+
+# x-edge-result-type values served from the edge cache.
+HIT_RESULT_TYPES = ("Hit", "RefreshHit")
+
+
+class TDigest:
+    """
+    Merging t-digest for streaming quantile estimates of `time-taken`.
+
+    Values are buffered and periodically folded into centroids with the k1 scale
+    function, so the digest stays at roughly `compression` centroids while
+    keeping quantiles near 0 and 1 accurate. Compression is vectorised: one sort
+    and one `bincount` per fold.
+    """
+
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._buffer = []
+        self._buffered = 0
+
+    def update(self, values, weights=None):
+        values = np.asarray(values, dtype=np.float64)
+        keep = ~np.isnan(values)
+        values = values[keep]
+        if not len(values):
+            return
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64)[keep]
+        self._buffer.append((values, weights))
+        self._buffered += len(values)
+        self.count += weights.sum()
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        if self._buffered > self.compression * 10:
+            self._compress()
+
+    def merge(self, other):
+        other._compress()
+        if len(other.means):
+            self.update(other.means, other.weights)
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        means = np.concatenate([self.means] + [v for v, _ in self._buffer])
+        weights = np.concatenate([self.weights] + [w for _, w in self._buffer])
+        self._buffer = []
+        self._buffered = 0
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        q = (np.cumsum(weights) - weights / 2) / total
+        k = np.floor(self.compression * (np.arcsin(2 * q - 1) / np.pi + 0.5)).astype(np.int64)
+        _, bucket = np.unique(k, return_inverse=True)
+        self.weights = np.bincount(bucket, weights=weights)
+        self.means = np.bincount(bucket, weights=means * weights) / self.weights
+
+    def quantile(self, q):
+        self._compress()
+        if not len(self.means):
+            return None
+        if len(self.means) == 1:
+            return float(self.means[0])
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.concatenate([[0.0], centers, [self.count]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+        return float(np.interp(q * self.count, positions, values))
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy-hitter sketch: approximate top-K with bounded memory.
+
+    At most `capacity` items are tracked; a new item evicts the current minimum
+    and inherits its count as an over-estimation error. Any item whose true
+    count exceeds total/capacity is guaranteed to be tracked.
+    """
+
+    def __init__(self, k=10, capacity=None):
+        self.k = k
+        self.capacity = capacity or k * 10
+        self.counts = {}
+        self.errors = {}
+
+    def update(self, item, count=1):
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+        elif len(counts) < self.capacity:
+            counts[item] = count
+            self.errors[item] = 0
+        else:
+            victim = min(counts, key=counts.get)
+            floor = counts.pop(victim)
+            del self.errors[victim]
+            counts[item] = floor + count
+            self.errors[item] = floor
+
+    def update_counts(self, counts):
+        """
+        Adds a dict of pre-aggregated counts in one step.
+
+        Untracked items enter with the current minimum as their error, exactly as
+        if each had evicted the minimum, and the summary is then cut back to the
+        `capacity` largest counts with one `nlargest` instead of a scan per eviction.
+        """
+        floor = min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+        tracked = self.counts
+        for item, count in counts.items():
+            if item in tracked:
+                tracked[item] += count
+            else:
+                tracked[item] = count + floor
+                self.errors[item] = floor
+        if len(tracked) > self.capacity:
+            self.counts = dict(heapq.nlargest(self.capacity, tracked.items(), key=itemgetter(1)))
+            self.errors = {item: self.errors[item] for item in self.counts}
+
+    def top(self, k=None):
+        ranked = sorted(self.counts.items(), key=lambda kv: -kv[1])[:k or self.k]
+        return [{"value": item, "count": count, "error": self.errors[item]} for item, count in ranked]
+
+
+class _Group:
+    __slots__ = ("requests", "bytes", "hits", "status", "time_taken")
+
+    def __init__(self, compression):
+        self.requests = 0
+        self.bytes = 0
+        self.hits = 0
+        self.status = Counter()
+        self.time_taken = TDigest(compression)
+
+
+def path_prefix(uri, depth=1):
+    """
+    Returns the first `depth` directory segments of a URI stem:
+    '/static/js/app.js' -> '/static' (depth 1), '/index.html' -> '/'.
+    """
+    segments = uri.split("/")[1:-1]
+    return "/" + "/".join(segments[:depth])
+
+
+def _iso(epoch):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(epoch))
+
+
+class RollupAggregator:
+    """
+    Streaming tumbling-window rollups over columnar `LogBatch` objects.
+
+    Records are grouped by (window, distribution, edge location, path prefix) and
+    reduced to request/byte/hit counts, a status distribution and a t-digest of
+    `time-taken`. Each (window, distribution) also tracks Space-Saving top-K URIs
+    and client IPs. Windows are emitted once the newest event time seen is more
+    than `allowed_lateness_s` past their end; `flush()` emits the rest.
+
+    Rollup documents are additive: if a window is emitted more than once because
+    late records arrived, summing `requests`/`sc_bytes`/`hits` still gives exact totals.
+    Each document carries `emission`, the number of earlier emissions of its key
+    in this run, which `rollup_id` turns into a deterministic `_id`: re-running
+    the same input overwrites the documents instead of doubling them. A window
+    that is only partly re-ingested (e.g. a resumed run, or dedup dropping the
+    records indexed before) is not additive across runs: its new documents
+    replace the earlier ones with the same `_id` and count only what this run saw.
+    """
+
+    def __init__(self, window_s=60, path_depth=1, top_k=10, compression=50, allowed_lateness_s=3600):
+        self.window_s = window_s
+        self.path_depth = path_depth
+        self.top_k = top_k
+        self.compression = compression
+        self.allowed_lateness_s = allowed_lateness_s
+        self.watermark = 0
+        self.groups = {}
+        self.heavy_hitters = {}
+        self._prefixes = {}
+        # Emissions so far per key, numbering late re-emissions for `rollup_id`.
+        self._emissions = Counter()
+
+    def _prefix(self, uri):
+        prefix = self._prefixes.get(uri)
+        if prefix is None:
+            if len(self._prefixes) > 100000:
+                self._prefixes.clear()
+            prefix = self._prefixes[uri] = path_prefix(uri, self.path_depth)
+        return prefix
+
+    def add(self, batch, distribution=None):
+        """
+        Folds one batch into the open windows.
+
+        Args:
+            batch (LogBatch): Parsed log records.
+            distribution (str | None): Distribution id of the log object; defaults
+                to each record's cs(Host).
+
+        Returns:
+            list[dict]: Rollup documents for windows closed by this batch.
+        """
+        n = len(batch)
+        if not n:
+            return []
+        timestamps = batch["timestamp"]
+        windows = (timestamps - timestamps % self.window_s).tolist()
+        distributions = [distribution] * n if distribution else batch["cs(Host)"].tolist()
+        edges = batch["x-edge-location"].tolist()
+        uris = batch["cs-uri-stem"].tolist()
+        prefixes = [self._prefix(uri) for uri in uris]
+
+        index = {}
+        codes = np.fromiter((index.setdefault(key, len(index))
+                             for key in zip(windows, distributions, edges, prefixes)),
+                            dtype=np.int64, count=n)
+        size = len(index)
+        results = batch["x-edge-result-type"]
+        hits = np.zeros(n, dtype=bool)
+        for result_type in HIT_RESULT_TYPES:
+            hits |= results.equals(result_type)
+        sc_bytes = batch["sc-bytes"]
+        requests = np.bincount(codes, minlength=size)
+        byte_sums = np.bincount(codes, weights=np.where(sc_bytes >= 0, sc_bytes, 0), minlength=size)
+        hit_sums = np.bincount(codes, weights=hits, minlength=size)
+
+        status = batch["sc-status"]
+        status_counts = {int(code): np.bincount(codes[status == code], minlength=size)
+                         for code in np.unique(status) if code >= 0}
+
+        order = np.argsort(codes, kind="stable")
+        taken = np.split(batch["time-taken"][order], np.cumsum(requests)[:-1])
+
+        for key, g in index.items():
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = _Group(self.compression)
+            group.requests += int(requests[g])
+            group.bytes += int(byte_sums[g])
+            group.hits += int(hit_sums[g])
+            for code, counts in status_counts.items():
+                if counts[g]:
+                    group.status[code] += int(counts[g])
+            group.time_taken.update(taken[g])
+
+        self._update_heavy_hitters(0, windows, distributions, uris)
+        self._update_heavy_hitters(1, windows, distributions, batch["c-ip"].tolist())
+
+        self.watermark = max(self.watermark, int(timestamps.max()))
+        return self._emit(self.watermark - self.allowed_lateness_s)
+
+    def _update_heavy_hitters(self, slot, windows, distributions, values):
+        per_window = {}
+        for (window, dist, value), count in Counter(zip(windows, distributions, values)).items():
+            per_window.setdefault((window, dist), {})[value] = count
+        for key, counts in per_window.items():
+            sketches = self.heavy_hitters.get(key)
+            if sketches is None:
+                sketches = self.heavy_hitters[key] = (SpaceSaving(self.top_k), SpaceSaving(self.top_k))
+            sketches[slot].update_counts(counts)
+
+    def flush(self):
+        """
+        Emits every open window.
+        """
+        return self._emit(None)
+
+    def _emit(self, cutoff):
+        docs = []
+        for key in [k for k in self.groups if cutoff is None or k[0] + self.window_s <= cutoff]:
+            window, distribution, edge, prefix = key
+            group = self.groups.pop(key)
+            emission = self._emissions[key]
+            self._emissions[key] += 1
+            docs.append({
+                "@timestamp": _iso(window),
+                "doc_type": "rollup",
+                "window_s": self.window_s,
+                "distribution": distribution,
+                "x_edge_location": edge,
+                "path_prefix": prefix,
+                "requests": group.requests,
+                "sc_bytes": group.bytes,
+                "hits": group.hits,
+                "hit_ratio": round(group.hits / group.requests, 4) if group.requests else None,
+                "status": {str(code): count for code, count in group.status.items()},
+                "status_5xx": sum(c for code, c in group.status.items() if code >= 500),
+                "time_taken_p50": group.time_taken.quantile(0.5),
+                "time_taken_p95": group.time_taken.quantile(0.95),
+                "time_taken_p99": group.time_taken.quantile(0.99),
+                "time_taken_max": float(group.time_taken.max) if group.time_taken.count else None,
+                "emission": emission,
+            })
+        for key in [k for k in self.heavy_hitters if cutoff is None or k[0] + self.window_s <= cutoff]:
+            window, distribution = key
+            uris, ips = self.heavy_hitters.pop(key)
+            emission = self._emissions[key]
+            self._emissions[key] += 1
+            docs.append({
+                "@timestamp": _iso(window),
+                "doc_type": "top_k",
+                "window_s": self.window_s,
+                "distribution": distribution,
+                "top_uris": uris.top(),
+                "top_client_ips": ips.top(),
+                "emission": emission,
+            })
+        return docs
+
+
+def sample_rows(batch, rate, rng=None):
+    """
+    Returns a Bernoulli sample of the batch's rows (rate 0 -> empty, 1 -> all).
+    """
+    if rate >= 1:
+        return batch
+    rng = rng or np.random.default_rng()
+    return batch.take(np.flatnonzero(rng.random(len(batch)) < rate))
+
+
+def rollup_id(doc):
+    """
+    Returns a deterministic document id for a rollup document, from its window,
+    distribution, edge location, path prefix and emission number.
+    """
+    key = "|".join(str(doc.get(field)) for field in ("doc_type", "@timestamp", "window_s", "distribution",
+                                                     "x_edge_location", "path_prefix", "emission"))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:24]
+
+
+def build_rollup_actions(docs, prefix=ROLLUP_PREFIX):
+    """
+    Yields NDJSON `_bulk` action pairs routing rollup documents to daily indices,
+    with `rollup_id` as the `_id` so a re-run overwrites instead of duplicating.
+    """
+    for doc in docs:
+        index = f"{prefix}-{doc['@timestamp'][:10].replace('-', '.')}"
+        action = {"index": {"_index": index, "_id": rollup_id(doc)}}
+        yield (json.dumps(action) + "\n" + json.dumps(doc) + "\n").encode("utf-8")
@@ -1,5 +1,8 @@
 from botocore.exceptions import ClientError
 
+from tracing import traced
+
+@traced("s3.ensure_bucket")
 def ensure_bucket(session, bucket_name, region):
     s3 = session.client('s3')
     try:
@@ -0,0 +1,301 @@
+import select
+import threading
+import time
+import uuid
+from collections import deque
+
+import paramiko
+
+from readiness import backoff_delays
+from tracing import span, tracer
+
+
+class ScriptResult:
+    """Outcome of `run_script`: the exit code of every step that ran, plus output tails."""
+
+    def __init__(self, steps, exit_status, stdout_tail, stderr_tail):
+        self.steps = steps
+        self.exit_status = exit_status
+        self.stdout_tail = stdout_tail
+        self.stderr_tail = stderr_tail
+
+    @property
+    def ok(self):
+        return self.exit_status == 0
+
+    def failed_step(self):
+        return next(((cmd, rc) for cmd, rc in self.steps if rc != 0), None)
+
+
+def build_script(commands, token):
+    """
+    Builds one bash script running `commands` in order, each in its own subshell
+    with stdin detached (stdin carries the script itself).
+
+    After every step a marker line `<token> <index> <exit code>` goes to stdout;
+    the script stops at the first failing step and exits with its code.
+    """
+    lines = ["set -o pipefail"]
+    for i, command in enumerate(commands):
+        lines.append(f"( {command}\n) < /dev/null")
+        lines.append(f"rc=$?; printf '\\n{token} {i} %d\\n' $rc; [ $rc -eq 0 ] || exit $rc")
+    return "\n".join(lines) + "\n"
+
+
+class _LineSplitter:
+    """Turns a byte stream into complete lines, keeping the partial last line buffered."""
+
+    def __init__(self):
+        self._pending = b""
+
+    def feed(self, data):
+        data = self._pending + data
+        *lines, self._pending = data.split(b"\n")
+        return [line.decode("utf-8", "replace") for line in lines]
+
+    def flush(self):
+        rest, self._pending = self._pending, b""
+        return [rest.decode("utf-8", "replace")] if rest else []
+
+
+def stream_channel(channel, on_stdout, on_stderr, chunk_size=32768):
+    """
+    Reads stdout and stderr of a running channel concurrently until the command
+    exits, passing complete lines to the callbacks as they arrive, so a chatty
+    stream can never fill its window and stall the other.
+
+    Returns:
+        int: The remote exit status.
+    """
+    out, err = _LineSplitter(), _LineSplitter()
+    while True:
+        progressed = False
+        while channel.recv_ready():
+            for line in out.feed(channel.recv(chunk_size)):
+                on_stdout(line)
+            progressed = True
+        while channel.recv_stderr_ready():
+            for line in err.feed(channel.recv_stderr(chunk_size)):
+                on_stderr(line)
+            progressed = True
+        if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+            break
+        if not progressed:
+            select.select([channel], [], [], 1.0)
+    for line in out.flush():
+        on_stdout(line)
+    for line in err.flush():
+        on_stderr(line)
+    return channel.recv_exit_status()
+
+
+def execute(ssh_client, command, on_stdout=None, on_stderr=None):
+    """
+    Runs one command on a new channel of the client's transport.
+
+    Returns:
+        tuple: (exit status, stdout text, stderr text).
+    """
+    channel = ssh_client.get_transport().open_session()
+    stdout, stderr = [], []
+    try:
+        channel.exec_command(command)
+        status = stream_channel(channel,
+                                lambda line: (stdout.append(line), on_stdout and on_stdout(line)),
+                                lambda line: (stderr.append(line), on_stderr and on_stderr(line)))
+    finally:
+        channel.close()
+    return status, "\n".join(stdout), "\n".join(stderr)
+
+
+def run_script(ssh_client, commands, label="", echo=True, tail_lines=50, check=True):
+    """
+    Runs a list of shell commands as one pipelined remote script over a single channel.
+
+    The script is sent on stdin to `bash -s`, so there is one round trip for the
+    whole list instead of one channel and one exchange per command. Per-step exit
+    codes are recovered from marker lines; output is streamed while it runs.
+
+    Args:
+        ssh_client (paramiko.SSHClient): The active SSH client.
+        commands (list): Shell commands to run in order.
+        label (str): Prefix for echoed output lines, e.g. the host name.
+        echo (bool): Print output lines as they arrive.
+        tail_lines (int): Lines of stdout/stderr kept for the result and error message.
+        check (bool): Raise if a step fails.
+
+    Returns:
+        ScriptResult: Exit codes of the steps that ran and the output tails.
+
+    Raises:
+        Exception: If `check` is set and a step exits non-zero.
+    """
+    token = f"__step_{uuid.uuid4().hex}__"
+    prefix = f"[{label}] " if label else ""
+    steps = []
+    step_started = [time.perf_counter()]
+    stdout_tail, stderr_tail = deque(maxlen=tail_lines), deque(maxlen=tail_lines)
+
+    def on_stdout(line):
+        if line.startswith(token):
+            _, index, rc = line.split()
+            steps.append((commands[int(index)], int(rc)))
+            # Steps run back to back, so each one spans from the previous marker to its own.
+            now = time.perf_counter()
+            tracer.record(f"step: {commands[int(index)][:60]}", step_started[0], now, exit_status=int(rc))
+            step_started[0] = now
+            if echo:
+                print(f"{prefix}step {int(index) + 1}/{len(commands)} exited {rc}: {commands[int(index)]}")
+            return
+        if line:
+            stdout_tail.append(line)
+            if echo:
+                print(f"{prefix}{line}")
+
+    def on_stderr(line):
+        if line:
+            stderr_tail.append(line)
+            if echo:
+                print(f"{prefix}{line}")
+
+    with span("ssh.run_script", host=label, steps=len(commands)):
+        channel = ssh_client.get_transport().open_session()
+        try:
+            channel.exec_command("bash -s")
+            channel.sendall(build_script(commands, token).encode("utf-8"))
+            channel.shutdown_write()
+            step_started[0] = time.perf_counter()
+            exit_status = stream_channel(channel, on_stdout, on_stderr)
+        finally:
+            channel.close()
+
+    result = ScriptResult(steps, exit_status, list(stdout_tail), list(stderr_tail))
+    if check and not result.ok:
+        failed = result.failed_step()
+        what = f"Command '{failed[0]}'" if failed else "Remote script"
+        raise Exception(f"{what} failed with exit status {exit_status}:\n" + "\n".join(stderr_tail))
+    return result
+
+
+def load_private_key(key_path):
+    """
+    Loads an RSA, ECDSA or Ed25519 private key from a file.
+
+    Raises:
+        Exception: If the file is missing, unreadable, encrypted or not a private key.
+    """
+    errors = []
+    for key_class in (paramiko.RSAKey, paramiko.ECDSAKey, paramiko.Ed25519Key):
+        try:
+            return key_class.from_private_key_file(key_path)
+        except paramiko.PasswordRequiredException:
+            raise Exception(f"SSH key {key_path} is encrypted; use a key without a passphrase")
+        except paramiko.SSHException as e:
+            errors.append(str(e))
+        except OSError as e:
+            raise Exception(f"Cannot read SSH key {key_path}: {e}")
+    raise Exception(f"{key_path} is not a supported private key ({'; '.join(errors)})")
+
+
+class SSHManager:
+    """
+    Keeps one authenticated SSH transport per (host, user) and hands out the same
+    client to every step, which then opens lightweight channels on it.
+
+    A dead transport is reconnected transparently. Connecting retries with jittered
+    exponential backoff until `connect_timeout` instead of fixed sleeps, which is
+    what a freshly booted instance needs while sshd is starting. A rejected login
+    is retried for at most `auth_retry_timeout` seconds after the first rejection,
+    since sshd can accept connections before cloud-init has written
+    authorized_keys; an unreadable key fails at once.
+    """
+
+    def __init__(self, connect_timeout=300, keepalive=30, auth_retry_timeout=60):
+        self.connect_timeout = connect_timeout
+        self.auth_retry_timeout = auth_retry_timeout
+        self.keepalive = keepalive
+        self._clients = {}
+        self._host_locks = {}
+        self._lock = threading.Lock()
+
+    def client(self, hostname, key_path, username="ubuntu"):
+        """
+        Returns a connected client for the host, reusing its transport when alive.
+
+        Raises:
+            Exception: If the key cannot be loaded, authentication fails, or no
+                connection could be made within `connect_timeout` seconds.
+        """
+        key = (hostname, username)
+        # One lock per host: connecting to a slow host does not hold up the others.
+        with self._lock:
+            host_lock = self._host_locks.setdefault(key, threading.Lock())
+        with host_lock:
+            client = self._clients.get(key)
+            if client is not None:
+                transport = client.get_transport()
+                if transport is not None and transport.is_active():
+                    return client
+                client.close()
+            client = self._connect(hostname, key_path, username)
+            self._clients[key] = client
+            return client
+
+    def _connect(self, hostname, key_path, username):
+        with span("ssh.connect", host=hostname) as connect_span:
+            client = self._connect_with_retries(hostname, key_path, username, connect_span)
+        return client
+
+    def _connect_with_retries(self, hostname, key_path, username, connect_span):
+        pkey = load_private_key(key_path)
+        deadline = time.monotonic() + self.connect_timeout
+        auth_deadline = None
+        attempt = 0
+        for delay in backoff_delays():
+            attempt += 1
+            connect_span.attrs["attempts"] = attempt
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            try:
+                client.connect(hostname, username=username, pkey=pkey, timeout=15,
+                               banner_timeout=30, auth_timeout=30)
+                client.get_transport().set_keepalive(self.keepalive)
+                print(f"SSH connection to {hostname} established (attempt {attempt}).")
+                return client
+            except paramiko.AuthenticationException as e:
+                client.close()
+                error = e
+                if auth_deadline is None:
+                    auth_deadline = min(deadline, time.monotonic() + self.auth_retry_timeout)
+                remaining = auth_deadline - time.monotonic()
+                if remaining <= 0:
+                    raise Exception(f"SSH authentication to {username}@{hostname} with {key_path} failed "
+                                    f"after {attempt} attempts: {e}")
+            except (paramiko.SSHException, EOFError, OSError) as e:
+                client.close()
+                error = e
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise Exception(f"Failed to establish SSH connection to {hostname} after "
+                                    f"{attempt} attempts: {e}")
+            delay = min(delay, remaining)
+            print(f"SSH connection to {hostname} failed (attempt {attempt}): {error}; retrying in {delay:.1f} s")
+            time.sleep(delay)
+
+    def run(self, hostname, key_path, commands, username="ubuntu", **kwargs):
+        """
+        Runs `commands` as one pipelined script on the host (see `run_script`).
+        """
+        return run_script(self.client(hostname, key_path, username), commands, label=hostname, **kwargs)
+
+    def close(self, hostname=None):
+        """
+        Closes the connections to `hostname`, or all of them.
+        """
+        with self._lock:
+            for key in [k for k in self._clients if hostname is None or k[0] == hostname]:
+                self._clients.pop(key).close()
+
+
+# The manager shared by every step of a deploy.
+ssh_manager = SSHManager()
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import subprocess
+import time
+
+from tracing import span
+from utils import TERRAFORM_DIR
+
+CACHE_DIR = os.path.expanduser("~/.cloudfront-setup/terraform-cache")
+# Shared by every Terraform run on this machine, so providers are downloaded once.
+PLUGIN_CACHE_DIR = os.path.expanduser("~/.cloudfront-setup/terraform-plugins")
+# Kept inside .terraform/, so deleting that directory also forces a new init.
+INIT_STAMP = os.path.join(".terraform", "cloudfront-setup-init.sha256")
+
+# `terraform plan -detailed-exitcode` exit codes.
+PLAN_NO_CHANGES = 0
+PLAN_CHANGES = 2
+
+
+def terraform_env():
+    """
+    Returns the environment Terraform runs with: the shared provider plugin cache
+    and non-interactive output.
+    """
+    os.makedirs(PLUGIN_CACHE_DIR, exist_ok=True)
+    env = dict(os.environ)
+    env.setdefault("TF_PLUGIN_CACHE_DIR", PLUGIN_CACHE_DIR)
+    env["TF_IN_AUTOMATION"] = "1"
+    return env
+
+
+def _config_files(terraform_dir):
+    for root, dirs, files in os.walk(terraform_dir):
+        dirs[:] = sorted(d for d in dirs if d != ".terraform")
+        for name in sorted(files):
+            if name.endswith(".tf") or name == ".terraform.lock.hcl":
+                yield os.path.join(root, name)
+
+
+def config_fingerprint(terraform_dir=TERRAFORM_DIR, tf_vars=None):
+    """
+    Returns a SHA-256 over the Terraform configuration files (and provider lock
+    file) and, when given, the variables; any change to either changes the key.
+
+    Args:
+        terraform_dir (str): Directory holding the .tf files.
+        tf_vars (dict | None): Variables passed with -var.
+
+    Returns:
+        str: Hex digest.
+    """
+    digest = hashlib.sha256()
+    for path in _config_files(terraform_dir):
+        digest.update(os.path.relpath(path, terraform_dir).encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    if tf_vars is not None:
+        digest.update(json.dumps(tf_vars, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _cache_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def load_cached_outputs(key):
+    """
+    Returns the outputs recorded for a fingerprint, or None.
+    """
+    try:
+        with open(_cache_path(key)) as f:
+            return json.load(f)["outputs"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def store_outputs(key, outputs):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = _cache_path(key) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"outputs": outputs, "stored_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())},
+                  f, indent=2)
+    os.replace(tmp_path, _cache_path(key))
+
+
+def cached_init(terraform_dir=TERRAFORM_DIR):
+    """
+    Runs `terraform init` only when the configuration changed since the last
+    successful init in this directory (or .terraform/ is missing).
+
+    Returns:
+        bool: True if init was skipped.
+    """
+    key = config_fingerprint(terraform_dir)
+    stamp_path = os.path.join(terraform_dir, INIT_STAMP)
+    try:
+        with open(stamp_path) as f:
+            if f.read().strip() == key:
+                print(f"Terraform init cache hit ({key[:12]}); skipping init.")
+                return True
+    except OSError:
+        pass
+    print(f"Terraform init cache miss ({key[:12]}); initializing...")
+    with span("terraform.init"):
+        subprocess.run(["terraform", "init", "-input=false"], cwd=terraform_dir, env=terraform_env(), check=True)
+    # init may have written or updated the lock file, so fingerprint again.
+    with open(stamp_path, "w") as f:
+        f.write(config_fingerprint(terraform_dir))
+    return False
+
+
+def terraform_outputs(terraform_dir=TERRAFORM_DIR):
+    """
+    Returns `terraform output -json` as a dict of output name -> value.
+    """
+    with span("terraform.output"):
+        result = subprocess.run(["terraform", "output", "-json"], cwd=terraform_dir, env=terraform_env(),
+                                capture_output=True, text=True, check=True)
+    return {key: value["value"] for key, value in json.loads(result.stdout).items()}
+
+
+def cached_apply(tf_vars, terraform_dir=TERRAFORM_DIR, verify=True):
+    """
+    Applies the configuration only if Terraform would change something.
+
+    The configuration files and variables are fingerprinted. A saved plan is
+    made with `plan -detailed-exitcode`; when it reports no changes the apply is
+    skipped, and the outputs come from the local cache when this fingerprint was
+    applied before. Otherwise the saved plan is applied (no second plan) and its
+    outputs are cached under the fingerprint.
+
+    Args:
+        tf_vars (dict): Variables passed with -var.
+        terraform_dir (str): Directory holding the .tf files.
+        verify (bool): On a cache hit, still run the plan to catch drift in the
+            real infrastructure. With False a hit returns the cached outputs
+            without contacting AWS.
+
+    Returns:
+        dict: Output name -> value.
+
+    Raises:
+        subprocess.CalledProcessError: If a Terraform command fails.
+    """
+    started = time.perf_counter()
+    key = config_fingerprint(terraform_dir, tf_vars)
+    cached = load_cached_outputs(key)
+    if cached is not None and not verify:
+        print(f"Terraform cache hit ({key[:12]}); using cached outputs without planning.")
+        return cached
+    print(f"Terraform cache {'hit' if cached is not None else 'miss'} ({key[:12]}); planning...")
+
+    env = terraform_env()
+    var_args = [f"-var={name}={value}" for name, value in tf_vars.items()]
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    plan_path = os.path.join(CACHE_DIR, f"{key}.tfplan")
+    try:
+        with span("terraform.plan", cache_hit=cached is not None):
+            plan = subprocess.run(["terraform", "plan", "-detailed-exitcode", "-input=false", f"-out={plan_path}"]
+                                  + var_args, cwd=terraform_dir, env=env)
+        if plan.returncode == PLAN_NO_CHANGES:
+            if cached is not None:
+                print(f"No changes; reusing cached outputs ({time.perf_counter() - started:.1f} s).")
+                return cached
+            print("No changes; reading outputs.")
+        elif plan.returncode == PLAN_CHANGES:
+            print("\nApplying Terraform plan...")
+            with span("terraform.apply"):
+                subprocess.run(["terraform", "apply", "-input=false", plan_path], cwd=terraform_dir, env=env,
+                               check=True)
+        else:
+            raise subprocess.CalledProcessError(plan.returncode, plan.args)
+    finally:
+        if os.path.exists(plan_path):
+            os.remove(plan_path)
+
+    outputs = terraform_outputs(terraform_dir)
+    store_outputs(key, outputs)
+    print(f"Terraform finished in {time.perf_counter() - started:.1f} s; outputs cached under {key[:12]}.")
+    return outputs
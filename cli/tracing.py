@@ -0,0 +1,275 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Span:
+    """One timed operation; times are `time.perf_counter()` seconds."""
+
+    def __init__(self, span_id, name, parent_id, thread_id, start, attrs=None):
+        self.span_id = span_id
+        self.name = name
+        self.parent_id = parent_id
+        self.thread_id = thread_id
+        self.start = start
+        self.end = None
+        self.attrs = dict(attrs or {})
+        # AWS API operation ('ec2.RunInstances') -> [calls, retries]
+        self.aws = {}
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+
+class Tracer:
+    """
+    Records a tree of timed spans across threads.
+
+    Each thread has its own stack of open spans; a span opened on a thread with
+    no open span (e.g. a stage on a worker thread) becomes a child of the root
+    span, the first one opened. AWS API calls made while a span is open are
+    counted on it through the boto3 hooks installed by `instrument_boto3`.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._root_id = None
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self):
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def _new_span(self, name, start, attrs):
+        current = self.current()
+        with self._lock:
+            parent_id = current.span_id if current is not None else self._root_id
+            span = Span(len(self.spans), name, parent_id, threading.get_ident(), start, attrs)
+            self.spans.append(span)
+            if self._root_id is None:
+                self._root_id = span.span_id
+        return span
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        Times the enclosed block as a child of the current span. An exception is
+        recorded on the span and re-raised.
+        """
+        span = self._new_span(name, time.perf_counter(), attrs)
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.attrs["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end = time.perf_counter()
+            stack.pop()
+
+    def record(self, name, start, end, **attrs):
+        """
+        Adds an already finished span (e.g. a remote step timed from its output)
+        under the current span.
+        """
+        span = self._new_span(name, start, attrs)
+        span.end = end
+        return span
+
+    def count_aws_call(self, operation, retries):
+        span = self.current()
+        if span is None:
+            return
+        with self._lock:
+            counts = span.aws.setdefault(operation, [0, 0])
+            counts[0] += 1
+            counts[1] += retries
+
+    def reset(self):
+        with self._lock:
+            self.spans = []
+            self.origin = time.perf_counter()
+            self._root_id = None
+
+    def tree(self):
+        """
+        Returns the spans as nested dicts with millisecond times relative to the
+        tracer's start. `aws_calls`/`aws_retries` include the span's descendants.
+        """
+        children = {}
+        for span in self.spans:
+            children.setdefault(span.parent_id, []).append(span)
+
+        def build(span):
+            nodes = [build(child) for child in children.get(span.span_id, [])]
+            calls = sum(c for c, _ in span.aws.values()) + sum(n["aws_calls"] for n in nodes)
+            retries = sum(r for _, r in span.aws.values()) + sum(n["aws_retries"] for n in nodes)
+            node = {
+                "name": span.name,
+                "start_ms": round((span.start - self.origin) * 1000, 3),
+                "duration_ms": round(span.duration * 1000, 3),
+                "aws_calls": calls,
+                "aws_retries": retries,
+            }
+            if span.aws:
+                node["aws_operations"] = {op: {"calls": c, "retries": r} for op, (c, r) in sorted(span.aws.items())}
+            if span.attrs:
+                node["attrs"] = span.attrs
+            if nodes:
+                node["children"] = nodes
+            return node
+
+        return [build(span) for span in children.get(None, [])]
+
+    def chrome_trace(self):
+        """
+        Returns the spans as Chrome trace-event JSON (chrome://tracing, Perfetto):
+        one complete ('X') event per span on the thread that ran it.
+        """
+        pid = os.getpid()
+        thread_ids = {}
+        events = []
+        for span in self.spans:
+            tid = thread_ids.setdefault(span.thread_id, len(thread_ids) + 1)
+            args = dict(span.attrs)
+            if span.aws:
+                args["aws"] = {op: {"calls": c, "retries": r} for op, (c, r) in span.aws.items()}
+            events.append({
+                "name": span.name,
+                "ph": "X",
+                "ts": round((span.start - self.origin) * 1e6, 1),
+                "dur": round(span.duration * 1e6, 1),
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            })
+        for thread_id, tid in thread_ids.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                           "args": {"name": "main" if thread_id == threading.main_thread().ident else f"worker-{tid}"}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump({"spans": self.tree()}, f, indent=2, default=str)
+
+    def write_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+    def print_summary(self, max_depth=3):
+        """
+        Prints the span tree with durations and AWS call counts.
+        """
+        def show(node, depth):
+            aws = f"  [{node['aws_calls']} AWS calls, {node['aws_retries']} retries]" if node["aws_calls"] else ""
+            error = "  FAILED" if "error" in node.get("attrs", {}) else ""
+            print(f"{'  ' * depth}{node['name']:<{50 - 2 * depth}} {node['duration_ms'] / 1000:9.2f} s{aws}{error}")
+            if depth + 1 < max_depth:
+                for child in node.get("children", []):
+                    show(child, depth + 1)
+
+        for node in self.tree():
+            show(node, 0)
+
+
+# The tracer used by every instrumented module.
+tracer = Tracer()
+
+
+def span(name, **attrs):
+    """Shorthand for `tracer.span`."""
+    return tracer.span(name, **attrs)
+
+
+def traced(name=None):
+    """
+    Decorator timing every call of the function as a span named `name`
+    (default: module.function).
+    """
+    def decorate(func):
+        span_name = name or f"{func.__module__}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _operation(event_name):
+    # 'after-call.ec2.DescribeInstances' -> 'ec2.DescribeInstances'
+    return event_name.split(".", 1)[1]
+
+
+def _after_call(event_name, parsed=None, **kwargs):
+    retries = (parsed or {}).get("ResponseMetadata", {}).get("RetryAttempts", 0)
+    tracer.count_aws_call(_operation(event_name), retries)
+
+
+def _after_call_error(event_name, context=None, **kwargs):
+    # Emitted once the retries are exhausted on a transport-level failure (no
+    # HTTP response, so no `after-call`); botocore passes no operation model.
+    attempts = (context or {}).get("retries", {}).get("attempt", 1)
+    tracer.count_aws_call(_operation(event_name), max(attempts - 1, 0))
+
+
+def _instrument_session(botocore_session):
+    botocore_session.register("after-call", _after_call, unique_id="cloudfront-setup-tracing-after-call")
+    botocore_session.register("after-call-error", _after_call_error,
+                              unique_id="cloudfront-setup-tracing-after-call-error")
+    return botocore_session
+
+
+_instrumented = False
+
+
+def instrument_boto3():
+    """
+    Counts every AWS API call (and the retries botocore made for it) on the span
+    open in the calling thread, for all boto3 sessions created afterwards and the
+    default session. Safe to call more than once.
+    """
+    global _instrumented
+    import boto3
+    import botocore.session
+    if _instrumented:
+        return
+    _instrumented = True
+    get_session = botocore.session.get_session
+
+    @functools.wraps(get_session)
+    def get_instrumented_session(*args, **kwargs):
+        return _instrument_session(get_session(*args, **kwargs))
+
+    # boto3.Session() obtains its botocore session through this function.
+    botocore.session.get_session = get_instrumented_session
+    if boto3.DEFAULT_SESSION is not None:
+        _instrument_session(boto3.DEFAULT_SESSION._session)
+
+
+def export(path_prefix):
+    """
+    Writes `<prefix>.json` (span tree) and `<prefix>.trace.json` (Chrome trace).
+
+    Returns:
+        tuple: The two paths.
+    """
+    json_path, trace_path = f"{path_prefix}.json", f"{path_prefix}.trace.json"
+    os.makedirs(os.path.dirname(os.path.abspath(json_path)), exist_ok=True)
+    tracer.write_json(json_path)
+    tracer.write_chrome_trace(trace_path)
+    return json_path, trace_path
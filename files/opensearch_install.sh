@@ -1,85 +1,78 @@
 #!/bin/bash
+#
+# Idempotent: re-running on a host that is already set up installs nothing and
+# only touches the containers when docker-compose.yml changed since the last
+# successful start (or a container is not running).
 
-echo "Updating and installing Docker..."
-sudo apt-get update
-sudo apt-get install -y ca-certificates curl gnupg lsb-release
+STATE_DIR=/home/ubuntu/.cloudfront-setup
+COMPOSE_FILE=/home/ubuntu/docker-compose.yml
+APPLIED_HASH_FILE=$STATE_DIR/compose.sha256
 
-# Add Docker's official GPG key
-sudo mkdir -p /etc/apt/keyrings
-curl -fsSL https://download.docker.com/linux/ubuntu/gpg | sudo gpg --dearmor -o /etc/apt/keyrings/docker.gpg
+if sudo docker compose version > /dev/null 2>&1; then
+    echo "Docker and the Compose plugin are already installed."
+else
+    echo "Updating and installing Docker..."
+    sudo apt-get update
+    sudo apt-get install -y ca-certificates curl gnupg lsb-release
+
+    # Add Docker's official GPG key
+    sudo mkdir -p /etc/apt/keyrings
+    curl -fsSL https://download.docker.com/linux/ubuntu/gpg | sudo gpg --dearmor --yes -o /etc/apt/keyrings/docker.gpg
 
-# Set up the repository
-echo \
-  "deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.gpg] https://download.docker.com/linux/ubuntu \
-  $(lsb_release -cs) stable" | sudo tee /etc/apt/sources.list.d/docker.list > /dev/null
+    # Set up the repository
+    echo \
+      "deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.gpg] https://download.docker.com/linux/ubuntu \
+      $(lsb_release -cs) stable" | sudo tee /etc/apt/sources.list.d/docker.list > /dev/null
 
-sudo apt-get update
-sudo apt-get install -y docker-ce docker-ce-cli containerd.io docker-buildx-plugin docker-compose-plugin
+    sudo apt-get update
+    sudo apt-get install -y docker-ce docker-ce-cli containerd.io docker-buildx-plugin docker-compose-plugin
 
-echo "Adding ubuntu user to docker group..."
-sudo usermod -aG docker ubuntu
+    echo "Adding ubuntu user to docker group..."
+    sudo usermod -aG docker ubuntu
+fi
 
-# Ensure Docker service is running and enabled
-echo "Ensuring Docker service is running and restarting if needed..."
-# First, try to start/enable
-sudo systemctl start docker
-sudo systemctl enable docker
-# Then, forcefully restart to clear any lingering issues from previous failed states
-sudo systemctl restart docker
+# Start Docker if it is not running; a running daemon is left alone.
+sudo systemctl enable --now docker
 
-# Wait for Docker to be truly active and healthy
+# Wait for the Docker daemon to answer, probing with short, doubling delays
+# (0.25 s up to 4 s) within a 60 s deadline instead of fixed 5 s sleeps.
 echo "Waiting for Docker service to become active..."
-docker_attempts=0
-max_docker_attempts=10
-while [ $docker_attempts -lt $max_docker_attempts ]; do
-    if sudo systemctl is-active --quiet docker; then
-        echo "Docker service is active."
+docker_delay=0.25
+docker_deadline=$((SECONDS + 60))
+until sudo docker info > /dev/null 2>&1; do
+    if [ $SECONDS -ge $docker_deadline ]; then
         break
-    else
-        echo "Docker not active yet. Retrying in 5 seconds..."
-        sleep 5
-        docker_attempts=$((docker_attempts+1))
     fi
+    sleep $docker_delay
+    docker_delay=$(awk -v d="$docker_delay" 'BEGIN { d *= 2; print (d > 4 ? 4 : d) }')
 done
 
-if ! sudo systemctl is-active --quiet docker; then
+if ! sudo docker info > /dev/null 2>&1; then
     echo "ERROR: Docker service failed to start after multiple attempts. Please investigate manually."
     sudo systemctl status docker --no-pager # Print full status for debugging
     exit 1 # Exit script if Docker isn't running
 fi
 
-echo "Navigating to /home/ubuntu and checking files..."
 cd /home/ubuntu/ || { echo "ERROR: Failed to navigate to /home/ubuntu/. Exiting."; exit 1; }
+if [ ! -f "$COMPOSE_FILE" ]; then
+    echo "ERROR: $COMPOSE_FILE is missing."
+    exit 1
+fi
+install -d -o ubuntu -g ubuntu "$STATE_DIR"
 
-# --- DEBUGGING CHECKS (Keep these for now, they are useful) ---
-echo "Listing files in /home/ubuntu/:"
-ls -l /home/ubuntu/
-
-echo "Checking docker-compose.yml:"
-ls -l /home/ubuntu/docker-compose.yml
-cat /home/ubuntu/docker-compose.yml
-
-echo "Checking opensearch_dashboards.yml:"
-ls -l /home/ubuntu/opensearch_dashboards.yml
-cat /home/ubuntu/opensearch_dashboards.yml
-
-echo "Checking Docker Compose version:"
-sudo docker compose version
+compose_hash=$(sha256sum "$COMPOSE_FILE" | cut -d' ' -f1)
+services=$(sudo docker compose config --services | wc -l)
+running=$(sudo docker compose ps --status running --quiet | wc -l)
 
-echo "Checking Docker Info:"
-sudo docker info
-# --- END DEBUGGING CHECKS ---
+if [ -f "$APPLIED_HASH_FILE" ] && [ "$(cat "$APPLIED_HASH_FILE")" = "$compose_hash" ] && [ "$running" -eq "$services" ]; then
+    echo "docker-compose.yml unchanged and all $services containers running; nothing to do."
+    exit 0
+fi
 
 echo "Starting Docker Compose for OpenSearch and Dashboards..."
-# Check if containers are already running before trying to start
-if sudo docker ps -a --format '{{.Names}}' | grep -q 'opensearch' && \
-   sudo docker ps -a --format '{{.Names}}' | grep -q 'opensearch-dashboards'; then
-    echo "OpenSearch and Dashboards containers already exist. Attempting to restart..."
-    sudo docker compose down # Stop and remove old containers
-    sudo docker compose up -d # Start fresh
-else
-    echo "OpenSearch and Dashboards containers not found. Starting them for the first time..."
-    sudo docker compose up -d
-fi
+# 'up -d' recreates only services whose configuration changed and pulls only
+# images that are not present locally.
+sudo docker compose up -d --remove-orphans || exit 1
+echo "$compose_hash" > "$APPLIED_HASH_FILE"
 
 echo "Docker Compose for OpenSearch and Dashboards initiated."
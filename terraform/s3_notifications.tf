@@ -0,0 +1,82 @@
+# Follow mode: S3 sends an ObjectCreated notification for every new log object
+# to an SQS queue, which `cli/follow.py` consumes instead of polling the prefix.
+
+variable "enable_follow" {
+  description = "Create the SQS queue and S3 notification used by follow mode"
+  type        = bool
+  default     = false
+}
+
+variable "log_prefix" {
+  description = "Key prefix CloudFront writes its logs under"
+  type        = string
+  default     = "cloudfront-logs/"
+}
+
+locals {
+  # SQS names allow letters, digits, hyphens and underscores only.
+  log_events_queue = "${replace(var.bucket_name, ".", "-")}-log-events"
+}
+
+# Messages that keep failing (e.g. a corrupt object) end up here after 5 receives.
+resource "aws_sqs_queue" "log_events_dlq" {
+  count                     = var.enable_follow ? 1 : 0
+  name                      = "${local.log_events_queue}-dlq"
+  message_retention_seconds = 1209600
+}
+
+resource "aws_sqs_queue" "log_events" {
+  count                      = var.enable_follow ? 1 : 0
+  name                       = local.log_events_queue
+  visibility_timeout_seconds = 300
+  receive_wait_time_seconds  = 20
+  message_retention_seconds  = 345600
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.log_events_dlq[0].arn
+    maxReceiveCount     = 5
+  })
+}
+
+# Allow the log bucket, and only it, to publish to the queue.
+resource "aws_sqs_queue_policy" "log_events" {
+  count     = var.enable_follow ? 1 : 0
+  queue_url = aws_sqs_queue.log_events[0].id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Sid       = "AllowLogBucketNotifications"
+        Effect    = "Allow"
+        Principal = { Service = "s3.amazonaws.com" }
+        Action    = "sqs:SendMessage"
+        Resource  = aws_sqs_queue.log_events[0].arn
+        Condition = {
+          ArnEquals = {
+            "aws:SourceArn" = data.aws_s3_bucket.log_bucket.arn
+          }
+        }
+      }
+    ]
+  })
+}
+
+# Note: a bucket has a single notification configuration, so this replaces any
+# notifications configured on the log bucket outside Terraform.
+resource "aws_s3_bucket_notification" "log_events" {
+  count  = var.enable_follow ? 1 : 0
+  bucket = var.bucket_name
+
+  queue {
+    queue_arn     = aws_sqs_queue.log_events[0].arn
+    events        = ["s3:ObjectCreated:*"]
+    filter_prefix = var.log_prefix
+  }
+
+  depends_on = [aws_sqs_queue_policy.log_events]
+}
+
+output "follow_queue_url" {
+  value = var.enable_follow ? aws_sqs_queue.log_events[0].id : ""
+}
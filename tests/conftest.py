@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The cli modules import each other by bare name, as when run from cli/.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "cli"))
@@ -0,0 +1,43 @@
+from dedup import DedupFilter, hash_strings
+from logparser import parse_chunk
+from test_ingest import log_chunk
+
+
+def ids(*values):
+    return hash_strings(list(values))
+
+
+def test_staged_ids_are_seen_in_run_but_not_persisted(tmp_path):
+    with DedupFilter(str(tmp_path), memory_mb=1) as dedup:
+        assert dedup.check_and_stage(ids("a", "b", "a")).tolist() == [True, True, False]
+        assert dedup.check_and_stage(ids("b", "c")).tolist() == [False, True]
+        assert dedup.pending == 3
+    with DedupFilter(str(tmp_path)) as dedup:
+        assert dedup.check_and_stage(ids("a", "b", "c")).all()
+
+
+def test_commit_persists_staged_ids(tmp_path):
+    with DedupFilter(str(tmp_path), memory_mb=1) as dedup:
+        dedup.check_and_stage(ids("a", "b"))
+        dedup.commit()
+        assert dedup.pending == 0
+    with DedupFilter(str(tmp_path)) as dedup:
+        assert dedup.check_and_stage(ids("a", "b", "c")).tolist() == [False, False, True]
+
+
+def test_discard_forgets_staged_ids(tmp_path):
+    with DedupFilter(str(tmp_path), memory_mb=1) as dedup:
+        dedup.check_and_add(ids("kept"))
+        dedup.check_and_stage(ids("lost"))
+        dedup.discard()
+        assert dedup.pending == 0
+        assert dedup.check_and_stage(ids("kept", "lost")).tolist() == [False, True]
+
+
+def test_filter_batch_keeps_records_without_request_id(tmp_path):
+    batch = parse_chunk(log_chunk({"x-edge-request-id": "one=="}, {"x-edge-request-id": "-"},
+                                  {"x-edge-request-id": "one=="}, {"x-edge-request-id": "-"}))
+    with DedupFilter(str(tmp_path), memory_mb=1) as dedup:
+        kept = dedup.filter_batch(batch)
+        assert kept["x-edge-request-id"].tolist() == ["one==", "-", "-"]
+        assert len(dedup.filter_batch(batch)) == 2
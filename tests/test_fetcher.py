@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+import fetcher
+from awsclients import clients
+from fetcher import FetchManifest, fetch_new_logs
+
+moto = pytest.importorskip("moto")
+
+BUCKET = "cf-logs-test"
+DAYS = ("2026-09-01", "2026-09-10", "2026-10-17")
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name, value in (("AWS_ACCESS_KEY_ID", "testing"), ("AWS_SECRET_ACCESS_KEY", "testing"),
+                        ("AWS_DEFAULT_REGION", "us-east-1")):
+        monkeypatch.setenv(name, value)
+    with moto.mock_aws():
+        clients.clear()
+        client = clients.client("s3", "us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+    clients.clear()
+
+
+def put_logs(s3, distributions):
+    keys = [f"cloudfront-logs/{distribution}.{day}-00.abc.gz" for distribution in distributions for day in DAYS]
+    for key in keys:
+        s3.put_object(Bucket=BUCKET, Key=key, Body=b"log")
+    return keys
+
+
+def fetch(tmp_path):
+    paths = fetch_new_logs("us-east-1", BUCKET, str(tmp_path / "logs"),
+                           manifest_path=str(tmp_path / "manifest.json"), max_workers=4)
+    return sorted(os.path.basename(path) for path in paths)
+
+
+def test_resume_after_crash_fetches_other_distributions(s3, tmp_path):
+    keys = put_logs(s3, ("EAAA", "EBBB"))
+    # A run that crashed after journaling EAAA's objects only.
+    manifest = FetchManifest(str(tmp_path / "manifest.json"))
+    for key in keys[:3]:
+        manifest.record(key, s3.head_object(Bucket=BUCKET, Key=key)["ETag"], "2026-10-17T00:00:00+00:00", "/x")
+
+    assert fetch(tmp_path) == [f"EBBB.{day}-00.abc.gz" for day in DAYS]
+    assert fetch(tmp_path) == []
+    watermarks = FetchManifest(str(tmp_path / "manifest.json")).watermarks
+    assert {distribution: watermark["date"] for distribution, watermark in watermarks.items()} == {
+        "EAAA": "2026-10-17", "EBBB": "2026-10-17"}
+
+
+def test_failed_download_is_retried_on_next_run(s3, tmp_path, monkeypatch):
+    put_logs(s3, ("EAAA",))
+    download = fetcher.download_object
+
+    def flaky(s3, bucket, obj, *args, **kwargs):
+        if "2026-09-01" in obj["Key"]:
+            raise OSError("connection reset")
+        return download(s3, bucket, obj, *args, **kwargs)
+
+    monkeypatch.setattr(fetcher, "download_object", flaky)
+    assert fetch(tmp_path) == [f"EAAA.{day}-00.abc.gz" for day in DAYS[1:]]
+    assert FetchManifest(str(tmp_path / "manifest.json")).watermark("EAAA") == {}
+
+    monkeypatch.setattr(fetcher, "download_object", download)
+    assert fetch(tmp_path) == ["EAAA.2026-09-01-00.abc.gz"]
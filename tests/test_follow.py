@@ -0,0 +1,28 @@
+import json
+
+from follow import parse_notification
+
+S3_EVENT = {"Records": [
+    {"eventName": "ObjectCreated:Put", "eventTime": "2026-10-17T13:05:42.123Z",
+     "s3": {"bucket": {"name": "cf-logs"}, "object": {"key": "cloudfront-logs/E1.2026-10-17-13.abc%2B1.gz"}}},
+    {"eventName": "ObjectRemoved:Delete", "eventTime": "2026-10-17T13:06:00.000Z",
+     "s3": {"bucket": {"name": "cf-logs"}, "object": {"key": "cloudfront-logs/E1.2026-10-17-12.old.gz"}}},
+]}
+
+
+def test_direct_s3_notification():
+    assert parse_notification(json.dumps(S3_EVENT)) == [
+        ("cf-logs", "cloudfront-logs/E1.2026-10-17-13.abc+1.gz", 1792242342.123)]
+
+
+def test_sns_wrapped_notification():
+    envelope = {"Type": "Notification", "TopicArn": "arn:aws:sns:us-east-1:123456789012:logs",
+                "Message": json.dumps(S3_EVENT)}
+    assert parse_notification(json.dumps(envelope)) == parse_notification(json.dumps(S3_EVENT))
+
+
+def test_test_events_have_no_objects():
+    test_event = {"Service": "Amazon S3", "Event": "s3:TestEvent", "Time": "2026-10-17T13:00:00.000Z",
+                  "Bucket": "cf-logs"}
+    assert parse_notification(json.dumps(test_event)) == []
+    assert parse_notification(json.dumps({"Type": "Notification", "Message": json.dumps(test_event)})) == []
@@ -0,0 +1,58 @@
+from ingest import build_batch_actions, build_bulk_actions
+from logparser import CLOUDFRONT_FIELDS, parse_chunk
+
+DEFAULTS = {
+    "date": "2026-10-17", "time": "13:05:42", "x-edge-location": "FRA56-P1", "sc-bytes": "5120",
+    "c-ip": "192.0.2.10", "cs-method": "GET", "cs(Host)": "d111111abcdef8.cloudfront.net",
+    "cs-uri-stem": "/static/app.js", "sc-status": "200", "cs(Referer)": "-",
+    "cs(User-Agent)": "Mozilla/5.0%20(X11)", "cs-uri-query": "-", "cs(Cookie)": "-",
+    "x-edge-result-type": "Hit", "x-edge-request-id": "abcDEF123ghiJKL456==",
+    "x-host-header": "example.com", "cs-protocol": "https", "cs-bytes": "312", "time-taken": "0.002",
+    "x-forwarded-for": "-", "ssl-protocol": "TLSv1.3", "ssl-cipher": "TLS_AES_128_GCM_SHA256",
+    "x-edge-response-result-type": "Hit", "cs-protocol-version": "HTTP/2.0", "fle-status": "-",
+    "fle-encrypted-fields": "-", "c-port": "51234", "time-to-first-byte": "0.001",
+    "x-edge-detailed-result-type": "Hit", "sc-content-type": "application/javascript",
+    "sc-content-len": "5120", "sc-range-start": "-", "sc-range-end": "-",
+}
+
+
+def log_chunk(*records):
+    lines = ["\t".join(dict(DEFAULTS, **record)[name] for name in CLOUDFRONT_FIELDS) for record in records]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def assert_same_actions(data, granularity="daily"):
+    batch = parse_chunk(data)
+    expected = b"".join(build_bulk_actions(batch.iter_docs(), "cloudfront-logs", granularity))
+    assert b"".join(build_batch_actions(batch, "cloudfront-logs", granularity)) == expected
+
+
+def test_batch_actions_match_per_document_encoding():
+    assert_same_actions(log_chunk(
+        {},
+        {"cs-uri-query": "v=2&lang=en", "x-edge-request-id": "zzz999==", "time": "23:59:59"},
+        {"sc-bytes": "-", "time-taken": "-", "sc-range-start": "0", "sc-range-end": "1023"},
+        {"x-edge-request-id": "-", "date": "2026-10-18", "time": "00:00:01"},
+        {"cs(Referer)": "", "sc-status": "000"},
+    ))
+
+
+def test_batch_actions_match_for_hourly_and_unrouted_indices():
+    data = log_chunk({}, {"time": "07:00:00", "x-edge-request-id": "other=="}, {"cs-uri-query": "a=b"})
+    assert_same_actions(data, "hourly")
+    assert_same_actions(data, None)
+
+
+def test_batch_actions_match_on_values_json_escapes():
+    # Quotes, backslashes and non-ASCII take the per-document fallback.
+    assert_same_actions(log_chunk(
+        {"cs(User-Agent)": 'curl/8.0 "quoted"'},
+        {"cs-uri-stem": "/café\\menu"},
+    ))
+
+
+def test_batch_actions_match_after_take():
+    batch = parse_chunk(log_chunk({}, {"x-edge-request-id": "b=="}, {"cs-uri-query": "x=1"}, {"x-edge-request-id": "d=="}))
+    subset = batch.take([3, 0, 2])
+    expected = b"".join(build_bulk_actions(subset.iter_docs()))
+    assert b"".join(build_batch_actions(subset)) == expected